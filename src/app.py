@@ -1,23 +1,41 @@
+import concurrent.futures
+import dataclasses
+import itertools
 import os
+import threading
 from typing import TypedDict
 
 import structlog
-from langchain.schema import Document
-from langgraph.graph import END, StateGraph
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
 
+import document_grading
 import document_search
+import embedding_util
+import http_util
+import instrumentation
+import lazy_import
 import llm_util
 import printing
+import query_cache
 from document_grading import DocumentGrader, DocumentGradingTool
+from instrumentation import Metrics
 from query_translation import QueryTranslationTool, QueryTranslator
 
 logger = structlog.get_logger(__name__)
 
+# the graph is only needed by `search` and `asearch`
+langgraph_graph = lazy_import.LazyModule("langgraph.graph")
+
+_COMPONENTS = {}
+_COMPONENTS_LOCK = threading.Lock()
+
 
 class GraphState(TypedDict):
     input_sentence: str
     query_strings: list[str]
     docs: list[Document]
+    metrics: Metrics
 
 
 class CitationFinder:
@@ -28,51 +46,305 @@ class CitationFinder:
             _set_langchain_env(config)
 
         self.config = config
-        self.app = self._build_app()
+        components = _get_components(config)
+        self.llm_scheduler = components.llm_scheduler
+        self.query_translator = components.query_translator
+        self.document_grader = components.document_grader
+        self._graph = components.graph
 
-    def _build_app(self):
-        # fetch system prompts
-        query_translator_prompt = llm_util.read_system_prompt("query_translation.txt")
-        document_grader_prompt = llm_util.read_system_prompt("document_grading.txt")
-        # init query translator
-        query_translator_runnable = llm_util.init_assistant_runnable(
-            query_translator_prompt, tools=QueryTranslationTool, config=self.config
-        )
-        query_translator = QueryTranslator(query_translator_runnable)
-        # init document grader
-        document_grader_runnable = llm_util.init_assistant_runnable(
-            document_grader_prompt, tools=DocumentGradingTool, config=self.config
+    @property
+    def app(self):
+        """
+        The compiled LangGraph app, built on first use.
+        """
+        return self._graph.get()
+
+    def warm_up(self, background=False):
+        """
+        Import the lazily imported dependencies and create the clients used by a
+        search ahead of time, so that the first search doesn't wait for them.
+
+        Parameters:
+        background (bool): Whether to only import the dependencies in a background
+                           thread, e.g. while the first query is being translated,
+                           instead of blocking until everything is ready.
+
+        Returns:
+        threading.Thread or None: The importing thread if `background` is True.
+        """
+        thread = lazy_import.preload(_lazy_modules(self.config))
+        if background:
+            return thread
+        thread.join()
+        self.query_translator.runnable.get()
+        self.document_grader.runnable.get()
+        embedding_util.init_embeddings(self.config)
+        http_util.get_http_client(self.config)
+        document_search.warm_up(self.config)
+        self._graph.get()
+        logger.debug(f"Warmed up, import times: {lazy_import.import_times()}")
+
+    def _log_stats(self, metrics):
+        logger.debug(f"LLM scheduler stats: {self.llm_scheduler.stats()}")
+        logger.debug(f"Stage metrics: {metrics.to_dict()}")
+
+    def search(self, input_sentence, return_mode="print"):
+        assert return_mode in ["print", "return"]
+        logger.info(f"Searching citations for input sentence '{input_sentence}'")
+        metrics = Metrics()
+        final_state = self.app.invoke(
+            {"input_sentence": input_sentence, "metrics": metrics}
         )
-        document_grader = DocumentGrader(document_grader_runnable)
-        # init document search
-        doc_search_func = (
-            lambda state: document_search.document_search(state, self.config)
+        self._log_stats(metrics)
+        if return_mode == "print":
+            printing.print_output(final_state)
+        elif return_mode == "return":
+            return final_state
+
+    def search_many(self, input_sentences, return_mode="print"):
+        """
+        Search citations for many input sentences at once. Query strings and articles
+        shared between sentences are searched, scraped and embedded only once, after
+        which retrieval and grading are done separately for each sentence.
+
+        Parameters:
+        input_sentences (list[str]): The sentences to search citations for.
+        return_mode (str): Whether to "print" or "return" the results.
+
+        Returns:
+        list[GraphState] or None: The final state of each input sentence, in input
+                                  order, if `return_mode` is "return". The states
+                                  share the Metrics of the whole batch.
+        """
+        assert return_mode in ["print", "return"]
+        unique_sentences = list(dict.fromkeys(input_sentences))
+        logger.info(
+            f"Searching citations for {len(unique_sentences)} unique input sentences"
         )
-        # build app
-        builder = StateGraph(GraphState)
+        metrics = Metrics()
+        states = [
+            {"input_sentence": sentence, "metrics": metrics}
+            for sentence in unique_sentences
+        ]
+        with metrics.stage("query_translator"):
+            translate = instrumentation.bind(self.query_translator)
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.config.max_concurrent_sentences
+            ) as executor:
+                translated = list(executor.map(translate, states))
+        states = [{**state, **update} for state, update in zip(states, translated)]
 
-        builder.add_node("query_translator", query_translator)
-        builder.add_node("document_grader", document_grader)
-        builder.add_node("document_search", doc_search_func)
+        with metrics.stage("document_search"):
+            searched = document_search.document_search_many(states, self.config)
+        states = [{**state, **update} for state, update in zip(states, searched)]
 
-        builder.set_entry_point("query_translator")
-        builder.add_edge("query_translator", "document_search")
-        builder.add_edge("document_search", "document_grader")
-        builder.add_edge("document_grader", END)
+        with metrics.stage("document_grader"):
+            graded = self.document_grader.grade_many(states)
+        states = [{**state, **update} for state, update in zip(states, graded)]
 
-        app = builder.compile()
+        final_states = {state["input_sentence"]: state for state in states}
+        final_states = [final_states[sentence] for sentence in input_sentences]
+        self._log_stats(metrics)
+        if return_mode == "print":
+            printing.print_many_outputs(final_states)
+        elif return_mode == "return":
+            return final_states
 
-        return app
+    def search_stream(self, input_sentence, metrics=None):
+        """
+        Search citations for an input sentence, yielding each citation as soon as it
+        has been confirmed relevant. Articles are embedded as they are scraped and
+        documents are graded concurrently, so the first citations arrive before the
+        whole search has completed.
 
-    def search(self, input_sentence, return_mode="print"):
+        Parameters:
+        input_sentence (str): The sentence to search citations for.
+        metrics (Metrics or None): Metrics to record the stages of the search into.
+                                   Time spent by the caller between citations is
+                                   not counted.
+
+        Yields:
+        Document: Relevant documents with the supporting quote in the
+                  'supporting_quote' metadata field.
+        """
+        logger.info(f"Streaming citations for input sentence '{input_sentence}'")
+        metrics = metrics if metrics is not None else Metrics()
+        state = {"input_sentence": input_sentence}
+        with metrics.stage("query_translator"):
+            state.update(self.query_translator(state))
+        with metrics.stage("document_search"):
+            state.update(document_search.stream_document_search(state, self.config))
+        relevant_docs = self.document_grader.iter_grade(state)
+        for i in itertools.count():
+            # the stage must not stay entered while the caller handles a citation
+            with metrics.stage("document_grader", count_call=i == 0):
+                doc = next(relevant_docs, None)
+            if doc is None:
+                break
+            yield doc
+        self._log_stats(metrics)
+
+    async def asearch(self, input_sentence, return_mode="print"):
         assert return_mode in ["print", "return"]
         logger.info(f"Searching citations for input sentence '{input_sentence}'")
-        final_state = self.app.invoke({"input_sentence": input_sentence})
+        metrics = Metrics()
+        final_state = await self.app.ainvoke(
+            {"input_sentence": input_sentence, "metrics": metrics}
+        )
+        self._log_stats(metrics)
         if return_mode == "print":
             printing.print_output(final_state)
         elif return_mode == "return":
             return final_state
 
+    async def aclose(self):
+        """
+        Close the async HTTP clients that `asearch` opened in the running event loop.
+        Must be awaited before the loop is closed, e.g. at the end of the coroutine
+        passed to `asyncio.run`, or by using the CitationFinder as an async context
+        manager.
+        """
+        await http_util.aclose_async_http_clients()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+
+class _Components:
+    """
+    The parts of a CitationFinder that are expensive to create, shared by all
+    CitationFinders of the same Config in the process. The language model clients and
+    the graph are only created on first use.
+    """
+
+    def __init__(self, config):
+        # fetch system prompts
+        query_translator_prompt = llm_util.read_system_prompt("query_translation.txt")
+        document_grader_prompt = llm_util.read_system_prompt("document_grading.txt")
+        # all language model calls share one scheduler
+        self.llm_scheduler = llm_util.get_llm_scheduler(config)
+        # init query translator
+        query_translator_runnable = lazy_import.LazyObject(
+            lambda: llm_util.init_assistant_runnable(
+                query_translator_prompt, tools=QueryTranslationTool, config=config
+            )
+        )
+        query_cache_embeddings = (
+            embedding_util.init_embeddings(config)
+            if config.query_cache_similarity_threshold is not None
+            else None
+        )
+        translation_cache = query_cache.get_query_cache(
+            config, query_translator_prompt, query_cache_embeddings
+        )
+        self.query_translator = QueryTranslator(
+            query_translator_runnable,
+            cache=translation_cache,
+            scheduler=self.llm_scheduler,
+            system_prompt=query_translator_prompt,
+        )
+        # init document grader
+        document_grader_runnable = lazy_import.LazyObject(
+            lambda: llm_util.init_assistant_runnable(
+                document_grader_prompt, tools=DocumentGradingTool, config=config
+            )
+        )
+        self.document_grader = DocumentGrader(
+            document_grader_runnable,
+            max_concurrency=config.max_concurrent_gradings,
+            max_retries=config.grading_max_retries,
+            cache=document_grading.get_verdict_cache(config, document_grader_prompt),
+            scheduler=self.llm_scheduler,
+            system_prompt=document_grader_prompt,
+        )
+        self.graph = lazy_import.LazyObject(
+            lambda: _build_graph(self.query_translator, self.document_grader, config)
+        )
+
+
+def _lazy_modules(config):
+    # modules imported on first use by a search, in the order they are needed
+    modules = ["langchain_openai", "langgraph.graph"]
+    if config.html_parser == "lxml":
+        modules.append("lxml.html")
+    if config.embedding_backend == "local" or config.reranker == "cross_encoder":
+        modules.append("sentence_transformers")
+    if config.vectorstore_backend == "chroma":
+        modules.extend(["langchain_community.vectorstores", "chromadb"])
+    return modules
+
+
+def _get_components(config):
+    key = dataclasses.astuple(config)
+    with _COMPONENTS_LOCK:
+        if key not in _COMPONENTS:
+            _COMPONENTS[key] = _Components(config)
+        return _COMPONENTS[key]
+
+
+def _build_graph(query_translator, document_grader, config):
+    # init document search
+    doc_search_func = lambda state: document_search.document_search(state, config)
+    adoc_search_func = lambda state: document_search.adocument_search(state, config)
+    # build app, each node has a sync and an async implementation so that the app
+    # can be run with both `invoke` and `ainvoke`
+    builder = langgraph_graph.StateGraph(GraphState)
+
+    builder.add_node(
+        "query_translator",
+        _instrumented_node(
+            "query_translator", query_translator.__call__, query_translator.acall
+        )
+    )
+    builder.add_node(
+        "document_grader",
+        _instrumented_node(
+            "document_grader", document_grader.__call__, document_grader.acall
+        )
+    )
+    builder.add_node(
+        "document_search",
+        _instrumented_node("document_search", doc_search_func, adoc_search_func)
+    )
+
+    builder.set_entry_point("query_translator")
+    builder.add_edge("query_translator", "document_search")
+    builder.add_edge("document_search", "document_grader")
+    builder.add_edge("document_grader", langgraph_graph.END)
+
+    app = builder.compile()
+    logger.debug("Compiled the app graph")
+
+    return app
+
+
+def _instrumented_node(name, func, afunc):
+    """
+    Wrap the sync and async implementations of a graph node into a runnable that
+    measures the node as a stage of the Metrics in the graph state.
+
+    Parameters:
+    name (str): Name of the node.
+    func (callable): The sync implementation.
+    afunc (callable): The async implementation.
+
+    Returns:
+    RunnableLambda: The node runnable.
+    """
+
+    def run(state):
+        with instrumentation.stage(name, state.get("metrics")):
+            return func(state)
+
+    async def arun(state):
+        with instrumentation.stage(name, state.get("metrics")):
+            return await afunc(state)
+
+    return RunnableLambda(run, afunc=arun)
+
 
 def _check_openai_env():
     if os.environ.get("OPENAI_API_KEY") is None:
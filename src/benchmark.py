@@ -0,0 +1,958 @@
+import argparse
+import ast
+import asyncio
+import hashlib
+import http.server
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+import zlib
+
+import numpy as np
+import structlog
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+import embedding_util
+import http_util
+import instrumentation
+import llm_util
+import pubmed
+import rate_limiting
+from config import Config
+from instrumentation import Metrics
+
+logger = structlog.get_logger(__name__)
+
+
+VOCABULARY = [
+    "covid", "myocarditis", "arrhythmia", "hypertension", "diabetes", "obesity",
+    "insulin", "statin", "cholesterol", "stroke", "thrombosis", "inflammation",
+    "cytokine", "vaccine", "antibody", "infection", "sepsis", "pneumonia", "asthma",
+    "fibrosis", "kidney", "liver", "cirrhosis", "dementia", "alzheimer", "depression",
+    "anxiety", "sleep", "exercise", "smoking", "alcohol", "pregnancy", "preeclampsia",
+    "neonatal", "pediatric", "elderly", "mortality", "hospitalization", "biomarker",
+    "troponin", "metformin", "aspirin", "anticoagulant", "chemotherapy", "tumor",
+    "melanoma", "leukemia", "lymphoma", "microbiome", "probiotic", "vitamin",
+    "deficiency", "osteoporosis", "fracture", "arthritis", "psoriasis", "eczema",
+    "allergy", "influenza", "tuberculosis", "malaria", "hepatitis", "hiv",
+    "transplant", "dialysis", "glucose", "lipid", "endothelial", "oxidative",
+    "mitochondrial", "genetic", "mutation", "expression", "receptor", "pathway",
+]
+FILLER_WORDS = [
+    "the", "of", "in", "and", "with", "was", "were", "patients", "study", "risk",
+    "increased", "reduced", "associated", "significant", "cohort", "analysis",
+    "compared", "group", "outcome", "effect", "observed", "results", "clinical",
+    "trial", "data", "levels", "response", "treatment", "years", "controls",
+]
+SENTENCE_TEMPLATES = [
+    "{0} increases the risk of {1} in patients with {2}",
+    "{0} is associated with reduced {1} among {2} cohorts",
+    "Treatment with {0} lowers {1} and improves {2} outcomes",
+    "{0} levels predict {1} after {2}",
+]
+N_QUERY_STRINGS = 3
+
+ARTICLE_TEMPLATE = """<html><body>
+<h1 class="content-title">{title}</h1>
+<span class="doi"><a>10.5555/benchmark.{pmid}</a></span>
+<span class="fm-vol-iss-date">Published online {year} Jan 5.</span>
+<div class="contrib-group fm-author">{authors}</div>
+<div id="abstract-1"><p>{abstract}</p></div>
+<div class="tsec sec">{paragraphs}</div>
+</body></html>"""
+SEARCH_RESULT_TEMPLATE = (
+    '<article class="full-docsum"><a class="docsum-title" data-article-id="{pmid}">'
+    "{title}</a>{free}</article>"
+)
+FREE_ARTICLE_TAG = (
+    '<span class="free-resources spaced-citation-item citation-part">'
+    "Free PMC article.</span>"
+)
+# the stub's PMCIDs are the PMIDs shifted by a constant, so that they can be mapped
+# back without state
+PMCID_OFFSET = 100000000
+EUTILS_TERM_PATTERN = re.compile(r"\((.*)\) AND pubmed pmc\[sb\]")
+
+
+def _fixture_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def _rng(*seed):
+    # str seeds are hashed deterministically, unlike `hash`, which is salted
+    return random.Random(":".join(str(part) for part in seed))
+
+
+def _jats_article(article, pmid, pmcid):
+    element = ET.Element("article")
+    meta = ET.SubElement(ET.SubElement(element, "front"), "article-meta")
+    for id_type, value in (("pmid", pmid), ("pmc", pmcid), ("doi", article.doi)):
+        if value is not None:
+            ET.SubElement(meta, "article-id", {"pub-id-type": id_type}).text = value
+    title_group = ET.SubElement(meta, "title-group")
+    ET.SubElement(title_group, "article-title").text = article.title
+    contrib_group = ET.SubElement(meta, "contrib-group")
+    for author in article.authors or []:
+        contrib = ET.SubElement(contrib_group, "contrib", {"contrib-type": "author"})
+        name = ET.SubElement(contrib, "name")
+        given_names, _, surname = author.rpartition(" ")
+        if given_names:
+            ET.SubElement(name, "given-names").text = given_names
+        ET.SubElement(name, "surname").text = surname
+    if article.publication_year is not None:
+        pub_date = ET.SubElement(meta, "pub-date", {"pub-type": "epub"})
+        ET.SubElement(pub_date, "year").text = str(article.publication_year)
+    if article.abstract is not None:
+        abstract = ET.SubElement(meta, "abstract")
+        for paragraph in article.abstract.split("\n\n"):
+            ET.SubElement(abstract, "p").text = paragraph
+    body = ET.SubElement(element, "body")
+    for text in article.texts:
+        ET.SubElement(body, "p").text = text
+    return element
+
+
+class FixtureStore:
+    """
+    The PubMed pages replayed by the stub server. Pages recorded with
+    `record_fixtures` are read from the fixture directory, and query strings that
+    have not been recorded are served one of the recorded search pages. Without
+    recorded pages, pages are generated deterministically from the query string or
+    PMID, so that every run of a scenario sees the same articles.
+
+    The E-utilities responses are derived from the same pages, so that both PubMed
+    backends find the same articles.
+    """
+
+    def __init__(
+        self,
+        directory=None,
+        n_articles=5000,
+        n_paragraphs=30,
+        free_fraction=0.7,
+        seed=0,
+    ):
+        self.directory = directory
+        self.n_articles = n_articles
+        self.n_paragraphs = n_paragraphs
+        self.free_fraction = free_fraction
+        self.seed = seed
+        search_dir = os.path.join(directory or "", "search")
+        self.recorded_search_keys = (
+            sorted(name[:-len(".html")] for name in os.listdir(search_dir))
+            if directory is not None and os.path.isdir(search_dir)
+            else []
+        )
+
+    def _read(self, kind, key):
+        if self.directory is None:
+            return None
+        path = os.path.join(self.directory, kind, f"{key}.html")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def _text(self, rng, n_words):
+        words = [
+            rng.choice(VOCABULARY) if rng.random() < 0.3 else rng.choice(FILLER_WORDS)
+            for _ in range(n_words)
+        ]
+        return " ".join(words).capitalize() + "."
+
+    def search_page(self, query_string):
+        rng = _rng(self.seed, "search", query_string)
+        if self.recorded_search_keys:
+            key = _fixture_key(query_string)
+            if key not in self.recorded_search_keys:
+                key = rng.choice(self.recorded_search_keys)
+            return self._read("search", key)
+        # PubMed returns up to 200 results per page, of which only some are free
+        pmids = rng.sample(range(self.n_articles), min(200, self.n_articles))
+        results = "".join(
+            SEARCH_RESULT_TEMPLATE.format(
+                pmid=30000000 + pmid,
+                title=self._text(rng, 8),
+                free=FREE_ARTICLE_TAG if rng.random() < self.free_fraction else "",
+            )
+            for pmid in pmids
+        )
+        return f"<html><body>{results}</body></html>"
+
+    def article_page(self, pmid):
+        recorded = self._read("articles", pmid)
+        if recorded is not None:
+            return recorded
+        rng = _rng(self.seed, "article", pmid)
+        paragraphs = []
+        for _ in range(self.n_paragraphs):
+            paragraph = " ".join(
+                self._text(rng, rng.randint(10, 25)) for _ in range(rng.randint(2, 6))
+            )
+            paragraphs.append(paragraph)
+            # footnotes and figure captions often repeat a paragraph
+            if rng.random() < 0.05:
+                paragraphs.append(paragraph)
+        return ARTICLE_TEMPLATE.format(
+            title=self._text(rng, 10),
+            pmid=pmid,
+            year=rng.randint(1990, 2024),
+            authors="".join(f"<a>Author {rng.randint(1, 999)}</a>" for _ in range(4)),
+            abstract=self._text(rng, 120),
+            paragraphs="".join(f"<p>{paragraph}</p>" for paragraph in paragraphs),
+        )
+
+    def esearch(self, term, retmax):
+        match = EUTILS_TERM_PATTERN.fullmatch(term)
+        query_string = match.group(1) if match else term
+        urls = pubmed._parse_search_results(
+            self.search_page(query_string), retmax, query_string
+        )
+        pmids = [pubmed._pmid_from_url(url) for url in urls]
+        return json.dumps({"esearchresult": {"idlist": pmids}})
+
+    def elink(self, pmids):
+        linksets = [
+            {
+                "dbfrom": "pubmed",
+                "ids": [pmid],
+                "linksetdbs": [
+                    {
+                        "dbto": "pmc",
+                        "linkname": "pubmed_pmc",
+                        "links": [str(int(pmid) + PMCID_OFFSET)],
+                    }
+                ],
+            }
+            for pmid in pmids
+        ]
+        return json.dumps({"linksets": linksets})
+
+    def efetch(self, pmcids):
+        root = ET.Element("pmc-articleset")
+        for pmcid in pmcids:
+            pmid = str(int(pmcid) - PMCID_OFFSET)
+            article = pubmed._parse_article_html(self.article_page(pmid), "")
+            root.append(_jats_article(article, pmid, pmcid))
+        return ET.tostring(root, encoding="unicode")
+
+
+class _StubHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        store = self.server.store
+        content_type = "text/html; charset=utf-8"
+        if url.path.startswith("/pmid/"):
+            body = store.article_page(url.path.rstrip("/").rsplit("/", 1)[-1])
+        elif url.path == "/":
+            body = store.search_page(params.get("term", [""])[0])
+        elif url.path == "/eutils/esearch.fcgi":
+            body = store.esearch(params["term"][0], int(params["retmax"][0]))
+            content_type = "application/json"
+        elif url.path == "/eutils/elink.fcgi":
+            body = store.elink(params["id"])
+            content_type = "application/json"
+        elif url.path == "/eutils/efetch.fcgi":
+            body = store.efetch(params["id"][0].split(","))
+            content_type = "application/xml"
+        else:
+            self.send_error(404)
+            return
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        content = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve(store, latency, ports):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    server.daemon_threads = True
+    server.store = store
+    server.latency = latency
+    ports.put(server.server_port)
+    server.serve_forever()
+
+
+def start_stub_server(store, latency=0.0):
+    """
+    Start a local HTTP server replaying PubMed search and article pages and
+    E-utilities responses, and point the PubMed scraper at it. The server runs in its
+    own process, so that generating pages doesn't take CPU time from the benchmarked
+    process.
+
+    Parameters:
+    store (FixtureStore): The pages to serve.
+    latency (float): Seconds each response is delayed by, to emulate the network.
+
+    Returns:
+    tuple: The server process and the base URL of the E-utilities API, to be set
+           as `Config.eutils_base_url`.
+    """
+    context = multiprocessing.get_context("spawn")
+    ports = context.Queue()
+    process = context.Process(
+        target=_serve, args=(store, latency, ports), daemon=True
+    )
+    process.start()
+    base_url = f"http://127.0.0.1:{ports.get(timeout=60)}/"
+    pubmed.SEARCH_BASE_URL = base_url
+    pubmed.ARTICLE_BASE_URL = base_url + "pmid/"
+    return process, base_url + "eutils/"
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic embeddings hashing the words of a text into a fixed number of
+    buckets, so that texts sharing words are similar, with a configurable latency
+    per request and per text to emulate a remote embedding API.
+    """
+
+    def __init__(self, dim=256, request_latency=0.0, text_latency=0.0):
+        self.dim = dim
+        self.request_latency = request_latency
+        self.text_latency = text_latency
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            vector[zlib.crc32(word.strip(".,").encode("utf-8")) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.request_latency + self.text_latency * len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def _topic_words(text):
+    words = {word.strip(".,").lower() for word in text.split()}
+    return [word for word in VOCABULARY if word in words]
+
+
+def _fake_response(tool_name, system_prompt, content):
+    if tool_name == "QueryTranslationTool":
+        words = _topic_words(content)
+        query_strings = [
+            " ".join(pair) for pair in itertools.combinations(words, 2)
+        ][:N_QUERY_STRINGS] or [content]
+        args = {"query_strings": query_strings}
+    else:
+        doc, _, input_sentence = content.partition("User's input sentence: ")
+        doc = doc.split(": ", 1)[-1].strip()
+        sentence_words = _topic_words(input_sentence)
+        doc_words = set(_topic_words(doc))
+        is_relevant = bool(sentence_words) and all(
+            word in doc_words for word in sentence_words
+        )
+        args = {
+            "document_is_relevant": is_relevant,
+            "supporting_quote": doc.split(". ", 1)[0] if is_relevant else "",
+        }
+    input_tokens = rate_limiting.estimate_tokens(system_prompt + content)
+    output_tokens = rate_limiting.estimate_tokens(json.dumps(args))
+    return AIMessage(
+        content="",
+        tool_calls=[{"name": tool_name, "args": args, "id": "call_0"}],
+        usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        },
+    )
+
+
+def fake_assistant_runnable_factory(latency=0.0):
+    """
+    Create a replacement of `llm_util.init_assistant_runnable` whose runnables answer
+    deterministically after a configurable latency instead of calling OpenAI. Query
+    strings are pairs of topic words of the input sentence, and a document is graded
+    relevant if it mentions all topic words of the sentence.
+
+    Parameters:
+    latency (float): Seconds each language model call takes.
+
+    Returns:
+    callable: The replacement function.
+    """
+
+    def init_assistant_runnable(system_prompt, tools, config):
+        tool_name = (tools[0] if isinstance(tools, list) else tools).__name__
+
+        def respond(inputs):
+            time.sleep(latency)
+            return _fake_response(
+                tool_name, system_prompt, inputs["messages"][-1].content
+            )
+
+        async def arespond(inputs):
+            await asyncio.sleep(latency)
+            return _fake_response(
+                tool_name, system_prompt, inputs["messages"][-1].content
+            )
+
+        return RunnableLambda(respond, afunc=arespond)
+
+    return init_assistant_runnable
+
+
+def make_sentences(n_sentences, seed=0):
+    rng = _rng(seed, "sentences")
+    sentences = []
+    for i in range(n_sentences):
+        template = SENTENCE_TEMPLATES[i % len(SENTENCE_TEMPLATES)]
+        sentences.append(template.format(*rng.sample(VOCABULARY, 3)).capitalize())
+    return sentences
+
+
+def record_fixtures(query_strings, directory, config):
+    """
+    Record live PubMed search pages and the pages of their free articles into a
+    fixture directory, to be replayed by the stub server.
+
+    Parameters:
+    query_strings (list): The search query strings to record.
+    directory (str): The fixture directory.
+    config (Config): A Config object containing:
+                     - n_articles_per_query (int): Number of articles to record per
+                                                   query.
+                     - http_* (various): Settings of the HTTP client.
+    """
+    http_client = http_util.get_http_client(config)
+    os.makedirs(os.path.join(directory, "search"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "articles"), exist_ok=True)
+    for query_string in query_strings:
+        resp = http_client.get(
+            pubmed.SEARCH_BASE_URL,
+            endpoint="pubmed_search",
+            params={"term": query_string, "size": 200},
+        )
+        path = os.path.join(directory, "search", f"{_fixture_key(query_string)}.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(resp.text)
+        urls = pubmed._parse_search_results(
+            resp.text, config.n_articles_per_query, query_string
+        )
+        for url in urls:
+            pmid = pubmed._pmid_from_url(url)
+            resp = http_client.get(url, endpoint="pmc_article")
+            path = os.path.join(directory, "articles", f"{pmid}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(resp.text)
+        logger.info(f"Recorded {len(urls)} articles for query string '{query_string}'")
+
+
+def _search(finder, sentences, mode):
+    if mode == "many":
+        states = finder.search_many(sentences, return_mode="return")
+        return states, states[0]["metrics"]
+    if mode == "sequential":
+        states = [
+            finder.search(sentence, return_mode="return") for sentence in sentences
+        ]
+    elif mode == "async":
+
+        async def search_all():
+            try:
+                return await asyncio.gather(
+                    *(
+                        finder.asearch(sentence, return_mode="return")
+                        for sentence in sentences
+                    )
+                )
+            finally:
+                await finder.aclose()
+
+        states = asyncio.run(search_all())
+    else:
+        raise ValueError(f"Unknown benchmark mode '{mode}'")
+    metrics = Metrics()
+    for state in states:
+        metrics.merge(state["metrics"])
+    return states, metrics
+
+
+def run_scenario(scenario):
+    """
+    Run a single benchmark scenario against the stub server and fake language model
+    and embedding backends, with empty caches in a temporary directory.
+
+    Parameters:
+    scenario (dict): The scenario, as built by `_scenarios`.
+
+    Returns:
+    dict: The scenario with its wall time, throughput, peak memory, number of found
+          citations and per-stage metrics.
+    """
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    store = FixtureStore(scenario["fixtures_dir"], seed=scenario["seed"])
+    server, eutils_base_url = start_stub_server(store, scenario["http_latency"])
+    llm_util.init_assistant_runnable = fake_assistant_runnable_factory(
+        scenario["llm_latency"]
+    )
+    embedding_util._init_openai_embeddings = lambda model_name: FakeEmbeddings(
+        request_latency=scenario["embedding_latency"],
+        text_latency=scenario["embedding_text_latency"],
+    )
+    # imported late so that the patched modules are in place when the app is built
+    from app import CitationFinder
+
+    sentences = make_sentences(scenario["n_sentences"], scenario["seed"])
+    with tempfile.TemporaryDirectory() as cache_dir:
+        config = Config(
+            **{
+                "n_articles_per_query": scenario["n_articles_per_query"],
+                "cache_dir": cache_dir,
+                "use_langsmith": False,
+                "eutils_base_url": eutils_base_url,
+                **scenario["config"],
+            }
+        )
+        finder = CitationFinder(config)
+        if scenario["warm"]:
+            _search(finder, sentences, scenario["mode"])
+        start = time.perf_counter()
+        states, metrics = _search(finder, sentences, scenario["mode"])
+        wall_seconds = time.perf_counter() - start
+    server.terminate()
+    return {
+        **scenario,
+        "wall_seconds": wall_seconds,
+        "sentences_per_second": len(sentences) / wall_seconds,
+        "peak_rss_bytes": instrumentation.get_peak_rss_bytes(),
+        "n_citations": sum(len(state["docs"]) for state in states),
+        "stages": metrics.to_dict(),
+    }
+
+
+def _run_in_subprocess(scenario):
+    # a fresh process per run, so that process-wide clients, vector stores and peak
+    # memory don't carry over between scenarios
+    with tempfile.TemporaryDirectory() as directory:
+        result_path = os.path.join(directory, "result.json")
+        subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "_run",
+                json.dumps(scenario),
+                result_path,
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        with open(result_path, "r") as f:
+            return json.load(f)
+
+
+def _parse_config_overrides(overrides):
+    config = {}
+    for override in overrides:
+        key, _, value = override.partition("=")
+        if key not in Config.__dataclass_fields__:
+            raise ValueError(f"Unknown Config field '{key}'")
+        try:
+            config[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            config[key] = value
+    return config
+
+
+def _scenarios(args):
+    config = {
+        # the fake backends have no rate limits
+        "llm_requests_per_minute": None,
+        "llm_tokens_per_minute": None,
+        "embedding_requests_per_minute": None,
+        "embedding_tokens_per_minute": None,
+        **_parse_config_overrides(args.config),
+    }
+    return [
+        {
+            "n_sentences": n_sentences,
+            "n_articles_per_query": n_articles,
+            "mode": args.mode,
+            "warm": args.warm,
+            "http_latency": args.http_latency,
+            "llm_latency": args.llm_latency,
+            "embedding_latency": args.embedding_latency,
+            "embedding_text_latency": args.embedding_text_latency,
+            "fixtures_dir": args.fixtures_dir,
+            "seed": args.seed,
+            "config": config,
+        }
+        for n_sentences in args.sentences
+        for n_articles in args.n_articles
+    ]
+
+
+def _eval_scenarios(args):
+    scenario = {
+        "n_sentences": args.sentences,
+        "n_articles_per_query": args.n_articles,
+        "mode": "many",
+        "warm": False,
+        # only the selection of graded documents is evaluated, not the latency
+        "http_latency": 0.0,
+        "llm_latency": 0.0,
+        "embedding_latency": 0.0,
+        "embedding_text_latency": 0.0,
+        "fixtures_dir": args.fixtures_dir,
+        "seed": args.seed,
+    }
+    config = {
+        "llm_requests_per_minute": None,
+        "llm_tokens_per_minute": None,
+        "embedding_requests_per_minute": None,
+        "embedding_tokens_per_minute": None,
+        "n_docs_rerank": args.n_docs_rerank,
+        **_parse_config_overrides(args.config),
+    }
+    # all documents retrieved for reranking are graded, to count the relevant ones
+    # that reranking could keep at best
+    variants = [
+        (
+            f"retrieve {args.n_docs_rerank} (reference)",
+            {"reranker": None, "n_docs_retrival": args.n_docs_rerank},
+        ),
+        (
+            f"retrieve {args.n_docs}",
+            {"reranker": None, "n_docs_retrival": args.n_docs},
+        ),
+    ]
+    for reranker in args.rerankers:
+        for n_docs_grade in args.n_docs_grade:
+            for min_score in args.rerank_min_scores:
+                name = f"{reranker} top {n_docs_grade}"
+                if min_score is not None:
+                    name += f", score >= {min_score:g}"
+                variants.append(
+                    (
+                        name,
+                        {
+                            "reranker": reranker,
+                            "n_docs_grade": n_docs_grade,
+                            "rerank_min_score": min_score,
+                        },
+                    )
+                )
+    return [
+        {**scenario, "name": name, "config": {**config, **variant_config}}
+        for name, variant_config in variants
+    ]
+
+
+def _format_eval_report(results):
+    reference = results[0]
+    n_relevant = reference["n_citations"]
+    lines = [
+        f"{reference['n_sentences']} sentences, {reference['n_articles_per_query']} "
+        f"articles per query, {n_relevant} relevant documents among the "
+        f"{reference['config']['n_docs_rerank']} retrieved per sentence",
+        f"  {'selection':<32}{'grading calls':>15}{'relevant':>10}{'recall':>8}",
+    ]
+    for result in results:
+        # every citation is a relevant document that was graded, and the graded
+        # documents are a subset of those of the reference
+        recall = result["n_citations"] / n_relevant if n_relevant else 1.0
+        lines.append(
+            f"  {result['name']:<32}"
+            f"{result['stages']['document_grader']['llm_calls']:>15}"
+            f"{result['n_citations']:>10}{recall:>8.2f}"
+        )
+    return "\n".join(lines)
+
+
+def _format_report(result, n_repeats):
+    lines = [
+        f"{result['n_sentences']} sentences, {result['n_articles_per_query']} "
+        f"articles per query, mode '{result['mode']}', "
+        f"{'warm' if result['warm'] else 'cold'} caches "
+        f"(median of {n_repeats} runs)",
+        f"  wall time {result['wall_seconds']:.2f}s, "
+        f"{result['sentences_per_second']:.2f} sentences/s, "
+        f"peak RSS {result['peak_rss_bytes'] / 2 ** 20:.1f} MiB, "
+        f"{result['n_citations']} citations",
+        f"  {'stage':<26}{'calls':>7}{'seconds':>10}{'HTTP MiB':>10}"
+        f"{'LLM calls':>11}{'LLM tokens':>12}{'embedded':>10}{'RSS +MiB':>10}",
+    ]
+    for name, stats in result["stages"].items():
+        lines.append(
+            f"  {name:<26}{stats['calls']:>7}{stats['seconds']:>10.3f}"
+            f"{stats['http_bytes'] / 2 ** 20:>10.2f}{stats['llm_calls']:>11}"
+            f"{stats['llm_input_tokens'] + stats['llm_output_tokens']:>12}"
+            f"{stats['embedded_texts']:>10}"
+            f"{stats['max_rss_growth_bytes'] / 2 ** 20:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Benchmark CitationFinder offline against a local PubMed stub server and "
+            "fake language model and embedding backends."
+        )
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="Run benchmark scenarios.")
+    run_parser.add_argument(
+        "--sentences",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100],
+        help="Numbers of input sentences of the scenarios."
+    )
+    run_parser.add_argument(
+        "--n_articles",
+        type=int,
+        nargs="+",
+        default=[10],
+        help="Numbers of articles per search query of the scenarios."
+    )
+    run_parser.add_argument(
+        "--mode",
+        type=str,
+        default="many",
+        choices=["many", "sequential", "async"],
+        help=(
+            "Whether to search all sentences with `search_many`, one after another "
+            "with `search`, or concurrently with `asearch`."
+        )
+    )
+    run_parser.add_argument(
+        "--warm",
+        action="store_true",
+        help="Search all sentences once before measuring, to benchmark warm caches."
+    )
+    run_parser.add_argument(
+        "--repeats",
+        type=int,
+        default=1,
+        help="Number of runs per scenario, the run with the median wall time is shown."
+    )
+    run_parser.add_argument(
+        "--http_latency",
+        type=float,
+        default=0.05,
+        help="Latency of the stub server's responses in seconds."
+    )
+    run_parser.add_argument(
+        "--llm_latency",
+        type=float,
+        default=0.5,
+        help="Latency of each fake language model call in seconds."
+    )
+    run_parser.add_argument(
+        "--embedding_latency",
+        type=float,
+        default=0.2,
+        help="Latency of each fake embedding request in seconds."
+    )
+    run_parser.add_argument(
+        "--embedding_text_latency",
+        type=float,
+        default=0.0001,
+        help="Additional latency per embedded text in seconds."
+    )
+    run_parser.add_argument(
+        "--fixtures_dir",
+        type=str,
+        default=None,
+        help=(
+            "Directory of pages recorded with the `record` command. Pages that have "
+            "not been recorded are generated."
+        )
+    )
+    run_parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the generated sentences and pages."
+    )
+    run_parser.add_argument(
+        "--config",
+        type=str,
+        nargs="+",
+        default=[],
+        help=(
+            "Config fields to override as `field=value`, e.g. "
+            "`vectorstore_backend=numpy`."
+        )
+    )
+    run_parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Path of a JSON file to write the results of all runs to."
+    )
+
+    eval_parser = subparsers.add_parser(
+        "eval",
+        help=(
+            "Compare the recall and grading calls of retrieving documents with and "
+            "without reranking."
+        ),
+    )
+    eval_parser.add_argument(
+        "--sentences",
+        type=int,
+        default=50,
+        help="Number of input sentences."
+    )
+    eval_parser.add_argument(
+        "--n_articles",
+        type=int,
+        default=10,
+        help="Number of articles per search query."
+    )
+    eval_parser.add_argument(
+        "--n_docs",
+        type=int,
+        default=10,
+        help="Number of documents graded without reranking."
+    )
+    eval_parser.add_argument(
+        "--n_docs_rerank",
+        type=int,
+        default=30,
+        help="Number of documents retrieved for reranking."
+    )
+    eval_parser.add_argument(
+        "--rerankers",
+        type=str,
+        nargs="+",
+        default=["bm25"],
+        choices=["bm25", "cross_encoder"],
+        help="Rerankers to evaluate."
+    )
+    eval_parser.add_argument(
+        "--n_docs_grade",
+        type=int,
+        nargs="+",
+        default=[3, 5, 10],
+        help="Numbers of reranked documents to grade."
+    )
+    eval_parser.add_argument(
+        "--rerank_min_scores",
+        type=ast.literal_eval,
+        nargs="+",
+        default=[None],
+        help="Minimum reranker scores to evaluate, `None` for no minimum."
+    )
+    eval_parser.add_argument(
+        "--fixtures_dir",
+        type=str,
+        default=None,
+        help="Directory of pages recorded with the `record` command."
+    )
+    eval_parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the generated sentences and pages."
+    )
+    eval_parser.add_argument(
+        "--config",
+        type=str,
+        nargs="+",
+        default=[],
+        help="Config fields to override as `field=value`."
+    )
+
+    record_parser = subparsers.add_parser(
+        "record", help="Record live PubMed pages as fixtures."
+    )
+    record_parser.add_argument(
+        "--query_strings",
+        type=str,
+        nargs="+",
+        required=True,
+        help="Search query strings to record."
+    )
+    record_parser.add_argument(
+        "--n_articles",
+        type=int,
+        default=10,
+        help="Number of articles to record per search query."
+    )
+    record_parser.add_argument(
+        "--fixtures_dir",
+        type=str,
+        required=True,
+        help="Directory to write the recorded pages to."
+    )
+
+    return parser.parse_args()
+
+
+def run():
+    if len(sys.argv) == 4 and sys.argv[1] == "_run":
+        # a single run in a subprocess, see `_run_in_subprocess`
+        structlog.configure(
+            wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING)
+        )
+        result = run_scenario(json.loads(sys.argv[2]))
+        with open(sys.argv[3], "w") as f:
+            json.dump(result, f)
+        return
+
+    args = parse_args()
+    if args.command == "record":
+        record_fixtures(
+            args.query_strings,
+            args.fixtures_dir,
+            Config(n_articles_per_query=args.n_articles),
+        )
+        return
+    if args.command == "eval":
+        results = [_run_in_subprocess(scenario) for scenario in _eval_scenarios(args)]
+        print(_format_eval_report(results))
+        return
+    if args.command != "run":
+        raise SystemExit("Specify a command, either `run`, `eval` or `record`")
+
+    all_results = []
+    for scenario in _scenarios(args):
+        results = [_run_in_subprocess(scenario) for _ in range(args.repeats)]
+        all_results += results
+        median_wall_seconds = statistics.median_low(
+            [result["wall_seconds"] for result in results]
+        )
+        median_result = next(
+            result for result in results
+            if result["wall_seconds"] == median_wall_seconds
+        )
+        print(_format_report(median_result, args.repeats))
+        print()
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(all_results, f, indent=2)
+
+
+if __name__ == "__main__":
+    run()
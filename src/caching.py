@@ -0,0 +1,262 @@
+import concurrent.futures
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+class PersistentCache:
+    """
+    A thread-safe key-value cache persisted in a SQLite database. Values must be
+    JSON-serializable and are stored zlib-compressed. Entries expire after
+    `ttl_seconds` and, once the cache holds more than `max_entries` entries, the least
+    recently used entries are evicted.
+    """
+
+    def __init__(self, path, ttl_seconds=None, max_entries=None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB, created_at REAL, accessed_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)"
+        )
+        self._conn.commit()
+        self._n_entries = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def __len__(self):
+        return self._n_entries
+
+    def _is_expired(self, created_at, now):
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def get(self, key):
+        """
+        Fetch a value from the cache.
+
+        Parameters:
+        key (str): The cache key.
+
+        Returns:
+        object or None: The cached value, or None if the key is missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created_at = row
+            if self._is_expired(created_at, now):
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self._n_entries -= 1
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(zlib.decompress(value))
+
+    def set(self, key, value):
+        """
+        Store a value in the cache, evicting the least recently used entries if the
+        cache grows beyond `max_entries`.
+
+        Parameters:
+        key (str): The cache key.
+        value (object): A JSON-serializable value to store.
+        """
+        blob = zlib.compress(json.dumps(value).encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            exists = self._conn.execute(
+                "SELECT 1 FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, blob, now, now)
+            )
+            if exists is None:
+                self._n_entries += 1
+            self._evict()
+            self._conn.commit()
+
+    def set_limits(self, ttl_seconds=None, max_entries=None):
+        """
+        Change the time-to-live and maximum number of entries of the cache, evicting
+        the least recently used entries right away if the cache holds too many.
+
+        Parameters:
+        ttl_seconds (float or None): Time-to-live of cache entries in seconds, or
+                                     None for no expiry.
+        max_entries (int or None): Maximum number of entries to keep, or None for
+                                   no limit.
+        """
+        with self._lock:
+            self.ttl_seconds = ttl_seconds
+            self.max_entries = max_entries
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        if self.max_entries is None or self._n_entries <= self.max_entries:
+            return
+        n_evict = self._n_entries - self.max_entries
+        self._conn.execute(
+            "DELETE FROM cache WHERE key IN "
+            "(SELECT key FROM cache ORDER BY accessed_at ASC LIMIT ?)",
+            (n_evict,)
+        )
+        self._n_entries -= n_evict
+        self.evictions += n_evict
+
+    def items(self, prefix=""):
+        """
+        Fetch all unexpired entries whose key starts with the given prefix, without
+        counting them as hits or updating their access times.
+
+        Parameters:
+        prefix (str): Prefix of the keys to fetch.
+
+        Returns:
+        list[tuple]: (key, value) pairs of the matching entries.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value, created_at FROM cache WHERE substr(key, 1, ?) = ?",
+                (len(prefix), prefix)
+            ).fetchall()
+        return [
+            (key, json.loads(zlib.decompress(value)))
+            for key, value, created_at in rows
+            if not self._is_expired(created_at, now)
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+            self._n_entries = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._n_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls of the same key: while a call is in flight, calls with
+    the same key wait for it and share its result or exception instead of repeating
+    the work. Results are not kept once the call has completed.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Call `func(*args, **kwargs)`, unless a call with the same key is in flight, in
+        which case its result is awaited instead.
+
+        Parameters:
+        key (hashable): Key identifying calls that give the same result.
+        func (callable): The function to call.
+
+        Returns:
+        object: The result of the call.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._calls[key] = future
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "coalesced": self.coalesced}
+
+
+def get_cache(path, ttl_seconds=None, max_entries=None):
+    """
+    Get the process-wide PersistentCache stored at the given path, creating it on
+    first use. If the cache is already open with other limits, the limits of the
+    latest call apply from then on, as the entries of a file are shared.
+
+    Parameters:
+    path (str): Path of the SQLite database file.
+    ttl_seconds (float or None): Time-to-live of cache entries in seconds, or None for
+                                 no expiry.
+    max_entries (int or None): Maximum number of entries to keep, or None for no
+                               limit.
+
+    Returns:
+    PersistentCache: The cache stored at the given path.
+    """
+    path = os.path.abspath(path)
+    with _CACHES_LOCK:
+        if path not in _CACHES:
+            _CACHES[path] = PersistentCache(path, ttl_seconds, max_entries)
+            logger.debug(f"Opened persistent cache at '{path}'")
+            return _CACHES[path]
+        cache = _CACHES[path]
+    if (cache.ttl_seconds, cache.max_entries) != (ttl_seconds, max_entries):
+        logger.info(
+            f"Changing limits of persistent cache at '{path}' from "
+            f"ttl_seconds={cache.ttl_seconds}, max_entries={cache.max_entries} to "
+            f"ttl_seconds={ttl_seconds}, max_entries={max_entries}"
+        )
+        cache.set_limits(ttl_seconds, max_entries)
+    return cache
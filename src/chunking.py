@@ -0,0 +1,145 @@
+import hashlib
+import re
+
+import numpy as np
+
+import rate_limiting
+
+_N_PERMUTATIONS = 64
+_SHINGLE_SIZE = 5
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+# coefficients of the MinHash permutations, fixed so that signatures are comparable
+# between processes; kept below 2**32 so that products fit into 64 bits
+_RNG = np.random.default_rng(0)
+_A = _RNG.integers(1, 1 << 32, _N_PERMUTATIONS, dtype=np.uint64)
+_B = _RNG.integers(0, 1 << 32, _N_PERMUTATIONS, dtype=np.uint64)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _normalize(text):
+    return " ".join(text.lower().split())
+
+
+def _minhash(text):
+    words = text.split()
+    n_shingles = max(len(words) - _SHINGLE_SIZE + 1, 1)
+    shingles = {" ".join(words[i:i + _SHINGLE_SIZE]) for i in range(n_shingles)}
+    # crc32 is linear, which correlates it with the permutations, so a proper hash
+    # function is used instead
+    hashes = np.array(
+        [
+            int.from_bytes(
+                hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(),
+                "little",
+            )
+            for shingle in shingles
+        ],
+        dtype=np.uint64,
+    )
+    return ((np.outer(hashes, _A) + _B) % _MERSENNE_PRIME).min(axis=0)
+
+
+def deduplicate(texts, near_duplicate_threshold=0.9):
+    """
+    Remove duplicate paragraphs, keeping the first occurrence. A paragraph is a
+    duplicate if its normalized text equals or is contained in an earlier paragraph,
+    as happens with footnotes in nested <p> tags, or if its estimated Jaccard
+    similarity to an earlier paragraph, computed with MinHash over word shingles, is
+    at least `near_duplicate_threshold`.
+
+    Parameters:
+    texts (list[str]): The paragraphs of an article.
+    near_duplicate_threshold (float or None): Minimum similarity of near-duplicates,
+                                              or None to only remove exact
+                                              duplicates.
+
+    Returns:
+    list[str]: The unique paragraphs.
+    """
+    unique_texts = []
+    kept = []
+    seen_hashes = set()
+    signatures = []
+    for text in texts:
+        normalized = _normalize(text)
+        text_hash = hashlib.sha1(normalized.encode("utf-8")).digest()
+        if text_hash in seen_hashes:
+            continue
+        if any(normalized in kept_text for kept_text in kept):
+            continue
+        if near_duplicate_threshold is not None:
+            signature = _minhash(normalized)
+            if signatures:
+                similarities = (np.vstack(signatures) == signature).mean(axis=1)
+                if similarities.max() >= near_duplicate_threshold:
+                    continue
+            signatures.append(signature)
+        seen_hashes.add(text_hash)
+        kept.append(normalized)
+        unique_texts.append(text)
+    return unique_texts
+
+
+def _split(text, max_tokens):
+    """
+    Split a paragraph into pieces of at most `max_tokens` tokens at sentence
+    boundaries, or at word boundaries if a single sentence is too long.
+    """
+    pieces = []
+    for sentence in _SENTENCE_END.split(text):
+        if rate_limiting.estimate_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        # pieces are merged below, so single words can be appended here
+        pieces.extend(sentence.split())
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        candidate = f"{current} {piece}" if current else piece
+        if current and rate_limiting.estimate_tokens(candidate) > max_tokens:
+            chunks.append(current)
+            current = piece
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk(texts, target_tokens=256, max_tokens=512):
+    """
+    Split oversized paragraphs and merge small adjacent paragraphs, so that chunks are
+    close to `target_tokens` tokens in size.
+
+    Parameters:
+    texts (list[str]): The paragraphs of an article, in document order.
+    target_tokens (int): Paragraphs are merged until a chunk reaches this size.
+    max_tokens (int): Maximum size of a chunk.
+
+    Returns:
+    list[str]: The chunks.
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    for text in texts:
+        n_tokens = rate_limiting.estimate_tokens(text)
+        if n_tokens > max_tokens:
+            if current:
+                chunks.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split(text, max_tokens))
+            continue
+        if current and current_tokens + n_tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += n_tokens
+        if current_tokens >= target_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
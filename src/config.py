@@ -6,9 +6,66 @@ from typing import Optional
 class Config:
     n_articles_per_query: int = 10
     n_docs_retrival: int = 10
+    reranker: Optional[str] = None
+    n_docs_rerank: int = 30
+    n_docs_grade: int = 5
+    rerank_min_score: Optional[float] = None
+    cross_encoder_model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
     model_name: str = "gpt-4o-2024-08-06"
     temperature: int = 0
     reset_vectorstore_after_retrieval: bool = True
+    cache_dir: str = ".citation_finder_cache"
+    use_article_cache: bool = True
+    article_cache_ttl_days: Optional[float] = 30
+    article_cache_max_entries: Optional[int] = 10000
+    embedding_backend: str = "openai"
+    embedding_model_name: str = "text-embedding-ada-002"
+    local_embedding_model_name: str = "pritamdeka/S-PubMedBert-MS-MARCO"
+    local_embedding_batch_size: int = 64
+    local_embedding_threads: int = 0
+    embedding_batch_max_tokens: int = 100000
+    embedding_batch_max_size: int = 1000
+    max_concurrent_embedding_batches: int = 4
+    embedding_requests_per_minute: Optional[int] = 3000
+    embedding_tokens_per_minute: Optional[int] = 1000000
+    embedding_max_retries: int = 5
+    use_embedding_cache: bool = True
+    use_persistent_vectorstore: bool = True
+    chunk_target_tokens: Optional[int] = 256
+    chunk_max_tokens: int = 512
+    near_duplicate_threshold: Optional[float] = 0.9
+    vectorstore_backend: str = "chroma"
+    use_mmr: bool = False
+    mmr_lambda: float = 0.5
+    use_query_cache: bool = True
+    query_cache_max_entries: Optional[int] = 10000
+    query_cache_similarity_threshold: Optional[float] = None
+    use_grading_cache: bool = True
+    grading_cache_max_entries: Optional[int] = 100000
+    pubmed_backend: str = "html"
+    html_parser: str = "bs4"
+    parse_workers: int = 0
+    eutils_base_url: str = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+    eutils_batch_size: int = 50
+    ncbi_api_key: Optional[str] = None
+    max_concurrent_scrapes: int = 16
+    max_requests_per_host: int = 8
+    http_connect_timeout: float = 5.0
+    http_read_timeout: float = 30.0
+    http_max_retries: int = 3
+    http_backoff_base: float = 0.5
+    http_backoff_max: float = 30.0
+    http_pool_size: int = 32
+    max_concurrent_gradings: int = 5
+    max_concurrent_sentences: int = 8
+    grading_max_retries: int = 2
+    llm_max_concurrency: int = 16
+    llm_requests_per_minute: Optional[int] = 500
+    llm_tokens_per_minute: Optional[int] = 300000
+    server_host: str = "127.0.0.1"
+    server_port: int = 8000
+    server_max_concurrency: int = 4
+    server_max_queue_size: int = 32
     use_langsmith: bool = True
     langchain_project: Optional[str] = "citation-finder"
     langchain_tracing_v2: Optional[str] = "true"
@@ -1,10 +1,25 @@
+import asyncio
+import concurrent.futures
+import functools
+import hashlib
+import os
+import time
+
 import structlog
+from langchain_core.documents import Document
 from langchain_core.pydantic_v1 import BaseModel, Field
 
+import caching
+import instrumentation
+import rate_limiting
 from llm_util import Assistant
 
 logger = structlog.get_logger(__name__)
 
+# delays in seconds of retried grading calls, unless the API sets `Retry-After`
+_RETRY_BACKOFF_BASE = 1.0
+_RETRY_BACKOFF_MAX = 10.0
+
 
 class DocumentGradingTool(BaseModel):
     document_is_relevant: bool = Field(
@@ -30,25 +45,318 @@ def _format_inputs(doc, input_sentence):
     )
 
 
+def _parse_tool_output(response, attempt):
+    if response.tool_calls:
+        return response.tool_calls[0]["args"]
+    logger.warning(
+        f"DocumentGrader failed to call DocumentGradingTool on attempt {attempt + 1}"
+    )
+    return None
+
+
+def _filter_relevant_docs(docs, tool_outputs):
+    filtered_docs = []
+    for doc, tool_output in zip(docs, tool_outputs):
+        if tool_output is not None and tool_output["document_is_relevant"] == True:
+            # the retrieved document is left unmodified, the citation is a copy
+            metadata = {
+                **doc.metadata, "supporting_quote": tool_output["supporting_quote"]
+            }
+            filtered_docs.append(
+                Document(page_content=doc.page_content, metadata=metadata)
+            )
+    logger.debug(f"Graded {len(filtered_docs)} documents are relevant")
+    return filtered_docs
+
+
+def _hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class VerdictCache:
+    """
+    A cache of grading verdicts of (input sentence, document) pairs. Entries are keyed
+    by hashes of the sentence, the document text, the language model and the grading
+    prompt, so that changing the model or the prompt invalidates the cache.
+    """
+
+    def __init__(self, cache, model_name, system_prompt):
+        self.cache = cache
+        self.namespace = f"{_hash(model_name)[:16]}:{_hash(system_prompt)[:16]}:"
+
+    def _key(self, doc, input_sentence):
+        return (
+            f"{self.namespace}{_hash(input_sentence)}:{_hash(doc.page_content)}"
+        )
+
+    def get(self, doc, input_sentence):
+        """
+        Look up the verdict of a document.
+
+        Parameters:
+        doc (Document): The graded document.
+        input_sentence (str): The user's input sentence.
+
+        Returns:
+        dict or None: The arguments of the DocumentGradingTool call, or None on a
+                      cache miss.
+        """
+        return self.cache.get(self._key(doc, input_sentence))
+
+    def set(self, doc, input_sentence, tool_output):
+        """
+        Store the verdict of a document.
+
+        Parameters:
+        doc (Document): The graded document.
+        input_sentence (str): The user's input sentence.
+        tool_output (dict): The arguments of the DocumentGradingTool call.
+        """
+        verdict = {
+            "document_is_relevant": tool_output["document_is_relevant"],
+            "supporting_quote": tool_output["supporting_quote"],
+        }
+        self.cache.set(self._key(doc, input_sentence), verdict)
+
+    def stats(self):
+        return self.cache.stats()
+
+
+def get_verdict_cache(config, system_prompt):
+    """
+    Get the grading verdict cache, or None if verdict caching is disabled.
+
+    Parameters:
+    config (Config): A Config object containing:
+                     - use_grading_cache (bool): Whether to cache grading verdicts.
+                     - cache_dir (str): Directory of the persistent caches.
+                     - grading_cache_max_entries (int): Maximum number of cached
+                                                        verdicts.
+                     - model_name (str): Name of the language model.
+    system_prompt (str): The system prompt of the document grader.
+
+    Returns:
+    VerdictCache or None: The verdict cache.
+    """
+    if not config.use_grading_cache:
+        return None
+    cache = caching.get_cache(
+        os.path.join(config.cache_dir, "verdicts.sqlite"),
+        max_entries=config.grading_cache_max_entries,
+    )
+    return VerdictCache(cache, config.model_name, system_prompt)
+
+
 class DocumentGrader(Assistant):
-    def __init__(self, runnable):
-        super().__init__(runnable)
+    def __init__(
+        self,
+        runnable,
+        max_concurrency=5,
+        max_retries=2,
+        cache=None,
+        scheduler=None,
+        system_prompt=None,
+    ):
+        super().__init__(
+            runnable, scheduler=scheduler, priority="bulk", system_prompt=system_prompt
+        )
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.cache = cache
+
+    def _retry_delay(self, attempt, error=None):
+        delay = rate_limiting.retry_after(error)
+        if delay is None:
+            delay = rate_limiting.backoff_delay(
+                attempt - 1, _RETRY_BACKOFF_BASE, _RETRY_BACKOFF_MAX
+            )
+        return delay
+
+    def _log_failure(self):
+        logger.warning(
+            f"DocumentGrader failed to grade document after {self.max_retries + 1} "
+            "attempts, skipping grading of this document"
+        )
+
+    def _get_cached(self, doc, input_sentence):
+        if self.cache is None:
+            return None
+        return self.cache.get(doc, input_sentence)
+
+    def _set_cached(self, doc, input_sentence, tool_output):
+        if self.cache is not None:
+            self.cache.set(doc, input_sentence, tool_output)
+
+    def _log_cache_stats(self):
+        if self.cache is not None:
+            logger.debug(f"Verdict cache stats: {self.cache.stats()}")
+
+    def _grade(self, doc, input_sentence):
+        """
+        Grade a single document, retrying failed LLM calls with exponential backoff.
+
+        Parameters:
+        doc (Document): The document to grade.
+        input_sentence (str): The user's input sentence.
+
+        Returns:
+        dict or None: The arguments of the DocumentGradingTool call, or None if
+                      grading failed on every attempt.
+        """
+        cached = self._get_cached(doc, input_sentence)
+        if cached is not None:
+            return cached
+        inputs = _format_inputs(doc.page_content, input_sentence)
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                time.sleep(self._retry_delay(attempt, error))
+            try:
+                response = self.invoke(inputs)
+            except Exception as e:
+                logger.warning(
+                    f"DocumentGrader failed on attempt {attempt + 1}: {repr(e)}"
+                )
+                error = e
+                continue
+            error = None
+            tool_output = _parse_tool_output(response, attempt)
+            if tool_output is not None:
+                self._set_cached(doc, input_sentence, tool_output)
+                return tool_output
+        self._log_failure()
+        return None
+
+    async def _agrade(self, doc, input_sentence, semaphore):
+        """
+        Async version of `_grade`.
+
+        Parameters:
+        doc (Document): The document to grade.
+        input_sentence (str): The user's input sentence.
+        semaphore (asyncio.Semaphore): Semaphore bounding concurrent LLM calls.
+
+        Returns:
+        dict or None: The arguments of the DocumentGradingTool call, or None if
+                      grading failed on every attempt.
+        """
+        # the verdict cache is a SQLite database, keep its I/O off the event loop
+        cached = (
+            await asyncio.to_thread(self._get_cached, doc, input_sentence)
+            if self.cache is not None
+            else None
+        )
+        if cached is not None:
+            return cached
+        inputs = _format_inputs(doc.page_content, input_sentence)
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self._retry_delay(attempt, error))
+            try:
+                async with semaphore:
+                    response = await self.ainvoke(inputs)
+            except Exception as e:
+                logger.warning(
+                    f"DocumentGrader failed on attempt {attempt + 1}: {repr(e)}"
+                )
+                error = e
+                continue
+            error = None
+            tool_output = _parse_tool_output(response, attempt)
+            if tool_output is not None:
+                if self.cache is not None:
+                    await asyncio.to_thread(
+                        self._set_cached, doc, input_sentence, tool_output
+                    )
+                return tool_output
+        self._log_failure()
+        return None
 
     def __call__(self, state):
         input_sentence = state["input_sentence"]
-        filtered_docs = []
-        for doc in state["docs"]:
-            inputs = _format_inputs(doc.page_content, input_sentence)
-            response = self.invoke(inputs)
-            if response.tool_calls:
-                tool_output = response.tool_calls[0]["args"]
-                if tool_output["document_is_relevant"] == True:
-                    doc.metadata["supporting_quote"] = tool_output["supporting_quote"]
-                    filtered_docs.append(doc)
-            else:
-                logger.warning(
-                    "DocumentGrader failed to call DocumentGradingTool, skipping "
-                    "grading of this document"
+        docs = state["docs"]
+        grade = instrumentation.bind(
+            functools.partial(self._grade, input_sentence=input_sentence)
+        )
+        # `map` returns results in the original retrieval order
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_concurrency
+        ) as executor:
+            tool_outputs = list(executor.map(grade, docs))
+        self._log_cache_stats()
+        return {"docs": _filter_relevant_docs(docs, tool_outputs)}
+
+    def grade_many(self, states):
+        """
+        Grade the documents of many input sentences in a single thread pool, so that
+        the number of concurrent LLM calls stays bounded across all sentences.
+
+        Parameters:
+        states (list): A list of GraphState objects, each containing:
+                       - input_sentence (str): The user's input sentence.
+                       - docs (list): The retrieved Document objects to grade.
+
+        Returns:
+        list[GraphState]: For each input state, a GraphState object with the relevant
+                          documents in the 'docs' attribute.
+        """
+        pairs = [
+            (doc, state["input_sentence"]) for state in states for doc in state["docs"]
+        ]
+        grade = instrumentation.bind(lambda pair: self._grade(*pair))
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_concurrency
+        ) as executor:
+            tool_outputs = list(executor.map(grade, pairs))
+        self._log_cache_stats()
+
+        graded_states = []
+        start = 0
+        for state in states:
+            end = start + len(state["docs"])
+            graded_states.append(
+                {"docs": _filter_relevant_docs(state["docs"], tool_outputs[start:end])}
+            )
+            start = end
+        return graded_states
+
+    def iter_grade(self, state):
+        """
+        Grade documents concurrently and yield each relevant document as soon as its
+        grading has completed, instead of waiting for all documents to be graded.
+
+        Parameters:
+        state (GraphState): A GraphState object containing:
+                            - input_sentence (str): The user's input sentence.
+                            - docs (list): The retrieved Document objects to grade.
+
+        Yields:
+        Document: Relevant documents with the supporting quote in the
+                  'supporting_quote' metadata field, in order of completion.
+        """
+        input_sentence = state["input_sentence"]
+        grade = instrumentation.bind(self._grade)
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_concurrency
+        ) as executor:
+            docs_by_future = {
+                executor.submit(grade, doc, input_sentence): doc
+                for doc in state["docs"]
+            }
+            for future in concurrent.futures.as_completed(docs_by_future):
+                yield from _filter_relevant_docs(
+                    [docs_by_future[future]], [future.result()]
                 )
-        logger.debug(f"Graded {len(filtered_docs)} documents are relevant")
-        return {"docs": filtered_docs}
+        self._log_cache_stats()
+
+    async def acall(self, state):
+        input_sentence = state["input_sentence"]
+        docs = state["docs"]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        # `gather` returns results in the original retrieval order
+        tool_outputs = await asyncio.gather(
+            *(self._agrade(doc, input_sentence, semaphore) for doc in docs)
+        )
+        self._log_cache_stats()
+        return {"docs": _filter_relevant_docs(docs, tool_outputs)}
@@ -1,23 +1,47 @@
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import types
+import uuid
+
 import structlog
-from langchain.schema import Document
-from langchain_community.vectorstores import Chroma
-from langchain_openai import OpenAIEmbeddings
 
+import chunking
+import embedding_util
+import instrumentation
+import lazy_import
 import pubmed
+import reranking
+from embedding_cache import CachedEmbeddings
+from numpy_vectorstore import NumpyVectorStore
 
 logger = structlog.get_logger(__name__)
 
+# Chroma is only imported if it's the configured vector store
+vectorstores = lazy_import.LazyModule("langchain_community.vectorstores")
+
+COLLECTION_NAME = "citation-finder"
+_ADD_BATCH_SIZE = 1000
+# number of candidates considered by MMR per retrieved document
+_MMR_FETCH_FACTOR = 4
+
+_VECTORSTORES = {}
+_VECTORSTORES_LOCK = threading.Lock()
+
 
 def _extract_article_metadata(article):
     """
-    Extract metadata from an article object.
+    Extract metadata from an article object. The metadata is shared by all paragraphs
+    of the article and therefore read-only.
 
     Parameters:
     article (Article): An article object containing metadata attributes such as
                        title, doi, publication_year, authors, and url.
 
     Returns:
-    dict: A dictionary containing the extracted metadata with keys:
+    MappingProxyType: A read-only mapping containing the extracted metadata with keys:
           - title (str): The title of the article.
           - doi (str): The DOI (Digital Object Identifier) of the article.
           - publication_year (int): The publication year of the article.
@@ -28,57 +52,349 @@ def _extract_article_metadata(article):
     doi = article.doi or "<UNK>"
     publication_year = article.publication_year or "<UNK>"
     authors = "; ".join(article.authors) if article.authors is not None else "<UNK>"
-    return {
-        "title": title,
-        "doi": doi,
-        "publication_year": publication_year,
-        "authors": authors,
-        "url": article.url
-    }
+    return types.MappingProxyType(
+        {
+            "title": title,
+            "doi": doi,
+            "publication_year": publication_year,
+            "authors": authors,
+            "url": article.url
+        }
+    )
 
 
-def _generate_documents(articles, min_length=200):
+def _generate_paragraphs(articles, config, min_length=200):
     """
-    Generate document objects from a list of articles, filtering texts by minimum
-    length. One article text corresponds roughly to one paragraph.
+    Generate the paragraphs to index from a list of articles, filtering texts by
+    minimum length. Duplicate paragraphs of an article are removed, and if chunking is
+    enabled, oversized paragraphs are split and small adjacent paragraphs merged.
+    No Document objects are created, only the retrieved paragraphs become Documents.
 
     Parameters:
-    articles (list): A list of Article objects to generate documents from.
+    articles (list): A list of Article objects to generate paragraphs from.
+    config (Config): A Config object containing:
+                     - chunk_target_tokens (int or None): Target size of chunks in
+                                                          tokens, or None to keep one
+                                                          document per paragraph.
+                     - chunk_max_tokens (int): Maximum size of chunks in tokens.
+                     - near_duplicate_threshold (float or None): Minimum similarity
+                                                                 of near-duplicate
+                                                                 paragraphs, or None
+                                                                 to only remove exact
+                                                                 duplicates.
     min_length (int): Minimum length of text to be considered as a valid document
                       (default: 200).
 
     Returns:
-    list[Document]: A list of Document objects, each representing a single article text
-                    (paragraph) with corresponding metadata.
+    tuple: A list of paragraph texts and a list of the same length with the read-only
+           metadata of each paragraph, shared by all paragraphs of an article.
     """
-    docs = []
-    for article in articles:
-        metadata = _extract_article_metadata(article)
-        for text in article.texts:
-            if len(text) > min_length:
-                doc = Document(page_content=text, metadata=metadata)
-                docs.append(doc)
-    logger.debug(f"Generated {len(docs)} documents")
-    return docs
+    texts = []
+    metadatas = []
+    n_texts = 0
+    with instrumentation.stage("document_search.chunk"):
+        for article in articles:
+            metadata = _extract_article_metadata(article)
+            article_texts = chunking.deduplicate(
+                article.texts, config.near_duplicate_threshold
+            )
+            n_texts += article.n_texts
+            if config.chunk_target_tokens is not None:
+                article_texts = chunking.chunk(
+                    article_texts, config.chunk_target_tokens, config.chunk_max_tokens
+                )
+            for text in article_texts:
+                if len(text) > min_length:
+                    texts.append(text)
+                    metadatas.append(metadata)
+    logger.debug(f"Generated {len(texts)} documents from {n_texts} paragraphs")
+    return texts, metadatas
+
+
+def _vectorstore_class(config):
+    if config.vectorstore_backend == "chroma":
+        return vectorstores.Chroma
+    if config.vectorstore_backend == "numpy":
+        return NumpyVectorStore
+    raise ValueError(f"Unknown vector store backend '{config.vectorstore_backend}'")
 
 
-def _set_up_vectorstore(docs):
+def _new_vectorstore(embeddings, config):
     """
-    Set up a vector store for document retrieval using embeddings.
+    Create an empty, throwaway vector store.
 
     Parameters:
-    docs (list): A list of Document objects to store in the vector store.
+    embeddings (Embeddings): The embedding model used to embed the documents.
+    config (Config): A Config object containing:
+                     - vectorstore_backend (str): Either "chroma" or "numpy".
 
     Returns:
-    Chroma: A Chroma vector store object initialized with the provided documents
-            and embeddings.
+    VectorStore: The empty vector store.
+    """
+    if _vectorstore_class(config) is NumpyVectorStore:
+        return NumpyVectorStore(embeddings)
+    return vectorstores.Chroma(
+        collection_name=f"{COLLECTION_NAME}-{uuid.uuid4().hex}",
+        embedding_function=embeddings,
+    )
+
+
+def _collection_name(config):
+    # documents chunked with different settings must not be retrieved together
+    if config.chunk_target_tokens is None:
+        return COLLECTION_NAME
+    return f"{COLLECTION_NAME}-{config.chunk_target_tokens}-{config.chunk_max_tokens}"
+
+
+def _get_persistent_vectorstore(embeddings, config):
+    """
+    Get the process-wide persistent vector store, creating it on first use. The store
+    holds every paragraph scraped so far and is updated incrementally. The "numpy"
+    backend keeps the store in memory for the lifetime of the process only, and relies
+    on the embedding cache to rebuild it cheaply.
+
+    Parameters:
+    embeddings (Embeddings): The embedding model used to embed the documents.
+    config (Config): A Config object containing:
+                     - cache_dir (str): Directory of the persistent caches.
+                     - embedding_backend (str): Either "openai" or "local".
+                     - vectorstore_backend (str): Either "chroma" or "numpy".
+                     - chunk_target_tokens (int or None): Target size of chunks in
+                                                          tokens, or None to keep one
+                                                          document per paragraph.
+                     - chunk_max_tokens (int): Maximum size of chunks in tokens.
+
+    Returns:
+    VectorStore: The persistent vector store.
+    """
+    model_name = embedding_util.get_embedding_model_name(config)
+    collection_name = _collection_name(config)
+    if _vectorstore_class(config) is NumpyVectorStore:
+        with _VECTORSTORES_LOCK:
+            key = ("numpy", model_name, collection_name)
+            if key not in _VECTORSTORES:
+                _VECTORSTORES[key] = NumpyVectorStore(embeddings)
+            return _VECTORSTORES[key]
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+    persist_directory = os.path.abspath(
+        os.path.join(config.cache_dir, "chroma", safe_name)
+    )
+    key = (persist_directory, collection_name)
+    with _VECTORSTORES_LOCK:
+        if key not in _VECTORSTORES:
+            _VECTORSTORES[key] = vectorstores.Chroma(
+                collection_name=collection_name,
+                embedding_function=embeddings,
+                persist_directory=persist_directory,
+            )
+            logger.debug(
+                f"Opened persistent vector store '{collection_name}' at "
+                f"'{persist_directory}'"
+            )
+        return _VECTORSTORES[key]
+
+
+def warm_up(config):
+    """
+    Open the persistent vector store if enabled, so that the first search doesn't
+    wait for it.
+
+    Parameters:
+    config (Config): A Config object with the same fields as required by
+                     `document_search`.
+    """
+    if config.use_persistent_vectorstore:
+        _get_persistent_vectorstore(embedding_util.init_embeddings(config), config)
+
+
+def _document_id(text, metadata):
+    key = f"{metadata['url']}\x00{text}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _add_texts(vectorstore, texts, metadatas, ids=None):
+    if not isinstance(vectorstore, NumpyVectorStore):
+        # Chroma only accepts dictionaries, it stores its own copy of the metadata
+        metadatas = [dict(metadata) for metadata in metadatas]
+    vectorstore.add_texts(texts, metadatas=metadatas, ids=ids)
+
+
+def _upsert_paragraphs(vectorstore, texts, metadatas):
     """
-    embeddings = OpenAIEmbeddings()
-    vectorstore = Chroma.from_documents(
-        documents=docs,
-        embedding=embeddings,
+    Add paragraphs to a vector store unless they are already stored. Paragraphs are
+    identified by a hash of their URL and content, so only new paragraphs get embedded.
+    The given paragraphs replace everything stored for their URLs, so paragraphs left
+    over from an older scrape, parser or chunking of an article are deleted.
+
+    Parameters:
+    vectorstore (Chroma): The vector store to add the paragraphs to.
+    texts (list[str]): The paragraph texts.
+    metadatas (list[Mapping]): The metadata of each paragraph.
+    """
+    unique_paragraphs = {}
+    for text, metadata in zip(texts, metadatas):
+        unique_paragraphs.setdefault(_document_id(text, metadata), (text, metadata))
+    ids = list(unique_paragraphs.keys())
+    urls = list(
+        dict.fromkeys(metadata["url"] for _, metadata in unique_paragraphs.values())
+    )
+
+    stored_ids = set()
+    for i in range(0, len(urls), _ADD_BATCH_SIZE):
+        where = {"url": {"$in": urls[i:i + _ADD_BATCH_SIZE]}}
+        stored_ids.update(vectorstore.get(where=where, include=[])["ids"])
+    existing_ids = stored_ids.intersection(ids)
+    stale_ids = list(stored_ids - existing_ids)
+    for i in range(0, len(stale_ids), _ADD_BATCH_SIZE):
+        vectorstore.delete(ids=stale_ids[i:i + _ADD_BATCH_SIZE])
+    new_ids = [id_ for id_ in ids if id_ not in existing_ids]
+
+    for i in range(0, len(new_ids), _ADD_BATCH_SIZE):
+        batch_ids = new_ids[i:i + _ADD_BATCH_SIZE]
+        _add_texts(
+            vectorstore,
+            [unique_paragraphs[id_][0] for id_ in batch_ids],
+            [unique_paragraphs[id_][1] for id_ in batch_ids],
+            ids=batch_ids,
+        )
+    logger.debug(
+        f"Added {len(new_ids)} new documents to the vector store, "
+        f"{len(existing_ids)} were already stored, {len(stale_ids)} stale documents "
+        "were deleted"
     )
-    return vectorstore
+
+
+def _index_paragraphs(texts, metadatas, embeddings, config):
+    """
+    Embed paragraphs into a vector store. With a persistent vector store only
+    paragraphs that are not stored yet get embedded, otherwise a new vector store is
+    built.
+
+    Parameters:
+    texts (list[str]): The paragraph texts.
+    metadatas (list[Mapping]): The metadata of each paragraph.
+    embeddings (Embeddings): The embedding model used to embed the paragraphs.
+    config (Config): A Config object containing:
+                     - use_persistent_vectorstore (bool): Whether to use the long-lived
+                                                          vector store.
+                     - vectorstore_backend (str): Either "chroma" or "numpy".
+
+    Returns:
+    Chroma: The vector store containing the paragraphs.
+    """
+    with instrumentation.stage("document_search.embed"):
+        if config.use_persistent_vectorstore:
+            vectorstore = _get_persistent_vectorstore(embeddings, config)
+            _upsert_paragraphs(vectorstore, texts, metadatas)
+            return vectorstore
+        vectorstore = _new_vectorstore(embeddings, config)
+        _add_texts(vectorstore, texts, metadatas)
+        return vectorstore
+
+
+def _retrieve_by_vector(vectorstore, input_sentence, embedding, urls, config):
+    """
+    Retrieve the documents most similar to an embedded sentence, restricted to the
+    given articles. If a reranker is configured, more documents are retrieved and
+    then narrowed down by the reranker to the few that are worth grading.
+
+    Parameters:
+    vectorstore (Chroma): The vector store to retrieve documents from.
+    input_sentence (str): The input sentence.
+    embedding (list[float]): The embedded input sentence.
+    urls (set): URLs of the candidate articles.
+    config (Config): A Config object containing:
+                     - n_docs_retrival (int): Number of top relevant documents to
+                                              retrieve from vector database.
+                     - reranker (str or None): The local reranker, either "bm25" or
+                                               "cross_encoder", or None to not
+                                               rerank.
+                     - n_docs_rerank (int): Number of documents to retrieve for
+                                            reranking.
+                     - n_docs_grade (int): Number of reranked documents to keep
+                                           for grading.
+                     - use_mmr (bool): Whether to diversify the retrieved documents
+                                       with maximal marginal relevance.
+                     - mmr_lambda (float): Trade-off between relevance (1.0) and
+                                           diversity (0.0) of MMR.
+
+    Returns:
+    list[Document]: The retrieved documents.
+    """
+    if not urls:
+        return []
+    k = config.n_docs_retrival if config.reranker is None else config.n_docs_rerank
+    url_filter = {"url": {"$in": sorted(urls)}}
+    with instrumentation.stage("document_search.retrieve"):
+        if config.use_mmr:
+            docs = vectorstore.max_marginal_relevance_search_by_vector(
+                embedding,
+                k=k,
+                fetch_k=_MMR_FETCH_FACTOR * k,
+                lambda_mult=config.mmr_lambda,
+                filter=url_filter,
+            )
+        else:
+            docs = vectorstore.similarity_search_by_vector(
+                embedding, k=k, filter=url_filter
+            )
+        if config.reranker is None:
+            return docs
+        return reranking.rerank(docs, input_sentence, config)
+
+
+def _retrieve_documents_many(articles, queries, config):
+    """
+    Split articles into documents, embed them into a vector store once and retrieve
+    the documents most relevant to each input sentence among its candidate articles.
+
+    Parameters:
+    articles (list): A list of unique Article objects to retrieve documents from.
+    queries (list): A list of (input_sentence, candidate_urls) tuples.
+    config (Config): A Config object.
+
+    Returns:
+    list[list[Document]]: The retrieved documents of each query.
+    """
+    texts, metadatas = _generate_paragraphs(articles, config)
+    if not texts:
+        return [[] for _ in queries]
+    embeddings = embedding_util.init_embeddings(config)
+    vectorstore = _index_paragraphs(texts, metadatas, embeddings, config)
+    # embed all input sentences in a single request
+    with instrumentation.stage("document_search.embed"):
+        sentence_embeddings = embeddings.embed_documents(
+            [input_sentence for input_sentence, _ in queries]
+        )
+    retrieved_docs = [
+        _retrieve_by_vector(vectorstore, input_sentence, embedding, urls, config)
+        for embedding, (input_sentence, urls) in zip(sentence_embeddings, queries)
+    ]
+    if (
+        not config.use_persistent_vectorstore
+        and config.reset_vectorstore_after_retrieval
+    ):
+        vectorstore.delete_collection()
+    if isinstance(embeddings, CachedEmbeddings):
+        logger.debug(f"Embedding cache stats: {embeddings.stats()}")
+    return retrieved_docs
+
+
+def _retrieve_documents(articles, input_sentence, config):
+    """
+    Split articles into documents, embed them into a vector store and retrieve the
+    documents most relevant to the input sentence.
+
+    Parameters:
+    articles (list): A list of Article objects to retrieve documents from.
+    input_sentence (str): An input sentence to retrieve relevant documents for.
+    config (Config): A Config object.
+
+    Returns:
+    list[Document]: The retrieved documents.
+    """
+    urls = {article.url for article in articles}
+    return _retrieve_documents_many(articles, [(input_sentence, urls)], config)[0]
 
 
 def document_search(state, config):
@@ -100,6 +416,14 @@ def document_search(state, config):
                      - reset_vectorstore_after_retrieval (bool): Whether to reset the
                                                                  vector store after
                                                                  retrieval.
+                     - embedding_backend (str): Either "openai" to embed with the
+                                                OpenAI API or "local" to embed on the
+                                                local CPU.
+                     - use_embedding_cache (bool): Whether to cache embeddings on disk.
+                     - use_persistent_vectorstore (bool): Whether to retrieve from a
+                                                          long-lived vector store of all
+                                                          scraped paragraphs instead of
+                                                          a per-query vector store.
 
     Returns:
     GraphState: A GraphState object with a list of retrieved Document objects appended
@@ -108,10 +432,121 @@ def document_search(state, config):
     query_strings = state["query_strings"]
     input_sentence = state["input_sentence"]
     articles = pubmed.pubmed_document_search(query_strings, config)
-    docs = _generate_documents(articles)
-    vectorstore = _set_up_vectorstore(docs)
-    retriever = vectorstore.as_retriever(search_kwargs={"k": config.n_docs_retrival})
-    retrieved_docs = retriever.invoke(input_sentence)
-    if config.reset_vectorstore_after_retrieval:
+    retrieved_docs = _retrieve_documents(articles, input_sentence, config)
+    return {"docs": retrieved_docs}
+
+
+async def adocument_search(state, config):
+    """
+    Async version of `document_search`. Articles are fetched with async HTTP, and the
+    blocking embedding and vector store calls run in a worker thread.
+
+    Parameters:
+    state (GraphState): A GraphState object with the same fields as required by
+                        `document_search`.
+    config (Config): A Config object with the same fields as required by
+                     `document_search`.
+
+    Returns:
+    GraphState: A GraphState object with a list of retrieved Document objects appended
+                to the 'docs' attribute.
+    """
+    query_strings = state["query_strings"]
+    input_sentence = state["input_sentence"]
+    articles = await pubmed.apubmed_document_search(query_strings, config)
+    retrieved_docs = await asyncio.to_thread(
+        _retrieve_documents, articles, input_sentence, config
+    )
+    return {"docs": retrieved_docs}
+
+
+def document_search_many(states, config):
+    """
+    Search documents for many input sentences at once. Each unique query string is
+    searched and each unique article is scraped and embedded only once, after which
+    documents are retrieved separately for each input sentence from the articles
+    found with its own query strings.
+
+    Parameters:
+    states (list): A list of GraphState objects, each containing:
+                   - query_strings (list): A list of query strings for searching
+                                           articles.
+                   - input_sentence (str): An input sentence to retrieve relevant
+                                           documents for.
+    config (Config): A Config object with the same fields as required by
+                     `document_search`.
+
+    Returns:
+    list[GraphState]: For each input state, a GraphState object with a list of
+                      retrieved Document objects appended to the 'docs' attribute.
+    """
+    query_strings = list(
+        dict.fromkeys(
+            query_string for state in states for query_string in state["query_strings"]
+        )
+    )
+    articles_per_query = pubmed.pubmed_document_search_per_query(query_strings, config)
+    articles = list(
+        dict.fromkeys(
+            article
+            for query_string in query_strings
+            for article in articles_per_query[query_string]
+        )
+    )
+    queries = [
+        (
+            state["input_sentence"],
+            {
+                article.url
+                for query_string in state["query_strings"]
+                for article in articles_per_query[query_string]
+            },
+        )
+        for state in states
+    ]
+    retrieved_docs = _retrieve_documents_many(articles, queries, config)
+    return [{"docs": docs} for docs in retrieved_docs]
+
+
+def stream_document_search(state, config):
+    """
+    Search documents for an input sentence, embedding the paragraphs of each article
+    as soon as the article has been scraped instead of waiting for all articles, so
+    that embedding overlaps with scraping of the remaining articles.
+
+    Parameters:
+    state (GraphState): A GraphState object with the same fields as required by
+                        `document_search`.
+    config (Config): A Config object with the same fields as required by
+                     `document_search`.
+
+    Returns:
+    GraphState: A GraphState object with a list of retrieved Document objects appended
+                to the 'docs' attribute.
+    """
+    embeddings = embedding_util.init_embeddings(config)
+    if config.use_persistent_vectorstore:
+        vectorstore = _get_persistent_vectorstore(embeddings, config)
+    else:
+        vectorstore = _new_vectorstore(embeddings, config)
+    urls = set()
+    for article in pubmed.iter_pubmed_document_search(state["query_strings"], config):
+        texts, metadatas = _generate_paragraphs([article], config)
+        if texts:
+            with instrumentation.stage("document_search.embed"):
+                _upsert_paragraphs(vectorstore, texts, metadatas)
+            urls.add(article.url)
+    input_sentence = state["input_sentence"]
+    with instrumentation.stage("document_search.embed"):
+        embedding = embeddings.embed_query(input_sentence)
+    retrieved_docs = _retrieve_by_vector(
+        vectorstore, input_sentence, embedding, urls, config
+    )
+    if (
+        not config.use_persistent_vectorstore
+        and config.reset_vectorstore_after_retrieval
+    ):
         vectorstore.delete_collection()
+    if isinstance(embeddings, CachedEmbeddings):
+        logger.debug(f"Embedding cache stats: {embeddings.stats()}")
     return {"docs": retrieved_docs}
@@ -0,0 +1,243 @@
+import contextlib
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+import structlog
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+
+logger = structlog.get_logger(__name__)
+
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def _hash_text(text, model_name):
+    return hashlib.sha256(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def _hash_query(text, model_name):
+    # asymmetric models embed queries differently from documents of the same text
+    return _hash_text(f"query\x00{text}", model_name)
+
+
+class EmbeddingStore:
+    """
+    A persistent, append-only store of float32 embedding vectors. Vectors are kept in
+    a single raw float32 file that is memory-mapped for bulk reads, and a SQLite index
+    maps each key to its row in the matrix. Appends are serialized with a file lock,
+    so that several processes can share a store; on Windows, where file locks are not
+    available, a store must only be used by a single process.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._lock_path = os.path.join(directory, "vectors.lock")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(directory, "index.sqlite"), check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows (key TEXT PRIMARY KEY, row INTEGER)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)"
+        )
+        self._conn.commit()
+        self.dim = self._load_dim()
+        self._matrix = None
+
+    def _load_dim(self):
+        dim = self._conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+        return dim[0] if dim is not None else None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        with open(self._lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            # released when the file is closed
+            yield
+
+    def _n_rows_on_disk(self):
+        if self.dim is None or not os.path.exists(self._vectors_path):
+            return 0
+        return os.path.getsize(self._vectors_path) // (self.dim * 4)
+
+    def _get_matrix(self):
+        n_rows = self._n_rows_on_disk()
+        if self._matrix is None or self._matrix.shape[0] != n_rows:
+            self._matrix = np.memmap(
+                self._vectors_path, dtype=np.float32, mode="r", shape=(n_rows, self.dim)
+            )
+        return self._matrix
+
+    def lookup(self, keys):
+        """
+        Look up the matrix rows of the given keys.
+
+        Parameters:
+        keys (list[str]): Keys to look up.
+
+        Returns:
+        dict: A dictionary mapping each stored key to its row in the matrix. Keys that
+              are not stored are omitted.
+        """
+        rows = {}
+        unique_keys = list(set(keys))
+        with self._lock:
+            # stay well below SQLite's limit on the number of query parameters
+            for i in range(0, len(unique_keys), 500):
+                chunk = unique_keys[i:i + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                rows.update(
+                    self._conn.execute(
+                        f"SELECT key, row FROM rows WHERE key IN ({placeholders})",
+                        chunk
+                    ).fetchall()
+                )
+        return rows
+
+    def read(self, rows):
+        """
+        Read vectors from the memory-mapped matrix in bulk.
+
+        Parameters:
+        rows (list[int]): Rows of the matrix to read.
+
+        Returns:
+        np.ndarray: A float32 matrix of shape (len(rows), dim).
+        """
+        with self._lock:
+            if self.dim is None:
+                # the first vectors may have been added by another process
+                self.dim = self._load_dim()
+            matrix = self._get_matrix()
+        return np.asarray(matrix[np.asarray(rows, dtype=np.int64)])
+
+    def add(self, keys, vectors):
+        """
+        Append vectors to the store.
+
+        Parameters:
+        keys (list[str]): Keys of the vectors.
+        vectors (np.ndarray): A matrix of shape (len(keys), dim).
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        # the row of an appended vector is only known while no other process appends
+        with self._lock, self._file_lock():
+            if self.dim is None:
+                # another process may have added the first vectors meanwhile
+                self.dim = self._load_dim() or vectors.shape[1]
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO meta (name, value) VALUES ('dim', ?)",
+                    (self.dim,)
+                )
+            if vectors.shape[1] != self.dim:
+                raise ValueError(
+                    f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}"
+                )
+            start = self._n_rows_on_disk()
+            with open(self._vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO rows (key, row) VALUES (?, ?)",
+                [(key, start + i) for i, key in enumerate(keys)]
+            )
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings that are read from a persistent EmbeddingStore whenever possible. Only
+    texts that have not been embedded before are sent to the underlying embedding
+    model.
+    """
+
+    def __init__(self, embeddings, store, model_name):
+        self.embeddings = embeddings
+        self.store = store
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+
+    def _embed(self, texts, embed_func, hash_func=_hash_text):
+        keys = [hash_func(text, self.model_name) for text in texts]
+        rows = self.store.lookup(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in rows and key not in missing:
+                missing[key] = text
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            new_vectors = embed_func(list(missing.values()))
+            self.store.add(list(missing.keys()), np.asarray(new_vectors))
+            rows.update(self.store.lookup(list(missing.keys())))
+
+        vectors = self.store.read([rows[key] for key in keys])
+        logger.debug(
+            f"Embedded {len(texts)} texts, {len(missing)} of which were not cached"
+        )
+        return vectors.tolist()
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return self._embed(texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed(
+            [text],
+            lambda texts: [self.embeddings.embed_query(texts[0])],
+            hash_func=_hash_query,
+        )[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.store),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def get_embedding_store(cache_dir, model_name):
+    """
+    Get the process-wide EmbeddingStore of an embedding model, creating it on first
+    use. Each model gets its own store as vector dimensions differ between models.
+
+    Parameters:
+    cache_dir (str): Directory of the persistent caches.
+    model_name (str): Name of the embedding model.
+
+    Returns:
+    EmbeddingStore: The embedding store of the model.
+    """
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+    directory = os.path.abspath(os.path.join(cache_dir, "embeddings", safe_name))
+    with _STORES_LOCK:
+        if directory not in _STORES:
+            _STORES[directory] = EmbeddingStore(directory)
+            logger.debug(f"Opened embedding store at '{directory}'")
+        return _STORES[directory]
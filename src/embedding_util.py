@@ -0,0 +1,314 @@
+import concurrent.futures
+import os
+import threading
+import time
+
+import structlog
+from langchain_core.embeddings import Embeddings
+
+import embedding_cache
+import instrumentation
+import lazy_import
+import rate_limiting
+from embedding_cache import CachedEmbeddings
+
+logger = structlog.get_logger(__name__)
+
+# heavy dependencies are only imported by the backend that uses them
+langchain_openai = lazy_import.LazyModule("langchain_openai")
+openai = lazy_import.LazyModule("openai")
+sentence_transformers = lazy_import.LazyModule("sentence_transformers")
+torch = lazy_import.LazyModule("torch")
+
+_LOCAL_MODELS = {}
+_LOCAL_MODELS_LOCK = threading.Lock()
+
+_EMBEDDINGS = {}
+_EMBEDDINGS_LOCK = threading.Lock()
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Embeddings computed on the local CPU with a `sentence-transformers` model, so that
+    paragraphs can be embedded without network round trips or API rate limits. The
+    model is loaded once per process and shared between instances.
+    """
+
+    def __init__(self, model_name, batch_size=64, n_threads=0):
+        if not lazy_import.is_available("sentence_transformers"):
+            raise ImportError(
+                "Install `sentence-transformers` to use the 'local' embedding backend "
+                "or set `Config.embedding_backend` to 'openai'"
+            )
+        if n_threads > 0:
+            torch.set_num_threads(n_threads)
+        with _LOCAL_MODELS_LOCK:
+            if model_name not in _LOCAL_MODELS:
+                _LOCAL_MODELS[model_name] = sentence_transformers.SentenceTransformer(
+                    model_name, device="cpu"
+                )
+                logger.debug(f"Loaded local embedding model '{model_name}'")
+            self.model = _LOCAL_MODELS[model_name]
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        instrumentation.add("embedded_texts", len(texts))
+        vectors = self.model.encode(
+            list(texts),
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def _is_retryable(error):
+    """
+    Check whether a failed embedding request may succeed if retried, i.e. whether it
+    was rate limited, failed on the server or didn't reach the server. Other errors,
+    such as invalid requests or authentication errors, fail again on every retry.
+
+    Parameters:
+    error (Exception): The error raised by the embedding client.
+
+    Returns:
+    bool: Whether to retry the request.
+    """
+    if lazy_import.is_available("openai") and isinstance(
+        error,
+        (
+            openai.RateLimitError,
+            # includes openai.APITimeoutError
+            openai.APIConnectionError,
+            openai.InternalServerError,
+        ),
+    ):
+        return True
+    # errors of other clients carrying the HTTP response
+    status_code = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status_code, int):
+        return status_code == 429 or status_code >= 500
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    Embeddings sent to a remote embedding API in batches sized by token count, with
+    several batches in flight at once. Requests are throttled by a shared RateLimiter
+    to stay within the API's requests and tokens per minute, and batches failing on
+    rate limits, server or connection errors are retried with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        rate_limiter,
+        max_batch_tokens=100000,
+        max_batch_size=1000,
+        max_concurrency=4,
+        max_retries=5,
+        backoff_base=1.0,
+        backoff_max=60.0,
+    ):
+        self.embeddings = embeddings
+        self.rate_limiter = rate_limiter
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def _batches(self, texts):
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for i, text in enumerate(texts):
+            n_tokens = rate_limiting.estimate_tokens(text)
+            if batch and (
+                batch_tokens + n_tokens > self.max_batch_tokens
+                or len(batch) == self.max_batch_size
+            ):
+                batches.append((batch, batch_tokens))
+                batch = []
+                batch_tokens = 0
+            batch.append(i)
+            batch_tokens += n_tokens
+        if batch:
+            batches.append((batch, batch_tokens))
+        return batches
+
+    def _call(self, embed_func, texts, n_tokens):
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(n_tokens)
+            try:
+                return embed_func(texts)
+            except Exception as e:
+                if attempt == self.max_retries or not _is_retryable(e):
+                    raise
+                delay = rate_limiting.retry_after(e)
+                if delay is None:
+                    delay = rate_limiting.backoff_delay(
+                        attempt, self.backoff_base, self.backoff_max
+                    )
+                logger.warning(
+                    f"Embedding {len(texts)} texts failed: {repr(e)}. "
+                    f"Retrying in {delay:.2f}s"
+                )
+                time.sleep(delay)
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        texts = list(texts)
+        batches = self._batches(texts)
+        vectors = [None] * len(texts)
+        instrumentation.add("embedded_texts", len(texts))
+        instrumentation.add("embedding_tokens", sum(n for _, n in batches))
+
+        def embed_batch(batch):
+            indices, n_tokens = batch
+            batch_vectors = self._call(
+                self.embeddings.embed_documents, [texts[i] for i in indices], n_tokens
+            )
+            for i, vector in zip(indices, batch_vectors):
+                vectors[i] = vector
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(self.max_concurrency, len(batches))
+        ) as executor:
+            # consume the results to raise errors of failed batches
+            list(executor.map(embed_batch, batches))
+        logger.debug(f"Embedded {len(texts)} texts in {len(batches)} batches")
+        return vectors
+
+    def embed_query(self, text):
+        n_tokens = rate_limiting.estimate_tokens(text)
+        instrumentation.add("embedded_texts")
+        instrumentation.add("embedding_tokens", n_tokens)
+        return self._call(
+            lambda texts: self.embeddings.embed_query(texts[0]), [text], n_tokens
+        )
+
+
+def get_embedding_model_name(config):
+    """
+    Get the name of the embedding model of the configured embedding backend.
+
+    Parameters:
+    config (Config): A Config object containing:
+                     - embedding_backend (str): Either "openai" or "local".
+                     - embedding_model_name (str): Name of the OpenAI embedding
+                                                   model.
+                     - local_embedding_model_name (str): Name of the local
+                                                         `sentence-transformers`
+                                                         model.
+
+    Returns:
+    str: The name of the embedding model.
+    """
+    if config.embedding_backend == "openai":
+        return config.embedding_model_name
+    if config.embedding_backend == "local":
+        return config.local_embedding_model_name
+    raise ValueError(f"Unknown embedding backend '{config.embedding_backend}'")
+
+
+def _init_openai_embeddings(model_name):
+    # retries are handled by the scheduler, which also honours the rate limits
+    return langchain_openai.OpenAIEmbeddings(model=model_name, max_retries=0)
+
+
+def _embeddings_key(config):
+    return (
+        config.embedding_backend,
+        get_embedding_model_name(config),
+        config.local_embedding_batch_size,
+        config.local_embedding_threads,
+        config.embedding_batch_max_tokens,
+        config.embedding_batch_max_size,
+        config.max_concurrent_embedding_batches,
+        config.embedding_requests_per_minute,
+        config.embedding_tokens_per_minute,
+        config.embedding_max_retries,
+        config.use_embedding_cache,
+        os.path.abspath(config.cache_dir),
+    )
+
+
+def init_embeddings(config):
+    """
+    Get the process-wide embedding model, wrapped in a persistent embedding cache if
+    enabled, creating it on first use. The OpenAI client is only created once a text
+    misses the cache.
+
+    Parameters:
+    config (Config): A Config object containing:
+                     - embedding_backend (str): Either "openai" to embed with the
+                                                OpenAI API or "local" to embed on the
+                                                local CPU.
+                     - embedding_model_name (str): Name of the OpenAI embedding model.
+                     - local_embedding_model_name (str): Name of the local
+                                                         `sentence-transformers`
+                                                         model.
+                     - local_embedding_batch_size (int): Number of texts embedded
+                                                         per batch by the local
+                                                         model.
+                     - local_embedding_threads (int): Number of CPU threads of the
+                                                      local model, or 0 for the
+                                                      default.
+                     - embedding_batch_max_tokens (int): Maximum estimated number of
+                                                         tokens per embedding request.
+                     - embedding_batch_max_size (int): Maximum number of texts per
+                                                       embedding request.
+                     - max_concurrent_embedding_batches (int): Maximum number of
+                                                               concurrent embedding
+                                                               requests.
+                     - embedding_requests_per_minute (int or None): Request rate
+                                                                    limit.
+                     - embedding_tokens_per_minute (int or None): Token rate limit.
+                     - embedding_max_retries (int): Maximum number of retries per
+                                                    embedding request.
+                     - use_embedding_cache (bool): Whether to cache embeddings on disk.
+                     - cache_dir (str): Directory of the persistent caches.
+
+    Returns:
+    Embeddings: The embedding model.
+    """
+    key = _embeddings_key(config)
+    with _EMBEDDINGS_LOCK:
+        if key not in _EMBEDDINGS:
+            _EMBEDDINGS[key] = _init_embeddings(config)
+        return _EMBEDDINGS[key]
+
+
+def _init_embeddings(config):
+    model_name = get_embedding_model_name(config)
+    if config.embedding_backend == "local":
+        embeddings = LocalEmbeddings(
+            model_name,
+            batch_size=config.local_embedding_batch_size,
+            n_threads=config.local_embedding_threads,
+        )
+    else:
+        embeddings = ScheduledEmbeddings(
+            lazy_import.LazyObject(lambda: _init_openai_embeddings(model_name)),
+            rate_limiting.get_rate_limiter(
+                model_name,
+                requests_per_minute=config.embedding_requests_per_minute,
+                tokens_per_minute=config.embedding_tokens_per_minute,
+            ),
+            max_batch_tokens=config.embedding_batch_max_tokens,
+            max_batch_size=config.embedding_batch_max_size,
+            max_concurrency=config.max_concurrent_embedding_batches,
+            max_retries=config.embedding_max_retries,
+        )
+    if not config.use_embedding_cache:
+        return embeddings
+    store = embedding_cache.get_embedding_store(config.cache_dir, model_name)
+    return CachedEmbeddings(embeddings, store, model_name)
@@ -0,0 +1,312 @@
+import asyncio
+import contextlib
+import threading
+import time
+import urllib.parse
+import weakref
+
+import httpx
+import requests
+import structlog
+from requests.adapters import HTTPAdapter
+
+import instrumentation
+import rate_limiting
+import search_util
+from search_util import HostLimiter
+
+logger = structlog.get_logger(__name__)
+
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+# async clients are bound to the event loop they were created in
+_ASYNC_CLIENTS = weakref.WeakKeyDictionary()
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "bytes": self.bytes,
+            "total_latency": self.total_latency,
+            "mean_latency": (
+                self.total_latency / self.requests if self.requests else 0.0
+            ),
+            "max_latency": self.max_latency,
+        }
+
+
+class _BaseHttpClient:
+    def __init__(self, max_retries, backoff_base, backoff_max):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _record(self, endpoint, latency=None, n_bytes=0, error=False, retry=False):
+        with self._stats_lock:
+            stats = self._stats.setdefault(endpoint, EndpointStats())
+            if latency is not None:
+                stats.requests += 1
+                stats.bytes += n_bytes
+                stats.total_latency += latency
+                stats.max_latency = max(stats.max_latency, latency)
+            stats.errors += int(error)
+            stats.retries += int(retry)
+        if latency is not None:
+            instrumentation.add("http_requests")
+            instrumentation.add("http_bytes", n_bytes)
+
+    def _backoff(self, attempt, headers=None):
+        retry_after = rate_limiting.parse_retry_after(headers)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return rate_limiting.backoff_delay(attempt, self.backoff_base, self.backoff_max)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                endpoint: stats.to_dict() for endpoint, stats in self._stats.items()
+            }
+
+
+class HttpClient(_BaseHttpClient):
+    """
+    A thread-safe HTTP client with connection pooling, timeouts, per-host concurrency
+    limits, and retries with exponential backoff and jitter on throttled or failed
+    requests. Requests, bytes and latencies are counted per endpoint.
+    """
+
+    def __init__(
+        self,
+        connect_timeout=5.0,
+        read_timeout=30.0,
+        max_retries=3,
+        backoff_base=0.5,
+        backoff_max=30.0,
+        pool_size=32,
+        max_requests_per_host=8,
+        headers=None,
+    ):
+        super().__init__(max_retries, backoff_base, backoff_max)
+        self.timeout = (connect_timeout, read_timeout)
+        self.host_limiter = HostLimiter(max_requests_per_host)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(headers or search_util.HEADERS)
+
+    def get(self, url, endpoint, params=None):
+        """
+        Send a GET request, retrying on connection errors, timeouts and 429/5xx
+        responses.
+
+        Parameters:
+        url (str): The URL to request.
+        endpoint (str): Name of the endpoint under which the request is counted.
+        params (dict or None): Query parameters of the request.
+
+        Returns:
+        requests.Response: The successful response.
+        """
+        for attempt in range(self.max_retries + 1):
+            is_last_attempt = attempt == self.max_retries
+            start = time.perf_counter()
+            try:
+                with self.host_limiter.limit(url):
+                    resp = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(endpoint, error=True, retry=not is_last_attempt)
+                if is_last_attempt:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(
+                    f"Request to '{url}' failed: {repr(e)}. Retrying in {delay:.2f}s"
+                )
+                time.sleep(delay)
+                continue
+
+            self._record(endpoint, time.perf_counter() - start, len(resp.content))
+            if resp.status_code in RETRY_STATUS_CODES and not is_last_attempt:
+                self._record(endpoint, error=True, retry=True)
+                delay = self._backoff(attempt, resp.headers)
+                logger.warning(
+                    f"Request to '{url}' returned status {resp.status_code}. "
+                    f"Retrying in {delay:.2f}s"
+                )
+                time.sleep(delay)
+                continue
+            if not resp.ok:
+                self._record(endpoint, error=True)
+            resp.raise_for_status()
+            return resp
+
+
+class AsyncHttpClient(_BaseHttpClient):
+    """
+    The asyncio counterpart of HttpClient, built on `httpx.AsyncClient`. An instance
+    must only be used within the event loop it was created in.
+    """
+
+    def __init__(
+        self,
+        connect_timeout=5.0,
+        read_timeout=30.0,
+        max_retries=3,
+        backoff_base=0.5,
+        backoff_max=30.0,
+        pool_size=32,
+        max_requests_per_host=8,
+        headers=None,
+    ):
+        super().__init__(max_retries, backoff_base, backoff_max)
+        self.max_requests_per_host = max_requests_per_host
+        self.client = httpx.AsyncClient(
+            headers=headers or search_util.HEADERS,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            follow_redirects=True,
+        )
+        self._host_semaphores = {}
+
+    @contextlib.asynccontextmanager
+    async def _limit(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.max_requests_per_host)
+        async with self._host_semaphores[host]:
+            yield
+
+    async def get(self, url, endpoint, params=None):
+        """
+        Send a GET request, retrying on connection errors, timeouts and 429/5xx
+        responses.
+
+        Parameters:
+        url (str): The URL to request.
+        endpoint (str): Name of the endpoint under which the request is counted.
+        params (dict or None): Query parameters of the request.
+
+        Returns:
+        httpx.Response: The successful response.
+        """
+        for attempt in range(self.max_retries + 1):
+            is_last_attempt = attempt == self.max_retries
+            start = time.perf_counter()
+            try:
+                async with self._limit(url):
+                    resp = await self.client.get(url, params=params)
+            except httpx.TransportError as e:
+                self._record(endpoint, error=True, retry=not is_last_attempt)
+                if is_last_attempt:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(
+                    f"Request to '{url}' failed: {repr(e)}. Retrying in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            self._record(endpoint, time.perf_counter() - start, len(resp.content))
+            if resp.status_code in RETRY_STATUS_CODES and not is_last_attempt:
+                self._record(endpoint, error=True, retry=True)
+                delay = self._backoff(attempt, resp.headers)
+                logger.warning(
+                    f"Request to '{url}' returned status {resp.status_code}. "
+                    f"Retrying in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+                continue
+            if not resp.is_success:
+                self._record(endpoint, error=True)
+            resp.raise_for_status()
+            return resp
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def get_http_client(config):
+    """
+    Get the process-wide HttpClient for the given configuration, creating it on first
+    use so that connections are reused across searches.
+
+    Parameters:
+    config (Config): A Config object containing:
+                     - http_connect_timeout (float): Connect timeout in seconds.
+                     - http_read_timeout (float): Read timeout in seconds.
+                     - http_max_retries (int): Maximum number of retries per request.
+                     - http_backoff_base (float): Base delay of the exponential
+                                                  backoff in seconds.
+                     - http_backoff_max (float): Maximum backoff delay in seconds.
+                     - http_pool_size (int): Number of pooled connections per host.
+                     - max_requests_per_host (int): Maximum number of concurrent
+                                                    requests to a single host.
+
+    Returns:
+    HttpClient: The HTTP client.
+    """
+    key = _client_key(config)
+    with _CLIENTS_LOCK:
+        if key not in _CLIENTS:
+            _CLIENTS[key] = HttpClient(*key)
+        return _CLIENTS[key]
+
+
+def get_async_http_client(config):
+    """
+    Get the AsyncHttpClient of the running event loop for the given configuration,
+    creating it on first use so that connections are reused across searches.
+
+    Parameters:
+    config (Config): A Config object with the same HTTP settings as required by
+                     `get_http_client`.
+
+    Returns:
+    AsyncHttpClient: The async HTTP client.
+    """
+    loop = asyncio.get_running_loop()
+    key = _client_key(config)
+    clients = _ASYNC_CLIENTS.setdefault(loop, {})
+    if key not in clients:
+        clients[key] = AsyncHttpClient(*key)
+    return clients[key]
+
+
+async def aclose_async_http_clients():
+    """
+    Close the AsyncHttpClients of the running event loop and their connections. They
+    are recreated if they are needed again.
+    """
+    clients = _ASYNC_CLIENTS.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
+
+
+def _client_key(config):
+    return (
+        config.http_connect_timeout,
+        config.http_read_timeout,
+        config.http_max_retries,
+        config.http_backoff_base,
+        config.http_backoff_max,
+        config.http_pool_size,
+        config.max_requests_per_host,
+    )
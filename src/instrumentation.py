@@ -0,0 +1,270 @@
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+METRIC_PREFIX = "citation_finder_stage"
+COUNTERS = {
+    "http_requests": "Number of HTTP responses received.",
+    "http_bytes": "Number of HTTP response body bytes received.",
+    "llm_calls": "Number of language model calls.",
+    "llm_input_tokens": "Number of input tokens of language model calls.",
+    "llm_output_tokens": "Number of output tokens of language model calls.",
+    "embedded_texts": "Number of texts embedded by the embedding model.",
+    "embedding_tokens": "Estimated number of tokens sent to the embedding API.",
+}
+
+# the (Metrics, stage name) pair that counters are currently recorded into
+_SCOPE = contextvars.ContextVar("instrumentation_scope", default=None)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else None
+
+
+def get_peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_rss_bytes():
+    """
+    Get the current resident memory of the process, unlike `get_peak_rss_bytes`,
+    which only ever grows.
+
+    Returns:
+    int or None: The resident memory in bytes, or None if not available, e.g. on
+                 other systems than Linux.
+    """
+    if _PAGE_SIZE is None:
+        return None
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StageStats:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_rss_growth_bytes = 0
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "seconds": self.seconds,
+            "max_rss_growth_bytes": self.max_rss_growth_bytes,
+            **self.counters,
+        }
+
+
+class Metrics:
+    """
+    Thread-safe per-stage measurements of a single search: wall time, number of calls,
+    HTTP traffic, language model tokens, embedded texts and the largest growth of the
+    process's resident memory during a call of the stage. The memory is sampled at
+    the start and end of each call, so memory freed within the call is not counted,
+    and calls running concurrently with other stages count their memory too.
+
+    Stages are entered with `stage`, which makes them the target of the counters
+    recorded with the module-level `add` in the same thread or task. Worker threads
+    don't inherit the stage, so functions run in thread pools are wrapped with `bind`.
+    Time of stages run concurrently, e.g. the scraping of many articles, is summed.
+    """
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def _get_stats(self, name):
+        if name not in self._stages:
+            self._stages[name] = StageStats()
+        return self._stages[name]
+
+    @contextlib.contextmanager
+    def stage(self, name, count_call=True):
+        """
+        Measure a stage and record the counters of the code run within it.
+
+        Parameters:
+        name (str): Name of the stage, sub-stages are named "<stage>.<sub-stage>".
+        count_call (bool): Whether to count this as a new call of the stage, False to
+                           resume measuring a call that was interrupted.
+        """
+        token = _SCOPE.set((self, name))
+        start_rss_bytes = get_rss_bytes()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - start
+            _SCOPE.reset(token)
+            end_rss_bytes = get_rss_bytes()
+            with self._lock:
+                stats = self._get_stats(name)
+                stats.calls += int(count_call)
+                stats.seconds += seconds
+                if start_rss_bytes is not None and end_rss_bytes is not None:
+                    stats.max_rss_growth_bytes = max(
+                        stats.max_rss_growth_bytes, end_rss_bytes - start_rss_bytes
+                    )
+
+    def add(self, name, counter, value=1):
+        with self._lock:
+            counters = self._get_stats(name).counters
+            counters[counter] = counters.get(counter, 0) + value
+
+    def merge(self, other):
+        """
+        Add the measurements of another Metrics, e.g. of another search, to these.
+
+        Parameters:
+        other (Metrics): The Metrics to add.
+        """
+        with other._lock:
+            stages = [
+                (
+                    name,
+                    stats.calls,
+                    stats.seconds,
+                    stats.max_rss_growth_bytes,
+                    dict(stats.counters),
+                )
+                for name, stats in other._stages.items()
+            ]
+        with self._lock:
+            for name, calls, seconds, max_rss_growth_bytes, counters in stages:
+                stats = self._get_stats(name)
+                stats.calls += calls
+                stats.seconds += seconds
+                stats.max_rss_growth_bytes = max(
+                    stats.max_rss_growth_bytes, max_rss_growth_bytes
+                )
+                for counter, value in counters.items():
+                    stats.counters[counter] = stats.counters.get(counter, 0) + value
+
+    def to_dict(self):
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in self._stages.items()}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_prometheus(self, openmetrics=False):
+        """
+        Export the measurements in the Prometheus text exposition format, with one
+        sample per stage labelled by the stage name.
+
+        Parameters:
+        openmetrics (bool): Whether to follow the OpenMetrics text format instead.
+
+        Returns:
+        str: The exported measurements.
+        """
+        stages = self.to_dict()
+        families = [
+            ("calls", "counter", "Number of calls of the stage."),
+            ("seconds", "counter", "Wall time spent in the stage."),
+            (
+                "max_rss_growth_bytes",
+                "gauge",
+                "Largest growth of the process's resident memory during a call of the "
+                "stage.",
+            ),
+        ] + [(counter, "counter", help_) for counter, help_ in COUNTERS.items()]
+        lines = []
+        for key, metric_type, help_ in families:
+            family = f"{METRIC_PREFIX}_{key}"
+            sample = f"{family}_total" if metric_type == "counter" else family
+            # OpenMetrics names counter families without the `_total` suffix
+            name = family if openmetrics else sample
+            lines.append(f"# HELP {name} {help_}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for stage, stats in stages.items():
+                label = stage.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'{sample}{{stage="{label}"}} {stats.get(key, 0)}')
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def current():
+    """
+    Get the Metrics of the stage that is currently measured, or None.
+    """
+    scope = _SCOPE.get()
+    return scope[0] if scope is not None else None
+
+
+@contextlib.contextmanager
+def stage(name, metrics=None, count_call=True):
+    """
+    Measure a stage with the given Metrics, or with the Metrics of the enclosing stage
+    if None. Does nothing if there is neither, so that instrumented code also runs
+    outside of a measured search.
+
+    Parameters:
+    name (str): Name of the stage.
+    metrics (Metrics or None): The Metrics to record into.
+    count_call (bool): Whether to count this as a new call of the stage.
+    """
+    if metrics is None:
+        metrics = current()
+    if metrics is None:
+        yield None
+        return
+    with metrics.stage(name, count_call=count_call):
+        yield metrics
+
+
+def add(counter, value=1):
+    """
+    Add to a counter of the stage that is currently measured, if any.
+
+    Parameters:
+    counter (str): Name of the counter, one of `COUNTERS`.
+    value (int): Amount to add.
+    """
+    scope = _SCOPE.get()
+    if scope is not None:
+        metrics, name = scope
+        metrics.add(name, counter, value)
+
+
+def bind(func):
+    """
+    Bind a function to the stage that is currently measured, so that it records into
+    that stage when called from a worker thread.
+
+    Parameters:
+    func (callable): The function.
+
+    Returns:
+    callable: The bound function.
+    """
+    scope = _SCOPE.get()
+    if scope is None:
+        return func
+
+    def wrapper(*args, **kwargs):
+        token = _SCOPE.set(scope)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _SCOPE.reset(token)
+
+    return wrapper
@@ -0,0 +1,123 @@
+import importlib
+import importlib.util
+import sys
+import threading
+import time
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+
+_IMPORT_TIMES = {}
+_IMPORT_TIMES_LOCK = threading.Lock()
+
+
+def import_module(name):
+    """
+    Import a module, recording how long the import took if the module was not
+    imported yet.
+
+    Parameters:
+    name (str): Full name of the module.
+
+    Returns:
+    module: The module.
+    """
+    if name in sys.modules:
+        # waits for the module if it's still being imported by another thread
+        return importlib.import_module(name)
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    seconds = time.perf_counter() - start
+    with _IMPORT_TIMES_LOCK:
+        _IMPORT_TIMES.setdefault(name, seconds)
+    logger.debug(f"Imported '{name}' in {seconds:.3f}s")
+    return module
+
+
+def is_available(name):
+    """
+    Check whether a module is installed without importing it.
+
+    Parameters:
+    name (str): Full name of the module.
+
+    Returns:
+    bool: Whether the module can be imported.
+    """
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:
+        # the parent package of a submodule is missing
+        return False
+
+
+def import_times():
+    """
+    Get the time taken by each module imported with `import_module`.
+
+    Returns:
+    dict: A dictionary mapping module names to import times in seconds, in import
+          order.
+    """
+    with _IMPORT_TIMES_LOCK:
+        return dict(_IMPORT_TIMES)
+
+
+def preload(names):
+    """
+    Import modules in a background thread, so that their import overlaps with other
+    work, such as waiting for the language model, instead of delaying a later step.
+
+    Parameters:
+    names (list[str]): Full names of the modules. Modules that are not installed are
+                       skipped.
+
+    Returns:
+    threading.Thread: The importing thread.
+    """
+
+    def import_all():
+        for name in names:
+            if is_available(name):
+                import_module(name)
+
+    thread = threading.Thread(target=import_all, daemon=True)
+    thread.start()
+    return thread
+
+
+class LazyModule:
+    """
+    A module that is imported on first attribute access, so that heavy dependencies
+    only slow down the processes that actually use them.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(import_module(self._name), attr)
+
+
+class LazyObject:
+    """
+    An object created by `factory` on first attribute access, e.g. an API client
+    that is not needed if all results are found in the caches.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._object = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._object is None:
+            with self._lock:
+                if self._object is None:
+                    self._object = self._factory()
+        return self._object
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
@@ -1,18 +1,286 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
 import os
+import threading
+import time
 
-from langchain.schema import HumanMessage, SystemMessage
+import structlog
+from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.prompts.chat import MessagesPlaceholder
-from langchain_openai import ChatOpenAI
+
+import instrumentation
+import lazy_import
+import rate_limiting
+
+# the OpenAI client is only imported once a language model is created
+langchain_openai = lazy_import.LazyModule("langchain_openai")
+
+logger = structlog.get_logger(__name__)
+
+
+# lanes in order of precedence
+PRIORITIES = ("interactive", "bulk")
+# tokens reserved for the response of a call, whose size is only known afterwards
+OUTPUT_TOKENS_ALLOWANCE = 256
+
+_SCHEDULERS = {}
+_SCHEDULERS_LOCK = threading.Lock()
+
+
+class LaneStats:
+    def __init__(self):
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "total_wait": self.total_wait,
+            "mean_wait": self.total_wait / self.requests if self.requests else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class _Waiter:
+    """
+    A call waiting for a slot of an LLMScheduler, woken by whichever thread frees
+    the slot: with an event if the call waits in a thread, or with a future of its
+    event loop if it waits in a coroutine.
+    """
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.granted = False
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+        self.granted = True
+
+
+class LLMScheduler:
+    """
+    A thread-safe scheduler of language model calls shared by all assistants. It
+    bounds the number of concurrent calls, keeps the calls within requests and tokens
+    per minute budgets, and serves waiting calls by priority lane, so that interactive
+    calls are not stuck behind bulk work. Calls within a lane are served in order of
+    arrival. Calls may wait in threads with `acquire` or in coroutines with
+    `aacquire`, which share the same queue.
+    """
+
+    def __init__(self, max_concurrency=16, rate_limiter=None):
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter or rate_limiting.RateLimiter()
+        self._lock = threading.Lock()
+        self._queue = []
+        self._counter = itertools.count()
+        self._active = 0
+        self._max_queue_depth = 0
+        self._lanes = {priority: LaneStats() for priority in PRIORITIES}
+
+    def _grant(self):
+        # hands the free slots to the first waiting calls, called with the lock held
+        while self._queue and self._active < self.max_concurrency:
+            _, _, waiter = heapq.heappop(self._queue)
+            try:
+                waiter.wake()
+            except RuntimeError:
+                # the event loop of the call has been closed
+                continue
+            self._active += 1
+
+    def _enqueue(self, priority, loop=None):
+        waiter = _Waiter(loop)
+        with self._lock:
+            heapq.heappush(
+                self._queue, (PRIORITIES.index(priority), next(self._counter), waiter)
+            )
+            self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+            self._grant()
+        return waiter
+
+    def _cancel(self, waiter):
+        # a call that stopped waiting gives back its slot if it was granted one
+        # meanwhile, or leaves the queue otherwise
+        with self._lock:
+            if waiter.granted:
+                self._active -= 1
+                self._grant()
+            else:
+                self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+                heapq.heapify(self._queue)
+
+    def _record_wait(self, priority, start):
+        wait = time.perf_counter() - start
+        with self._lock:
+            lane = self._lanes[priority]
+            lane.requests += 1
+            lane.total_wait += wait
+            lane.max_wait = max(lane.max_wait, wait)
+
+    def acquire(self, priority="bulk", n_tokens=0):
+        """
+        Block until the call may be sent.
+
+        Parameters:
+        priority (str): The priority lane of the call, one of `PRIORITIES`.
+        n_tokens (int): Estimated number of tokens of the call.
+        """
+        start = time.perf_counter()
+        waiter = self._enqueue(priority)
+        try:
+            waiter.event.wait()
+        except BaseException:
+            self._cancel(waiter)
+            raise
+        try:
+            self.rate_limiter.acquire(n_tokens)
+        except BaseException:
+            self.release()
+            raise
+        self._record_wait(priority, start)
+
+    async def aacquire(self, priority="bulk", n_tokens=0):
+        """
+        Async version of `acquire`, waiting without blocking the event loop or a
+        thread. If the waiting coroutine is cancelled, the call leaves the queue, or
+        gives back its slot if it has already been granted one.
+
+        Parameters:
+        priority (str): The priority lane of the call, one of `PRIORITIES`.
+        n_tokens (int): Estimated number of tokens of the call.
+        """
+        start = time.perf_counter()
+        waiter = self._enqueue(priority, asyncio.get_running_loop())
+        try:
+            await waiter.future
+        except BaseException:
+            self._cancel(waiter)
+            raise
+        try:
+            await asyncio.sleep(self.rate_limiter.reserve(n_tokens))
+        except BaseException:
+            self.release()
+            raise
+        self._record_wait(priority, start)
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            self._grant()
+
+    @contextlib.contextmanager
+    def slot(self, priority="bulk", n_tokens=0):
+        self.acquire(priority, n_tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self._active,
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self._max_queue_depth,
+                "lanes": {
+                    priority: lane.to_dict() for priority, lane in self._lanes.items()
+                },
+            }
+
+
+def _record_usage(response):
+    usage = getattr(response, "usage_metadata", None) or {}
+    instrumentation.add("llm_calls")
+    instrumentation.add("llm_input_tokens", usage.get("input_tokens", 0))
+    instrumentation.add("llm_output_tokens", usage.get("output_tokens", 0))
 
 
 class Assistant:
-    def __init__(self, runnable):
+    def __init__(self, runnable, scheduler=None, priority="bulk", system_prompt=None):
         self.runnable = runnable
+        self.scheduler = scheduler
+        self.priority = priority
+        # the system prompt is sent with every call, so it is estimated only once
+        self.prompt_tokens = (
+            rate_limiting.estimate_tokens(system_prompt) if system_prompt else 0
+        )
+
+    def _estimate_tokens(self, message_content):
+        return (
+            self.prompt_tokens
+            + rate_limiting.estimate_tokens(message_content)
+            + OUTPUT_TOKENS_ALLOWANCE
+        )
 
     def invoke(self, message_content):
         messages = [HumanMessage(content=message_content)]
-        return self.runnable.invoke({"messages": messages})
+        if self.scheduler is None:
+            response = self.runnable.invoke({"messages": messages})
+        else:
+            n_tokens = self._estimate_tokens(message_content)
+            with self.scheduler.slot(self.priority, n_tokens):
+                response = self.runnable.invoke({"messages": messages})
+        _record_usage(response)
+        return response
+
+    async def ainvoke(self, message_content):
+        messages = [HumanMessage(content=message_content)]
+        if self.scheduler is None:
+            response = await self.runnable.ainvoke({"messages": messages})
+        else:
+            n_tokens = self._estimate_tokens(message_content)
+            await self.scheduler.aacquire(self.priority, n_tokens)
+            try:
+                response = await self.runnable.ainvoke({"messages": messages})
+            finally:
+                self.scheduler.release()
+        _record_usage(response)
+        return response
+
+
+def get_llm_scheduler(config):
+    """
+    Get the process-wide LLMScheduler of the configured language model, creating it
+    on first use, so that all assistants share the same budgets.
+
+    Parameters:
+    config (Config): A Config object containing:
+                     - model_name (str): Name of the language model.
+                     - llm_max_concurrency (int): Maximum number of concurrent calls.
+                     - llm_requests_per_minute (int or None): Request rate limit.
+                     - llm_tokens_per_minute (int or None): Token rate limit.
+
+    Returns:
+    LLMScheduler: The scheduler.
+    """
+    key = (
+        config.model_name,
+        config.llm_max_concurrency,
+        config.llm_requests_per_minute,
+        config.llm_tokens_per_minute,
+    )
+    with _SCHEDULERS_LOCK:
+        if key not in _SCHEDULERS:
+            _SCHEDULERS[key] = LLMScheduler(
+                max_concurrency=config.llm_max_concurrency,
+                rate_limiter=rate_limiting.RateLimiter(
+                    config.llm_requests_per_minute, config.llm_tokens_per_minute
+                ),
+            )
+        return _SCHEDULERS[key]
 
 
 def init_assistant_runnable(system_prompt, tools, config):
@@ -26,7 +294,9 @@ def init_assistant_runnable(system_prompt, tools, config):
         ]
     )
     llm = (
-        ChatOpenAI(model_name=config.model_name, temperature=config.temperature)
+        langchain_openai.ChatOpenAI(
+            model_name=config.model_name, temperature=config.temperature
+        )
         .bind_tools(tools=tools, strict=True)
     )
     return assistant_prompt | llm
@@ -1,7 +1,9 @@
 import argparse
+import time
 
-from app import CitationFinder
+import printing
 from config import Config
+from instrumentation import Metrics
 
 
 def parse_args():
@@ -15,6 +17,62 @@ def parse_args():
         default="Covid 19 increased the likelihood of heart complications",
         help="Input sentence for which you want to find citations."
     )
+    parser.add_argument(
+        "--input_file",
+        type=str,
+        default=None,
+        help=(
+            "Path to a text file with one input sentence per line. If given, "
+            "citations are searched for all sentences at once and `--input_sentence` "
+            "is ignored."
+        )
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=(
+            "Print each citation as soon as it has been found instead of after the "
+            "whole search has completed."
+        )
+    )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default=None,
+        choices=["json", "prometheus", "openmetrics"],
+        help=(
+            "Print the time and resources spent in each stage of the search to "
+            "stderr in the given format."
+        )
+    )
+    parser.add_argument(
+        "--profile_imports",
+        action="store_true",
+        help=(
+            "Print the time spent importing dependencies and setting up CitationFinder "
+            "to stderr."
+        )
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help=(
+            "Run a local HTTP/JSON server that keeps CitationFinder warm between "
+            "requests instead of searching a single input."
+        )
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Host the server listens on."
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="Port the server listens on."
+    )
 
     parser.add_argument(
         "--n_articles",
@@ -28,6 +86,53 @@ def parse_args():
         default=10,
         help="Number of documents to retrieve from the vector database."
     )
+    parser.add_argument(
+        "--reranker",
+        type=str,
+        default=None,
+        choices=["bm25", "cross_encoder"],
+        help=(
+            "Local reranker narrowing down retrieved documents before they are graded "
+            "by the language model."
+        )
+    )
+    parser.add_argument(
+        "--n_docs_grade",
+        type=int,
+        default=5,
+        help="Number of reranked documents graded by the language model."
+    )
+    parser.add_argument(
+        "--vectorstore_backend",
+        type=str,
+        default="chroma",
+        choices=["chroma", "numpy"],
+        help="Vector store used to retrieve documents."
+    )
+    parser.add_argument(
+        "--embedding_backend",
+        type=str,
+        default="openai",
+        choices=["openai", "local"],
+        help=(
+            "Whether to embed documents with the OpenAI API or with a local model on "
+            "the CPU."
+        )
+    )
+    parser.add_argument(
+        "--pubmed_backend",
+        type=str,
+        default="html",
+        choices=["html", "eutils"],
+        help="Whether to scrape PubMed web pages or to use the NCBI E-utilities API."
+    )
+    parser.add_argument(
+        "--html_parser",
+        type=str,
+        default="bs4",
+        choices=["bs4", "lxml"],
+        help="HTML parsing backend used to parse scraped articles."
+    )
     parser.add_argument(
         "--model_name",
         type=str,
@@ -85,6 +190,12 @@ def run():
     config = Config(
         n_articles_per_query=args.n_articles,
         n_docs_retrival=args.n_docs,
+        reranker=args.reranker,
+        n_docs_grade=args.n_docs_grade,
+        vectorstore_backend=args.vectorstore_backend,
+        embedding_backend=args.embedding_backend,
+        pubmed_backend=args.pubmed_backend,
+        html_parser=args.html_parser,
         model_name=args.model_name,
         temperature=args.temperature,
         reset_vectorstore_after_retrieval=args.reset_vectorstore,
@@ -93,9 +204,54 @@ def run():
         langchain_tracing_v2=args.langchain_tracing_v2,
         langchain_endpoint=args.langchain_endpoint,
         langchain_user_agent=args.langchain_user_agent,
+        server_host=args.host,
+        server_port=args.port,
     )
+    if args.serve:
+        import server
+
+        server.serve(config)
+        return
+    start = time.perf_counter()
+    # imported after parsing the arguments, so that `--help` doesn't wait for the
+    # dependencies
+    import lazy_import
+    from app import CitationFinder
+
+    imported = time.perf_counter()
     app = CitationFinder(config)
-    app.search(args.input_sentence)
+    # the remaining dependencies are imported while the search is started
+    app.warm_up(background=True)
+    set_up = time.perf_counter()
+    metrics = Metrics()
+    if args.input_file is not None:
+        final_states = app.search_many(
+            _read_sentences(args.input_file), return_mode="return"
+        )
+        printing.print_many_outputs(final_states)
+        if final_states:
+            metrics = final_states[0]["metrics"]
+    elif args.stream:
+        printing.print_stream(app.search_stream(args.input_sentence, metrics))
+    else:
+        final_state = app.search(args.input_sentence, return_mode="return")
+        printing.print_output(final_state)
+        metrics = final_state["metrics"]
+    if args.metrics is not None:
+        printing.print_metrics(metrics, args.metrics)
+    if args.profile_imports:
+        printing.print_import_profile(
+            {
+                "import app": imported - start,
+                "CitationFinder": set_up - imported,
+                **lazy_import.import_times(),
+            }
+        )
+
+
+def _read_sentences(path):
+    with open(path, "r") as f:
+        return [line.strip() for line in f if line.strip()]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,212 @@
+import threading
+import uuid
+
+import numpy as np
+import structlog
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+logger = structlog.get_logger(__name__)
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores, k):
+    k = min(k, len(scores))
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    # argpartition doesn't keep the order of ties, so they are ordered by row to keep
+    # the results deterministic
+    return top[np.lexsort((top, -scores[top]))]
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    An in-memory vector store doing exact k-nearest-neighbour search by cosine
+    similarity. The embeddings are held in one contiguous float32 matrix, so a query
+    is a single matrix-vector product over the candidate rows followed by
+    `argpartition`, without the overhead of setting up a database collection.
+
+    Texts and metadata are stored as given, so that metadata shared by the paragraphs
+    of an article is stored once, and Documents are only created for search results.
+
+    Only the parts of the Chroma interface used by CitationFinder are supported:
+    filters must be of the form `{"url": {"$in": urls}}`. Deleting documents compacts
+    the matrix, so it is meant for occasional removal of stale documents.
+    """
+
+    def __init__(self, embedding_function, initial_capacity=1024):
+        self.embedding_function = embedding_function
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._initial_capacity = initial_capacity
+        self._n_rows = 0
+        self._ids = []
+        self._texts = []
+        self._metadatas = []
+        self._row_by_id = {}
+        self._rows_by_url = {}
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def __len__(self):
+        return self._n_rows
+
+    def _reserve(self, n_new_rows, dim):
+        if self._matrix is None:
+            capacity = max(self._initial_capacity, n_new_rows)
+            self._matrix = np.empty((capacity, dim), dtype=np.float32)
+        elif self._n_rows + n_new_rows > self._matrix.shape[0]:
+            # grow geometrically so that appends are amortized O(1)
+            capacity = max(2 * self._matrix.shape[0], self._n_rows + n_new_rows)
+            matrix = np.empty((capacity, dim), dtype=np.float32)
+            matrix[:self._n_rows] = self._matrix[:self._n_rows]
+            self._matrix = matrix
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+        if not texts:
+            return []
+        vectors = _normalize(self.embedding_function.embed_documents(texts))
+        with self._lock:
+            self._reserve(len(texts), vectors.shape[1])
+            for text, metadata, id_, vector in zip(texts, metadatas, ids, vectors):
+                if id_ in self._row_by_id:
+                    row = self._row_by_id[id_]
+                    self._texts[row] = text
+                    self._metadatas[row] = metadata
+                else:
+                    row = self._n_rows
+                    self._n_rows += 1
+                    self._row_by_id[id_] = row
+                    self._ids.append(id_)
+                    self._texts.append(text)
+                    self._metadatas.append(metadata)
+                    url = metadata.get("url")
+                    self._rows_by_url.setdefault(url, []).append(row)
+                self._matrix[row] = vector
+        return ids
+
+    def get(self, ids=None, where=None, include=None):
+        with self._lock:
+            if where is not None:
+                rows = self._candidate_rows(where)
+                found = [self._ids[row] for row in rows]
+                if ids is not None:
+                    ids = set(ids)
+                    found = [id_ for id_ in found if id_ in ids]
+                return {"ids": found}
+            if ids is None:
+                ids = list(self._row_by_id)
+            return {"ids": [id_ for id_ in ids if id_ in self._row_by_id]}
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return
+        with self._lock:
+            deleted = {self._row_by_id[id_] for id_ in ids if id_ in self._row_by_id}
+            if not deleted:
+                return
+            kept = [row for row in range(self._n_rows) if row not in deleted]
+            self._matrix[:len(kept)] = self._matrix[kept]
+            self._n_rows = len(kept)
+            self._ids = [self._ids[row] for row in kept]
+            self._texts = [self._texts[row] for row in kept]
+            self._metadatas = [self._metadatas[row] for row in kept]
+            self._row_by_id = {id_: row for row, id_ in enumerate(self._ids)}
+            self._rows_by_url = {}
+            for row, metadata in enumerate(self._metadatas):
+                self._rows_by_url.setdefault(metadata.get("url"), []).append(row)
+
+    def delete_collection(self):
+        with self._lock:
+            self._matrix = None
+            self._n_rows = 0
+            self._ids = []
+            self._texts = []
+            self._metadatas = []
+            self._row_by_id = {}
+            self._rows_by_url = {}
+
+    def _candidate_rows(self, filter):
+        if filter is None:
+            return np.arange(self._n_rows)
+        if set(filter) != {"url"} or set(filter["url"]) != {"$in"}:
+            raise ValueError(f"Unsupported filter {filter}")
+        rows = [
+            row
+            for url in filter["url"]["$in"]
+            for row in self._rows_by_url.get(url, [])
+        ]
+        return np.asarray(sorted(rows), dtype=np.int64)
+
+    def _document(self, row):
+        # a copy of the metadata, so that the stored metadata can't be modified
+        return Document(
+            page_content=self._texts[row], metadata=dict(self._metadatas[row])
+        )
+
+    def _search(self, embedding, k, filter):
+        query = _normalize(embedding)
+        with self._lock:
+            rows = self._candidate_rows(filter)
+            if len(rows) == 0:
+                return rows, np.zeros(0, dtype=np.float32), None
+            # contiguous fast path when searching the whole matrix
+            vectors = (
+                self._matrix[:self._n_rows]
+                if len(rows) == self._n_rows
+                else self._matrix[rows]
+            )
+            scores = vectors @ query
+            top = _top_k(scores, k)
+            return rows[top], scores[top], vectors[top]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        rows, _, _ = self._search(embedding, k, filter)
+        return [self._document(row) for row in rows]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None):
+        rows, scores, _ = self._search(embedding, k, filter)
+        return [(self._document(row), float(score)) for row, score in zip(rows, scores)]
+
+    def max_marginal_relevance_search_by_vector(
+        self, embedding, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs
+    ):
+        """
+        Retrieve documents similar to the embedding that are also diverse among
+        themselves, selected greedily by maximal marginal relevance among the
+        `fetch_k` most similar documents.
+        """
+        rows, scores, vectors = self._search(embedding, fetch_k, filter)
+        if len(rows) == 0:
+            return []
+        selected = [0]
+        # highest similarity of each candidate to the already selected documents
+        max_redundancy = vectors @ vectors[0]
+        while len(selected) < min(k, len(rows)):
+            mmr = lambda_mult * scores - (1 - lambda_mult) * max_redundancy
+            mmr[selected] = -np.inf
+            best = int(np.argmax(mmr))
+            selected.append(best)
+            max_redundancy = np.maximum(max_redundancy, vectors @ vectors[best])
+        return [self._document(rows[i]) for i in selected]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        embedding = self.embedding_function.embed_query(query)
+        return self.similarity_search_by_vector(embedding, k=k, filter=filter)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        vectorstore = cls(embedding)
+        vectorstore.add_texts(texts, metadatas=metadatas, ids=ids)
+        return vectorstore
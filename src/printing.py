@@ -1,3 +1,4 @@
+import sys
 import textwrap
 
 OUTPUT_TEMPLATE = """
@@ -35,5 +36,44 @@ def print_output(state):
         )
         return
     for i, doc in enumerate(docs):
-        print("=" * 43, f"[Citation {i+1}]", "=" * 43)
-        print(_format_output(**doc.metadata))
+        print_citation(i, doc)
+
+
+def print_citation(index, doc):
+    print("=" * 43, f"[Citation {index+1}]", "=" * 43)
+    print(_format_output(**doc.metadata))
+
+
+def print_stream(docs):
+    n_citations = 0
+    for doc in docs:
+        print_citation(n_citations, doc)
+        n_citations += 1
+    if n_citations == 0:
+        print_output({"docs": []})
+
+
+def print_metrics(metrics, metrics_format="json"):
+    # printed to stderr so that citations on stdout can still be piped
+    if metrics_format == "json":
+        print(metrics.to_json(indent=2), file=sys.stderr)
+    elif metrics_format in ["prometheus", "openmetrics"]:
+        text = metrics.to_prometheus(openmetrics=metrics_format == "openmetrics")
+        print(text, end="", file=sys.stderr)
+    else:
+        raise ValueError(f"Unknown metrics format '{metrics_format}'")
+
+
+def print_import_profile(seconds):
+    # printed to stderr so that citations on stdout can still be piped
+    print("Setup and import times:", file=sys.stderr)
+    for name, value in seconds.items():
+        print(f"  {name:<40} {value:8.3f}s", file=sys.stderr)
+
+
+def print_many_outputs(states):
+    for state in states:
+        print("#" * 100)
+        print(f"INPUT SENTENCE: {state['input_sentence']}")
+        print("#" * 100)
+        print_output(state)
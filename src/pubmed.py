@@ -1,22 +1,39 @@
-import concurrent
+import asyncio
+import concurrent.futures
 import datetime
-import functools
+import multiprocessing
+import os
 import re
+import threading
 
-import bs4
-import dateutil
-import requests
 import structlog
 
+import caching
+import http_util
+import instrumentation
+import lazy_import
+import pubmed_eutils
 import search_util
 from search_util import Article
 
 logger = structlog.get_logger(__name__)
 
+# parsers are imported on first use, only the configured HTML parser is needed
+bs4 = lazy_import.LazyModule("bs4")
+dateutil_parser = lazy_import.LazyModule("dateutil.parser")
+lxml_html = lazy_import.LazyModule("lxml.html")
 
 ARTICLE_BASE_URL = "https://www.ncbi.nlm.nih.gov/pmc/articles/pmid/"
 SEARCH_BASE_URL = "https://pubmed.ncbi.nlm.nih.gov/"
 
+_XML_DECLARATION = re.compile(r"^\s*<\?xml[^>]*\?>")
+
+_PARSE_POOLS = {}
+_PARSE_POOLS_LOCK = threading.Lock()
+
+# concurrent searches scraping the same article share a single fetch
+_SCRAPES = caching.SingleFlight()
+
 
 class PubMedParser:
     def __init__(self, soup):
@@ -74,16 +91,7 @@ class PubMedParser:
         int: The publication year of the article.
         """
         date = self.soup.find("span", class_="fm-vol-iss-date").text
-        stripped = date.replace("Published online ", "").replace(".", "").strip()
-        try:
-            return datetime.datetime.strptime(stripped, "%Y %b %d").date().year
-        except ValueError as e:
-            parsed = dateutil.parser.parse(stripped).date().year
-            logger.warning(
-                f"Error parsing date string '{stripped}': {repr(e)}. "
-                f"Used 'dateutil.parser' to parse the string to '{parsed}'"
-            )
-            return parsed
+        return _parse_year(date)
 
     @search_util.exception_handler
     def _parse_authors(self):
@@ -154,46 +162,341 @@ class PubMedParser:
             for paragraph in paragraphs:
                 if self._is_not_empty(paragraph):
                     cleaned = paragraph.text.replace("\n", "")
-                    # TODO: check that text is not in seen texts, this may happen
-                    # sometimes because footnotes use nested p tags and thus same text
-                    # gets added multiple times
+                    # footnotes use nested p tags and thus the same text sometimes
+                    # gets added multiple times, duplicates are removed when the
+                    # texts are chunked
                     texts.append(cleaned)
         return texts
 
 
-def _scrape_article(url):
+class LxmlPubMedParser(PubMedParser):
+    """
+    A faster alternative to PubMedParser built on lxml. The elements holding the
+    article fields are located in a single walk over the document tree, after which
+    each field is extracted from its own subtree. Produces the same output as
+    PubMedParser.
+    """
+
+    def __init__(self, html):
+        self.title_element = None
+        self.doi_element = None
+        self.date_element = None
+        self.abstract_element = None
+        self.author_elements = []
+        self.section_elements = []
+        # lxml rejects str input with an encoding declaration, which PMC pages served
+        # as XHTML start with
+        self._locate_elements(lxml_html.fromstring(_XML_DECLARATION.sub("", html)))
+
+    @staticmethod
+    def _has_class(element, class_):
+        # same semantics as `class_` in BeautifulSoup: a single class matches any of
+        # the element's classes, several classes must match the attribute exactly
+        value = element.get("class")
+        if value is None:
+            return False
+        return value == class_ or class_ in value.split()
+
+    def _locate_elements(self, root):
+        for element in root.iter():
+            tag = element.tag
+            if not isinstance(tag, str):
+                # comments and processing instructions
+                continue
+            if tag == "div":
+                # the abstract is usually a section as well, e.g.
+                # <div id="abstract-1" class="tsec sec">
+                if (
+                    self.abstract_element is None
+                    and element.get("id", "").startswith("abstract-")
+                ):
+                    self.abstract_element = element
+                if self._has_class(element, "contrib-group fm-author"):
+                    self.author_elements.append(element)
+                elif self._has_class(element, "tsec sec"):
+                    self.section_elements.append(element)
+            elif tag == "span":
+                if self.doi_element is None and self._has_class(element, "doi"):
+                    self.doi_element = element
+                elif (
+                    self.date_element is None
+                    and self._has_class(element, "fm-vol-iss-date")
+                ):
+                    self.date_element = element
+            elif (
+                tag == "h1"
+                and self.title_element is None
+                and self._has_class(element, "content-title")
+            ):
+                self.title_element = element
+
+    @search_util.exception_handler
+    def _parse_title(self):
+        return self.title_element.text_content()
+
+    @search_util.exception_handler
+    def _parse_doi(self):
+        return next(self.doi_element.iter("a")).text_content()
+
+    @search_util.exception_handler
+    def _parse_publication_year(self):
+        return _parse_year(self.date_element.text_content())
+
+    @search_util.exception_handler
+    def _parse_authors(self):
+        authors = []
+        for element in self.author_elements:
+            authors += [a.text_content() for a in element.iter("a")]
+        return authors
+
+    @search_util.exception_handler
+    def _parse_abstract(self):
+        if self.abstract_element is None:
+            return None
+        paragraphs = self.abstract_element.iter("p")
+        return "\n\n".join([p.text_content() for p in paragraphs])
+
+    @search_util.exception_handler
+    def _parse_texts(self):
+        texts = []
+        for section in self.section_elements:
+            for paragraph in section.iter("p"):
+                text = paragraph.text_content()
+                if text.strip() != "":
+                    texts.append(text.replace("\n", ""))
+        return texts
+
+
+def _parse_year(date):
+    """
+    Parse the publication year from a PubMed date string, such as
+    "Published online 2022 Feb 16.".
+
+    Parameters:
+    date (str): The date string.
+
+    Returns:
+    int: The publication year.
+    """
+    stripped = date.replace("Published online ", "").replace(".", "").strip()
+    try:
+        return datetime.datetime.strptime(stripped, "%Y %b %d").date().year
+    except ValueError as e:
+        parsed = dateutil_parser.parse(stripped).date().year
+        logger.warning(
+            f"Error parsing date string '{stripped}': {repr(e)}. "
+            f"Used 'dateutil.parser' to parse the string to '{parsed}'"
+        )
+        return parsed
+
+
+def _get_article_cache(config):
+    """
+    Get the persistent article cache, or None if article caching is disabled.
+
+    Parameters:
+    config (Config): A Config object containing:
+                     - use_article_cache (bool): Whether to cache scraped articles.
+                     - cache_dir (str): Directory of the persistent caches.
+                     - article_cache_ttl_days (float): Days after which cached
+                                                       articles expire.
+                     - article_cache_max_entries (int): Maximum number of cached
+                                                        articles.
+
+    Returns:
+    PersistentCache or None: The article cache.
+    """
+    if not config.use_article_cache:
+        return None
+    ttl_seconds = (
+        config.article_cache_ttl_days * 24 * 60 * 60
+        if config.article_cache_ttl_days is not None
+        else None
+    )
+    return caching.get_cache(
+        os.path.join(config.cache_dir, "articles.sqlite"),
+        ttl_seconds=ttl_seconds,
+        max_entries=config.article_cache_max_entries,
+    )
+
+
+def _pmid_from_url(url):
+    return url.rstrip("/").rsplit("/", 1)[-1]
+
+
+def _get_parse_pool(config):
+    """
+    Get the process-wide process pool used for parsing articles, creating it on first
+    use so that the worker processes are reused across searches.
+
+    Parameters:
+    config (Config): A Config object containing:
+                     - parse_workers (int): Number of worker processes, or 0 to parse
+                                            articles in the fetching threads.
+
+    Returns:
+    ProcessPoolExecutor or None: The process pool, or None if `parse_workers` is 0.
+    """
+    if config.parse_workers == 0:
+        return None
+    with _PARSE_POOLS_LOCK:
+        if config.parse_workers not in _PARSE_POOLS:
+            # "spawn" as forking a process with running threads is unsafe
+            _PARSE_POOLS[config.parse_workers] = concurrent.futures.ProcessPoolExecutor(
+                max_workers=config.parse_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            logger.debug(
+                f"Started article parsing pool with {config.parse_workers} processes"
+            )
+        return _PARSE_POOLS[config.parse_workers]
+
+
+def _parse_article(html, url, config):
+    """
+    Parse an article page, in the parsing process pool if one is configured and
+    otherwise in the calling thread.
+
+    Parameters:
+    html (str): The HTML of the article page.
+    url (str): The URL of the article.
+    config (Config): A Config object containing:
+                     - html_parser (str): The HTML parsing backend.
+                     - parse_workers (int): Number of parsing worker processes.
+
+    Returns:
+    Article: An Article object created from the parsed HTML content.
+    """
+    pool = _get_parse_pool(config)
+    if pool is None:
+        return _parse_article_html(html, url, config.html_parser)
+    record = pool.submit(_parse_article_record, html, url, config.html_parser).result()
+    return Article.from_dict(record)
+
+
+async def _aparse_article(html, url, config):
+    """
+    Async version of `_parse_article`, parsing in a worker thread if no process pool
+    is configured.
+
+    Parameters:
+    html (str): The HTML of the article page.
+    url (str): The URL of the article.
+    config (Config): A Config object with the same fields as required by
+                     `_parse_article`.
+
+    Returns:
+    Article: An Article object created from the parsed HTML content.
+    """
+    pool = _get_parse_pool(config)
+    if pool is None:
+        return await asyncio.to_thread(
+            _parse_article_html, html, url, config.html_parser
+        )
+    record = await asyncio.get_running_loop().run_in_executor(
+        pool, _parse_article_record, html, url, config.html_parser
+    )
+    return Article.from_dict(record)
+
+
+def _parse_article_record(html, url, html_parser):
+    # runs in the parsing worker processes, returns a plain dictionary as it is
+    # cheaper to send between processes than an Article object
+    return _parse_article_html(html, url, html_parser).to_dict()
+
+
+def _scrape_article(url, http_client, config, cache=None):
     """
-    Scrape a single article from a given URL and parse its content.
+    Scrape a single article from a given URL and parse its content. If a cache is
+    given, previously scraped articles are read from the cache by their PMID. An
+    article that is already being scraped by another thread, e.g. for a concurrent
+    search, is not fetched again.
 
     Parameters:
     url (str): The URL of the article to be scraped.
+    http_client (HttpClient): The HTTP client used to fetch the article.
+    config (Config): A Config object containing:
+                     - html_parser (str): The HTML parsing backend, either "bs4" or
+                                          "lxml".
+                     - parse_workers (int): Number of parsing worker processes.
+    cache (PersistentCache or None): Cache of parsed articles keyed by PMID.
 
     Returns:
     Article: An Article object created from the parsed HTML content.
     """
-    resp = requests.get(url, headers=search_util.HEADERS)
-    resp.raise_for_status()
-    soup = bs4.BeautifulSoup(resp.text, "html.parser")
-    parser = PubMedParser(soup)
-    return Article.from_parser(parser, url)
+    pmid = _pmid_from_url(url)
+    # searches with different parsers may parse the same page differently
+    key = (pmid, config.html_parser)
+    return _SCRAPES.do(key, _fetch_article, url, pmid, http_client, config, cache)
+
+
+def _fetch_article(url, pmid, http_client, config, cache):
+    with instrumentation.stage("document_search.scrape"):
+        cached = cache.get(pmid) if cache is not None else None
+        if cached is not None:
+            return Article.from_dict(cached)
+        resp = http_client.get(url, endpoint="pmc_article")
+    with instrumentation.stage("document_search.parse"):
+        article = _parse_article(resp.text, url, config)
+    if cache is not None:
+        cache.set(pmid, article.to_dict())
+    return article
+
+
+async def _ascrape_article(url, http_client, config, cache=None):
+    """
+    Async version of `_scrape_article`. Parsing and cache access run in worker threads
+    or processes so that they don't block the event loop.
 
+    Parameters:
+    url (str): The URL of the article to be scraped.
+    http_client (AsyncHttpClient): The async HTTP client used to fetch the article.
+    config (Config): A Config object with the same fields as required by
+                     `_scrape_article`.
+    cache (PersistentCache or None): Cache of parsed articles keyed by PMID.
 
-def _scrape_articles(urls):
+    Returns:
+    Article: An Article object created from the parsed HTML content.
     """
-    Scrape multiple articles from a list of URLs.
+    pmid = _pmid_from_url(url)
+    with instrumentation.stage("document_search.scrape"):
+        cached = (
+            await asyncio.to_thread(cache.get, pmid) if cache is not None else None
+        )
+        if cached is not None:
+            return Article.from_dict(cached)
+        resp = await http_client.get(url, endpoint="pmc_article")
+    with instrumentation.stage("document_search.parse"):
+        article = await _aparse_article(resp.text, url, config)
+    if cache is not None:
+        await asyncio.to_thread(cache.set, pmid, article.to_dict())
+    return article
+
+
+def _parse_article_html(html, url, html_parser="bs4"):
+    """
+    Parse the HTML of an article page into an Article object.
 
     Parameters:
-    urls (list): A list of URLs to scrape articles from.
+    html (str): The HTML of the article page.
+    url (str): The URL of the article.
+    html_parser (str): The HTML parsing backend, either "bs4" or "lxml".
 
     Returns:
-    list[Article]: A list of Article objects created from the parsed HTML content of
-                   each URL.
+    Article: An Article object created from the parsed HTML content.
     """
-    articles = []
-    for url in urls:
-        article = _scrape_article(url)
-        articles.append(article)
-    return articles
+    if html_parser == "lxml":
+        if not lazy_import.is_available("lxml.html"):
+            raise ImportError(
+                "Install `lxml` to use the 'lxml' HTML parser or set "
+                "`Config.html_parser` to 'bs4'"
+            )
+        parser = LxmlPubMedParser(html)
+    elif html_parser == "bs4":
+        parser = PubMedParser(bs4.BeautifulSoup(html, "html.parser"))
+    else:
+        raise ValueError(f"Unknown HTML parser '{html_parser}'")
+    return Article.from_parser(parser, url)
 
 
 def _is_free_pubmed_article(element):
@@ -241,53 +544,312 @@ def _find_free_pubmed_article_urls(soup, n_articles_per_query, query_string):
     return urls
 
 
-def _search_and_scrape_articles(query_string, config):
+def _search_article_urls(query_string, config, http_client):
     """
-    Search for articles based on a query string, then scrape and parse the results.
+    Search for articles based on a query string and find the URLs of free articles in
+    the search results.
 
     Parameters:
     query_string (str): The search query string to use for finding articles.
     config (Config): A Config object containing:
                      - n_articles_per_query (int): Number of articles to scrape per
                                                    query.
+    http_client (HttpClient): The HTTP client used to fetch the search results.
 
     Returns:
-    list[Article]: A list of Article objects created from the parsed HTML content of
-                   the search results.
+    list[str]: A list of URLs of free PubMed articles.
     """
     params = {"term": query_string, "size": 200}
-    resp = requests.get(SEARCH_BASE_URL, params=params, headers=search_util.HEADERS)
-    resp.raise_for_status()
-    soup = bs4.BeautifulSoup(resp.text, "html.parser")
-    urls = _find_free_pubmed_article_urls(
-        soup, config.n_articles_per_query, query_string
-    )
-    articles = _scrape_articles(urls)
+    with instrumentation.stage("document_search.search"):
+        resp = http_client.get(
+            SEARCH_BASE_URL, endpoint="pubmed_search", params=params
+        )
+        return _parse_search_results(
+            resp.text, config.n_articles_per_query, query_string
+        )
+
+
+async def _asearch_article_urls(query_string, config, http_client):
+    """
+    Async version of `_search_article_urls`.
+
+    Parameters:
+    query_string (str): The search query string to use for finding articles.
+    config (Config): A Config object containing:
+                     - n_articles_per_query (int): Number of articles to scrape per
+                                                   query.
+    http_client (AsyncHttpClient): The async HTTP client used to fetch the search
+                                   results.
+
+    Returns:
+    list[str]: A list of URLs of free PubMed articles.
+    """
+    params = {"term": query_string, "size": 200}
+    with instrumentation.stage("document_search.search"):
+        resp = await http_client.get(
+            SEARCH_BASE_URL, endpoint="pubmed_search", params=params
+        )
+        return await asyncio.to_thread(
+            _parse_search_results, resp.text, config.n_articles_per_query, query_string
+        )
+
+
+def _parse_search_results(html, n_articles_per_query, query_string):
+    soup = bs4.BeautifulSoup(html, "html.parser")
+    return _find_free_pubmed_article_urls(soup, n_articles_per_query, query_string)
+
+
+def _log_stats(cache, http_client):
+    if cache is not None:
+        logger.debug(f"Article cache stats: {cache.stats()}")
+    logger.debug(f"HTTP stats: {http_client.stats()}")
+    logger.debug(f"Scrape coalescing stats: {_SCRAPES.stats()}")
+
+
+def _unique_articles(articles):
+    articles = list(dict.fromkeys(articles))
+    logger.debug(f"Found and scraped {len(articles)} unique PubMed articles in total")
     return articles
 
 
-def pubmed_document_search(query_strings, config):
+def _iter_search_and_scrape(query_strings, config, http_client, cache=None):
     """
-    Perform a search for multiple query strings, scrape, and parse the results.
+    Search for multiple query strings and scrape the found articles, yielding results
+    as soon as they are available. Articles are scraped in a single worker pool shared
+    by all queries, and scraping of a query's articles starts as soon as its search
+    results have been parsed. Each article is scraped only once.
+
+    Parameters:
+    query_strings (list): A list of unique search query strings.
+    config (Config): A Config object with the same fields as required by
+                     `pubmed_document_search_per_query`.
+    http_client (HttpClient): The HTTP client used to send the requests.
+    cache (PersistentCache or None): Cache of parsed articles keyed by PMID.
+
+    Yields:
+    tuple: Either ("search", query_string, urls) when the search of a query string
+           has completed, or ("article", url, article) when an article has been
+           scraped.
+    """
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(len(query_strings), 1)
+    ) as search_executor, concurrent.futures.ThreadPoolExecutor(
+        max_workers=config.max_concurrent_scrapes
+    ) as scrape_executor:
+        search_futures = {
+            search_executor.submit(
+                instrumentation.bind(_search_article_urls),
+                query_string,
+                config,
+                http_client,
+            ): query_string
+            for query_string in query_strings
+        }
+        scrape_futures = {}
+        urls_by_future = {}
+        pending = set(search_futures)
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                if future in urls_by_future:
+                    yield "article", urls_by_future[future], future.result()
+                    continue
+                urls = future.result()
+                for url in urls:
+                    # the same article is often found with several query strings
+                    if url not in scrape_futures:
+                        scrape_future = scrape_executor.submit(
+                            instrumentation.bind(_scrape_article),
+                            url,
+                            http_client,
+                            config,
+                            cache,
+                        )
+                        scrape_futures[url] = scrape_future
+                        urls_by_future[scrape_future] = url
+                        pending.add(scrape_future)
+                yield "search", search_futures[future], urls
+
+
+def pubmed_document_search_per_query(query_strings, config):
+    """
+    Perform a search for multiple query strings, scrape, and parse the results, keeping
+    track of which articles were found with which query string. Each unique query
+    string is searched and each unique article is scraped only once. Articles are
+    scraped in a single worker pool shared by all queries, and scraping of a query's
+    articles starts as soon as its search results have been parsed.
 
     Parameters:
     query_strings (list): A list of search query strings to use for finding articles.
     config (Config): A Config object containing:
                      - n_articles_per_query (int): Number of articles to scrape per
                                                    query.
+                     - use_article_cache (bool): Whether to cache scraped articles.
+                     - max_concurrent_scrapes (int): Maximum number of articles
+                                                     scraped concurrently.
+                     - max_requests_per_host (int): Maximum number of concurrent
+                                                    requests to a single host.
+                     - http_* (various): Timeout, retry and connection pool settings
+                                         of the HTTP client.
+                     - pubmed_backend (str): Either "html" to scrape the PubMed web
+                                             pages or "eutils" to use the NCBI
+                                             E-utilities API.
+                     - html_parser (str): The HTML parsing backend of the "html"
+                                          PubMed backend, either "bs4" or "lxml".
+                     - parse_workers (int): Number of worker processes parsing
+                                            articles, or 0 to parse articles in the
+                                            fetching threads.
+
+    Returns:
+    dict: A dictionary mapping each query string to a list of Article objects created
+          from the parsed HTML content of its search results.
+    """
+    query_strings = list(dict.fromkeys(query_strings))
+    cache = _get_article_cache(config)
+    http_client = http_util.get_http_client(config)
+    if config.pubmed_backend == "eutils":
+        articles_per_query = pubmed_eutils.eutils_document_search_per_query(
+            query_strings, config, http_client, cache
+        )
+        _log_stats(cache, http_client)
+        return articles_per_query
+    if config.pubmed_backend != "html":
+        raise ValueError(f"Unknown PubMed backend '{config.pubmed_backend}'")
+    urls_per_query = {}
+    articles_by_url = {}
+    for event, key, value in _iter_search_and_scrape(
+        query_strings, config, http_client, cache
+    ):
+        if event == "search":
+            urls_per_query[key] = value
+        else:
+            articles_by_url[key] = value
+    # collect in search result order to keep the output deterministic
+    articles_per_query = {
+        query_string: [articles_by_url[url] for url in urls_per_query[query_string]]
+        for query_string in query_strings
+    }
+
+    _log_stats(cache, http_client)
+    return articles_per_query
+
+
+def pubmed_document_search(query_strings, config):
+    """
+    Perform a search for multiple query strings, scrape, and parse the results.
+
+    Parameters:
+    query_strings (list): A list of search query strings to use for finding articles.
+    config (Config): A Config object with the same fields as required by
+                     `pubmed_document_search_per_query`.
 
     Returns:
     list[Article]: A list of unique Article objects created from the parsed HTML
                    content of all search results.
     """
-    articles = []
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        func = functools.partial(_search_and_scrape_articles, config=config)
-        results = executor.map(func, query_strings)
+    articles_per_query = pubmed_document_search_per_query(query_strings, config)
+    articles = [
+        article
+        for query_string in query_strings
+        for article in articles_per_query[query_string]
+    ]
+    return _unique_articles(articles)
 
-    articles = []
-    for result in results:
-        articles += result
-    articles = list(set(articles))
-    logger.debug(f"Found and scraped {len(articles)} unique PubMed articles in total")
-    return articles
+
+async def _cancel_tasks(tasks):
+    tasks = list(tasks)
+    for task in tasks:
+        task.cancel()
+    # also retrieves the exceptions of failed tasks, so that they aren't logged as
+    # never retrieved
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def apubmed_document_search(query_strings, config):
+    """
+    Async version of `pubmed_document_search`. All searches and article fetches run
+    concurrently on the running event loop, bounded by `max_concurrent_scrapes`.
+
+    Parameters:
+    query_strings (list): A list of search query strings to use for finding articles.
+    config (Config): A Config object with the same fields as required by
+                     `pubmed_document_search_per_query`.
+
+    Returns:
+    list[Article]: A list of unique Article objects created from the parsed HTML
+                   content of all search results.
+    """
+    if config.pubmed_backend != "html":
+        # the E-utilities backend fetches articles in a few bulk requests, so running
+        # it in a worker thread doesn't leave much concurrency unused
+        return await asyncio.to_thread(pubmed_document_search, query_strings, config)
+    cache = _get_article_cache(config)
+    http_client = http_util.get_async_http_client(config)
+    semaphore = asyncio.Semaphore(config.max_concurrent_scrapes)
+    scrape_tasks = {}
+
+    async def scrape(url):
+        async with semaphore:
+            return await _ascrape_article(url, http_client, config, cache)
+
+    async def search_and_scrape(query_string):
+        urls = await _asearch_article_urls(query_string, config, http_client)
+        for url in urls:
+            # the same article is often found with several query strings
+            if url not in scrape_tasks:
+                scrape_tasks[url] = asyncio.ensure_future(scrape(url))
+        return urls
+
+    search_tasks = [
+        asyncio.ensure_future(search_and_scrape(query_string))
+        for query_string in query_strings
+    ]
+    try:
+        urls_per_query = await asyncio.gather(*search_tasks)
+        await asyncio.gather(*scrape_tasks.values())
+    finally:
+        # if a search or scrape failed, don't leave the other tasks running; the
+        # searches are stopped first so that they don't start new scrapes
+        await _cancel_tasks(search_tasks)
+        await _cancel_tasks(scrape_tasks.values())
+
+    # collect in query order to keep the output deterministic
+    articles = [
+        scrape_tasks[url].result() for urls in urls_per_query for url in urls
+    ]
+    _log_stats(cache, http_client)
+    return _unique_articles(articles)
+
+
+def iter_pubmed_document_search(query_strings, config):
+    """
+    Perform a search for multiple query strings, scrape, and parse the results,
+    yielding each unique article as soon as it has been scraped, so that later stages
+    can start processing articles while others are still being scraped.
+
+    Parameters:
+    query_strings (list): A list of search query strings to use for finding articles.
+    config (Config): A Config object with the same fields as required by
+                     `pubmed_document_search_per_query`.
+
+    Yields:
+    Article: Unique Article objects, in the order they finished scraping.
+    """
+    if config.pubmed_backend != "html":
+        # the E-utilities backend fetches articles in a few bulk requests
+        yield from pubmed_document_search(query_strings, config)
+        return
+    query_strings = list(dict.fromkeys(query_strings))
+    cache = _get_article_cache(config)
+    http_client = http_util.get_http_client(config)
+    seen = set()
+    for event, _, value in _iter_search_and_scrape(
+        query_strings, config, http_client, cache
+    ):
+        if event == "article" and value not in seen:
+            seen.add(value)
+            yield value
+    logger.debug(f"Found and scraped {len(seen)} unique PubMed articles in total")
+    _log_stats(cache, http_client)
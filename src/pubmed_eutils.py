@@ -0,0 +1,389 @@
+import concurrent.futures
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import structlog
+
+import instrumentation
+import pubmed
+import rate_limiting
+import search_util
+from search_util import Article
+
+logger = structlog.get_logger(__name__)
+
+
+# requests per second allowed by NCBI without and with an API key
+REQUESTS_PER_SECOND = 3
+REQUESTS_PER_SECOND_WITH_API_KEY = 10
+
+_BUCKETS = {}
+_BUCKETS_LOCK = threading.Lock()
+
+
+class PmcXmlParser:
+    """
+    Parser of a single PMC full-text article in JATS XML format, as returned by the
+    E-utilities `efetch` endpoint. Produces the same fields as `pubmed.PubMedParser`.
+    """
+
+    def __init__(self, element):
+        self.element = element
+        self.meta = element.find("front/article-meta")
+
+    def parse_article(self):
+        return {
+            "title": self._parse_title(),
+            "doi": self._parse_doi(),
+            "publication_year": self._parse_publication_year(),
+            "authors": self._parse_authors(),
+            "abstract": self._parse_abstract(),
+            "texts": self._parse_texts(),
+        }
+
+    @staticmethod
+    def _text(element):
+        return "".join(element.itertext())
+
+    def parse_ids(self):
+        """
+        Parse the PMID and PMCID of the article.
+
+        Returns:
+        tuple: The PMID and the numeric PMCID of the article, either of which may be
+               None.
+        """
+        pmid = pmcid = None
+        for article_id in self.meta.findall("article-id"):
+            id_type = article_id.get("pub-id-type")
+            if id_type == "pmid":
+                pmid = article_id.text
+            elif id_type in ("pmc", "pmcid"):
+                pmcid = article_id.text.replace("PMC", "")
+        return pmid, pmcid
+
+    @search_util.exception_handler
+    def _parse_title(self):
+        return self._text(self.meta.find("title-group/article-title"))
+
+    @search_util.exception_handler
+    def _parse_doi(self):
+        for article_id in self.meta.findall("article-id"):
+            if article_id.get("pub-id-type") == "doi":
+                return article_id.text
+        return None
+
+    @search_util.exception_handler
+    def _parse_publication_year(self):
+        pub_dates = self.meta.findall("pub-date")
+        # prefer the electronic publication date, as the HTML pages do
+        for pub_date in pub_dates:
+            if "epub" in (pub_date.get("pub-type"), pub_date.get("date-type")):
+                return int(pub_date.find("year").text)
+        for pub_date in pub_dates:
+            if pub_date.find("year") is not None:
+                return int(pub_date.find("year").text)
+        return None
+
+    @search_util.exception_handler
+    def _parse_authors(self):
+        authors = []
+        for contrib in self.meta.iter("contrib"):
+            if contrib.get("contrib-type") != "author":
+                continue
+            name = contrib.find("name")
+            if name is None:
+                collab = contrib.find("collab")
+                if collab is not None:
+                    authors.append(self._text(collab).strip())
+                continue
+            given_names = name.find("given-names")
+            surname = name.find("surname")
+            parts = [
+                self._text(part).strip()
+                for part in (given_names, surname)
+                if part is not None
+            ]
+            authors.append(" ".join(parts))
+        return authors
+
+    @search_util.exception_handler
+    def _parse_abstract(self):
+        abstract_element = self.meta.find("abstract")
+        if abstract_element is None:
+            return None
+        paragraphs = abstract_element.iter("p")
+        return "\n\n".join([self._text(p) for p in paragraphs])
+
+    @search_util.exception_handler
+    def _parse_texts(self):
+        body = self.element.find("body")
+        if body is None:
+            return []
+        texts = []
+        for paragraph in body.iter("p"):
+            text = self._text(paragraph)
+            if text.strip() != "":
+                texts.append(text.replace("\n", ""))
+        return texts
+
+
+def _api_key(config):
+    return config.ncbi_api_key or os.environ.get("NCBI_API_KEY")
+
+
+def _params(config, **params):
+    api_key = _api_key(config)
+    if api_key is not None:
+        params["api_key"] = api_key
+    return params
+
+
+def _get_bucket(config):
+    """
+    Get the process-wide token bucket of the E-utilities API, so that all requests of
+    the process share the NCBI rate limit of 3 requests per second, or 10 with an API
+    key. The bucket holds one second's worth of requests, so that bursts stay within
+    the limit as well.
+
+    Parameters:
+    config (Config): A Config object containing:
+                     - ncbi_api_key (str or None): NCBI API key, read from the
+                                                   `NCBI_API_KEY` environment
+                                                   variable if None.
+
+    Returns:
+    TokenBucket: The token bucket.
+    """
+    requests_per_second = (
+        REQUESTS_PER_SECOND_WITH_API_KEY
+        if _api_key(config) is not None
+        else REQUESTS_PER_SECOND
+    )
+    with _BUCKETS_LOCK:
+        if requests_per_second not in _BUCKETS:
+            _BUCKETS[requests_per_second] = rate_limiting.TokenBucket(
+                requests_per_second * 60, capacity=requests_per_second
+            )
+        return _BUCKETS[requests_per_second]
+
+
+def _get(path, endpoint, params, config, http_client):
+    delay = _get_bucket(config).reserve(1)
+    if delay > 0:
+        logger.debug(f"E-utilities rate limit reached, waiting {delay:.2f}s")
+        time.sleep(delay)
+    return http_client.get(
+        config.eutils_base_url + path, endpoint=endpoint, params=params
+    )
+
+
+def _esearch(query_string, config, http_client):
+    """
+    Search PubMed for articles with free full text in PMC.
+
+    Parameters:
+    query_string (str): The search query string to use for finding articles.
+    config (Config): A Config object containing:
+                     - n_articles_per_query (int): Number of articles to find per
+                                                   query.
+                     - eutils_base_url (str): Base URL of the E-utilities API.
+    http_client (HttpClient): The HTTP client used to send the request.
+
+    Returns:
+    list[str]: PMIDs of the found articles, ordered by relevance.
+    """
+    params = _params(
+        config,
+        db="pubmed",
+        term=f"({query_string}) AND pubmed pmc[sb]",
+        retmax=config.n_articles_per_query,
+        sort="relevance",
+        retmode="json",
+    )
+    with instrumentation.stage("document_search.search"):
+        resp = _get("esearch.fcgi", "eutils_esearch", params, config, http_client)
+    pmids = resp.json()["esearchresult"]["idlist"]
+    logger.debug(
+        f"Found {len(pmids)} free PubMed articles for query string '{query_string}'"
+    )
+    return pmids
+
+
+def _elink_pmcids(pmids, config, http_client):
+    """
+    Map PMIDs to PMCIDs with a single E-utilities `elink` request.
+
+    Parameters:
+    pmids (list[str]): PMIDs of the articles.
+    config (Config): A Config object containing:
+                     - eutils_base_url (str): Base URL of the E-utilities API.
+    http_client (HttpClient): The HTTP client used to send the request.
+
+    Returns:
+    dict: A dictionary mapping PMIDs to numeric PMCIDs. PMIDs without a PMC article
+          are omitted.
+    """
+    # passing each id separately makes elink return one link set per PMID
+    params = _params(
+        config, dbfrom="pubmed", db="pmc", linkname="pubmed_pmc", retmode="json"
+    )
+    params = list(params.items()) + [("id", pmid) for pmid in pmids]
+    with instrumentation.stage("document_search.search"):
+        resp = _get("elink.fcgi", "eutils_elink", params, config, http_client)
+    pmcids = {}
+    for linkset in resp.json().get("linksets", []):
+        for linksetdb in linkset.get("linksetdbs", []):
+            if linksetdb.get("linkname") == "pubmed_pmc" and linksetdb["links"]:
+                pmcids[linkset["ids"][0]] = linksetdb["links"][0]
+    return pmcids
+
+
+def _efetch_articles(pmcids, pmid_by_pmcid, config, http_client):
+    """
+    Fetch and parse the full texts of many PMC articles with a single E-utilities
+    `efetch` request.
+
+    Parameters:
+    pmcids (list[str]): Numeric PMCIDs of the articles.
+    pmid_by_pmcid (dict): A dictionary mapping PMCIDs to PMIDs.
+    config (Config): A Config object containing:
+                     - eutils_base_url (str): Base URL of the E-utilities API.
+    http_client (HttpClient): The HTTP client used to send the request.
+
+    Returns:
+    dict: A dictionary mapping PMIDs to Article objects.
+    """
+    params = _params(config, db="pmc", id=",".join(pmcids), retmode="xml")
+    with instrumentation.stage("document_search.scrape"):
+        resp = _get("efetch.fcgi", "eutils_efetch", params, config, http_client)
+    with instrumentation.stage("document_search.parse"):
+        root = ET.fromstring(resp.content)
+        articles = {}
+        for element in root.iter("article"):
+            parser = PmcXmlParser(element)
+            pmid, pmcid = parser.parse_ids()
+            pmid = pmid or pmid_by_pmcid.get(pmcid)
+            if pmid is None:
+                logger.warning(
+                    f"Could not map PMC article '{pmcid}' to a PMID, skipping"
+                )
+                continue
+            articles[pmid] = Article.from_parser(
+                parser, pubmed.ARTICLE_BASE_URL + pmid
+            )
+    return articles
+
+
+def _batches(items, batch_size):
+    return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+
+def _fetch_articles(pmids, config, http_client, cache=None):
+    """
+    Fetch articles by PMID, reading cached articles from the cache and fetching the
+    rest in batches of `eutils_batch_size` articles per request.
+
+    Parameters:
+    pmids (list[str]): PMIDs of the articles.
+    config (Config): A Config object containing:
+                     - eutils_batch_size (int): Number of articles per request.
+                     - max_concurrent_scrapes (int): Maximum number of concurrent
+                                                     requests.
+    http_client (HttpClient): The HTTP client used to send the requests.
+    cache (PersistentCache or None): Cache of parsed articles keyed by PMID.
+
+    Returns:
+    dict: A dictionary mapping PMIDs to Article objects. PMIDs whose full text could
+          not be fetched are omitted.
+    """
+    articles = {}
+    missing_pmids = []
+    for pmid in pmids:
+        cached = cache.get(pmid) if cache is not None else None
+        if cached is not None:
+            articles[pmid] = Article.from_dict(cached)
+        else:
+            missing_pmids.append(pmid)
+    if not missing_pmids:
+        return articles
+
+    batches = _batches(missing_pmids, config.eutils_batch_size)
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=config.max_concurrent_scrapes
+    ) as executor:
+        pmcids = {}
+        for result in executor.map(
+            instrumentation.bind(
+                lambda batch: _elink_pmcids(batch, config, http_client)
+            ),
+            batches,
+        ):
+            pmcids.update(result)
+        pmid_by_pmcid = {pmcid: pmid for pmid, pmcid in pmcids.items()}
+        pmcid_batches = _batches(list(pmcids.values()), config.eutils_batch_size)
+        for result in executor.map(
+            instrumentation.bind(
+                lambda batch: _efetch_articles(
+                    batch, pmid_by_pmcid, config, http_client
+                )
+            ),
+            pmcid_batches,
+        ):
+            articles.update(result)
+
+    if cache is not None:
+        for pmid in missing_pmids:
+            if pmid in articles:
+                cache.set(pmid, articles[pmid].to_dict())
+    return articles
+
+
+def eutils_document_search_per_query(query_strings, config, http_client, cache=None):
+    """
+    Search and fetch articles for multiple query strings with the NCBI E-utilities
+    API. PMIDs are searched with `esearch`, mapped to PMC articles with `elink` and
+    their full texts are fetched in bulk with `efetch`, so that many articles are
+    fetched per request instead of one request per article. Requests are throttled
+    to the NCBI rate limit, which is higher with an API key.
+
+    Parameters:
+    query_strings (list): A list of unique search query strings.
+    config (Config): A Config object containing:
+                     - n_articles_per_query (int): Number of articles to fetch per
+                                                   query.
+                     - eutils_base_url (str): Base URL of the E-utilities API.
+                     - eutils_batch_size (int): Number of articles per request.
+                     - ncbi_api_key (str or None): NCBI API key, read from the
+                                                   `NCBI_API_KEY` environment
+                                                   variable if None.
+    http_client (HttpClient): The HTTP client used to send the requests.
+    cache (PersistentCache or None): Cache of parsed articles keyed by PMID.
+
+    Returns:
+    dict: A dictionary mapping each query string to a list of Article objects.
+    """
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(len(query_strings), 1)
+    ) as executor:
+        pmids_per_query = dict(
+            zip(
+                query_strings,
+                executor.map(
+                    instrumentation.bind(
+                        lambda query_string: _esearch(query_string, config, http_client)
+                    ),
+                    query_strings
+                )
+            )
+        )
+    pmids = list(
+        dict.fromkeys(pmid for pmids in pmids_per_query.values() for pmid in pmids)
+    )
+    articles = _fetch_articles(pmids, config, http_client, cache)
+    return {
+        query_string: [articles[pmid] for pmid in pmids if pmid in articles]
+        for query_string, pmids in pmids_per_query.items()
+    }
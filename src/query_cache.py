@@ -0,0 +1,203 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+import structlog
+
+import caching
+
+logger = structlog.get_logger(__name__)
+
+
+def _normalize_sentence(sentence):
+    return " ".join(sentence.lower().split())
+
+
+def _hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class QueryCache:
+    """
+    A cache of query strings translated from input sentences. Sentences are looked up
+    by exact match of the normalized sentence first and, if an embedding model and a
+    similarity threshold are given, then by cosine similarity to the embeddings of the
+    previously translated sentences. Entries are namespaced by the language model and
+    the system prompt, so that changing either invalidates the cache.
+    """
+
+    def __init__(
+        self,
+        cache,
+        model_name,
+        system_prompt,
+        embeddings=None,
+        similarity_threshold=None,
+    ):
+        self.cache = cache
+        self.namespace = _hash(f"{model_name}\x00{system_prompt}")[:16] + ":"
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # the similarity index is built lazily from the cached sentences
+        self._keys = None
+        self._vectors = None
+
+    @property
+    def _use_similarity(self):
+        return self.embeddings is not None and self.similarity_threshold is not None
+
+    def _key(self, sentence):
+        return self.namespace + _hash(sentence)
+
+    def _embed(self, sentences):
+        vectors = np.asarray(self.embeddings.embed_documents(sentences), np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def _build_index(self):
+        with self._lock:
+            if self._keys is not None:
+                return
+        # embedded without holding the lock, so that exact lookups and stats don't
+        # wait for the embedding model; concurrent first lookups may build the index
+        # twice, of which the first one is kept
+        entries = self.cache.items(self.namespace)
+        keys = [key for key, _ in entries]
+        vectors = (
+            self._embed([value["sentence"] for _, value in entries])
+            if entries
+            else None
+        )
+        with self._lock:
+            if self._keys is None:
+                self._keys = keys
+                self._vectors = vectors
+        logger.debug(f"Built query cache similarity index of {len(entries)} sentences")
+
+    def _add_to_index(self, key, vector):
+        if self._keys is None or key in self._keys:
+            return
+        self._keys.append(key)
+        if self._vectors is None:
+            self._vectors = vector[None, :]
+        else:
+            self._vectors = np.vstack([self._vectors, vector])
+
+    def _remove_from_index(self, index):
+        del self._keys[index]
+        self._vectors = np.delete(self._vectors, index, axis=0)
+
+    def _get_similar(self, sentence):
+        vector = self._embed([sentence])[0]
+        self._build_index()
+        with self._lock:
+            while self._keys:
+                similarities = self._vectors @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] < self.similarity_threshold:
+                    break
+                cached = self.cache.get(self._keys[best])
+                if cached is not None:
+                    logger.debug(
+                        f"Reusing query strings of sentence '{cached['sentence']}' "
+                        f"with similarity {similarities[best]:.3f}"
+                    )
+                    return cached["query_strings"]
+                # the entry has been evicted or has expired
+                self._remove_from_index(best)
+        return None
+
+    def get(self, sentence):
+        """
+        Look up the query strings of an input sentence.
+
+        Parameters:
+        sentence (str): The input sentence.
+
+        Returns:
+        list[str] or None: The cached query strings, or None on a cache miss.
+        """
+        sentence = _normalize_sentence(sentence)
+        cached = self.cache.get(self._key(sentence))
+        if cached is not None:
+            with self._lock:
+                self.exact_hits += 1
+            return cached["query_strings"]
+        if self._use_similarity:
+            query_strings = self._get_similar(sentence)
+            if query_strings is not None:
+                with self._lock:
+                    self.similar_hits += 1
+                return query_strings
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, sentence, query_strings):
+        """
+        Store the query strings translated from an input sentence.
+
+        Parameters:
+        sentence (str): The input sentence.
+        query_strings (list[str]): The translated query strings.
+        """
+        sentence = _normalize_sentence(sentence)
+        key = self._key(sentence)
+        self.cache.set(key, {"sentence": sentence, "query_strings": query_strings})
+        if self._use_similarity:
+            vector = self._embed([sentence])[0]
+            with self._lock:
+                self._add_to_index(key, vector)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.exact_hits + self.similar_hits + self.misses
+            hits = self.exact_hits + self.similar_hits
+            return {
+                "entries": len(self.cache),
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "evictions": self.cache.evictions,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+
+def get_query_cache(config, system_prompt, embeddings=None):
+    """
+    Get the query translation cache, or None if query caching is disabled.
+
+    Parameters:
+    config (Config): A Config object containing:
+                     - use_query_cache (bool): Whether to cache translated queries.
+                     - cache_dir (str): Directory of the persistent caches.
+                     - query_cache_max_entries (int): Maximum number of cached
+                                                      sentences.
+                     - query_cache_similarity_threshold (float or None): Minimum
+                       cosine similarity for reusing the query strings of a similar
+                       sentence, or None to only reuse those of identical sentences.
+                     - model_name (str): Name of the language model.
+    system_prompt (str): The system prompt of the query translator.
+    embeddings (Embeddings or None): The embedding model used to find similar
+                                     sentences.
+
+    Returns:
+    QueryCache or None: The query cache.
+    """
+    if not config.use_query_cache:
+        return None
+    cache = caching.get_cache(
+        os.path.join(config.cache_dir, "queries.sqlite"),
+        max_entries=config.query_cache_max_entries,
+    )
+    return QueryCache(
+        cache,
+        config.model_name,
+        system_prompt,
+        embeddings=embeddings,
+        similarity_threshold=config.query_cache_similarity_threshold,
+    )
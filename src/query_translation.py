@@ -1,7 +1,12 @@
+import asyncio
+
+import structlog
 from langchain_core.pydantic_v1 import BaseModel, Field
 
 from llm_util import Assistant
 
+logger = structlog.get_logger(__name__)
+
 
 class QueryTranslationTool(BaseModel):
     query_strings: list[str] = (
@@ -9,14 +14,51 @@ class QueryTranslationTool(BaseModel):
     )
 
 
+def _parse_query_strings(response):
+    if not response.tool_calls:
+        raise RuntimeError("QueryTranslator failed to call QueryTranslationTool")
+    return response.tool_calls[0]["args"]["query_strings"]
+
+
 class QueryTranslator(Assistant):
-    def __init__(self, runnable):
-        super().__init__(runnable)
+    def __init__(self, runnable, cache=None, scheduler=None, system_prompt=None):
+        super().__init__(
+            runnable,
+            scheduler=scheduler,
+            priority="interactive",
+            system_prompt=system_prompt,
+        )
+        self.cache = cache
+
+    def _get_cached(self, input_sentence):
+        if self.cache is None:
+            return None
+        return self.cache.get(input_sentence)
+
+    def _set_cached(self, input_sentence, query_strings):
+        if self.cache is None:
+            return
+        self.cache.set(input_sentence, query_strings)
+        logger.debug(f"Query cache stats: {self.cache.stats()}")
 
     def __call__(self, state):
-        input_sentence = state["input_sentence"]
-        response = self.invoke(input_sentence)
-        if not response.tool_calls:
-            raise RuntimeError("QueryTranslator failed to call QueryTranslationTool")
-        query_strings = response.tool_calls[0]["args"]["query_strings"]
+        query_strings = self._get_cached(state["input_sentence"])
+        if query_strings is None:
+            response = self.invoke(state["input_sentence"])
+            query_strings = _parse_query_strings(response)
+            self._set_cached(state["input_sentence"], query_strings)
+        return {"query_strings": query_strings}
+
+    async def acall(self, state):
+        # the cache reads SQLite and may call the embedding model, which would block
+        # the event loop
+        query_strings = await asyncio.to_thread(
+            self._get_cached, state["input_sentence"]
+        )
+        if query_strings is None:
+            response = await self.ainvoke(state["input_sentence"])
+            query_strings = _parse_query_strings(response)
+            await asyncio.to_thread(
+                self._set_cached, state["input_sentence"], query_strings
+            )
         return {"query_strings": query_strings}
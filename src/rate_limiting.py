@@ -0,0 +1,169 @@
+import random
+import threading
+import time
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def estimate_tokens(text):
+    # roughly four characters per token for English text, without a tokenizer
+    return len(text) // 4 + 1
+
+
+def backoff_delay(attempt, base, max_delay):
+    """
+    Exponential backoff with full jitter.
+
+    Parameters:
+    attempt (int): Zero-based number of the failed attempt.
+    base (float): Base delay in seconds.
+    max_delay (float): Maximum delay in seconds.
+
+    Returns:
+    float: The delay in seconds.
+    """
+    return random.uniform(0, min(max_delay, base * 2 ** attempt))
+
+
+def retry_after(error):
+    """
+    Read the `Retry-After` header of the response of a failed API call, if any.
+
+    Parameters:
+    error (Exception): The error raised by the API client.
+
+    Returns:
+    float or None: The number of seconds to wait, or None if not given.
+    """
+    response = getattr(error, "response", None)
+    return parse_retry_after(getattr(response, "headers", None))
+
+
+def parse_retry_after(headers):
+    """
+    Read the `Retry-After` header of a response, if given in seconds. Header lookups
+    are case-insensitive for the responses of requests, httpx and the API clients.
+
+    Parameters:
+    headers (Mapping or None): The response headers.
+
+    Returns:
+    float or None: The number of seconds to wait, or None if not given or given as
+                   an HTTP date.
+    """
+    try:
+        return float((headers or {}).get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket refilled continuously at `rate_per_minute` tokens per
+    minute, holding at most `capacity` tokens, one minute's worth by default.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    def reserve(self, amount):
+        """
+        Take tokens from the bucket, going into debt if there are not enough of them.
+
+        Parameters:
+        amount (float): Number of tokens to take. Amounts larger than the capacity
+                        are capped to the capacity, so that they can be served at all.
+
+        Returns:
+        float: Number of seconds to wait before the tokens are available.
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+
+class RateLimiter:
+    """
+    Limits the rate of requests to an API with separate budgets of requests per minute
+    and tokens per minute. Either budget may be None for no limit.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.request_bucket = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.token_bucket = (
+            TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        )
+        self.total_wait = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, n_tokens=0):
+        """
+        Take a request of `n_tokens` tokens from the budgets without waiting.
+
+        Parameters:
+        n_tokens (int): Estimated number of tokens of the request.
+
+        Returns:
+        float: Number of seconds to wait before sending the request.
+        """
+        delay = 0.0
+        if self.request_bucket is not None:
+            delay = max(delay, self.request_bucket.reserve(1))
+        if self.token_bucket is not None and n_tokens > 0:
+            delay = max(delay, self.token_bucket.reserve(n_tokens))
+        if delay > 0:
+            with self._lock:
+                self.total_wait += delay
+            logger.debug(f"Rate limit reached, waiting {delay:.2f}s")
+        return delay
+
+    def acquire(self, n_tokens=0):
+        """
+        Block until a request of `n_tokens` tokens fits into the budgets.
+
+        Parameters:
+        n_tokens (int): Estimated number of tokens of the request.
+        """
+        delay = self.reserve(n_tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def get_rate_limiter(name, requests_per_minute=None, tokens_per_minute=None):
+    """
+    Get the process-wide RateLimiter of an API, creating it on first use, so that
+    all clients of the API share the same budgets.
+
+    Parameters:
+    name (str): Name of the API, e.g. the model name.
+    requests_per_minute (int or None): Maximum number of requests per minute.
+    tokens_per_minute (int or None): Maximum number of tokens per minute.
+
+    Returns:
+    RateLimiter: The rate limiter.
+    """
+    key = (name, requests_per_minute, tokens_per_minute)
+    with _LIMITERS_LOCK:
+        if key not in _LIMITERS:
+            _LIMITERS[key] = RateLimiter(requests_per_minute, tokens_per_minute)
+        return _LIMITERS[key]
@@ -0,0 +1,149 @@
+import collections
+import re
+import threading
+
+import numpy as np
+import structlog
+
+import lazy_import
+
+logger = structlog.get_logger(__name__)
+
+sentence_transformers = lazy_import.LazyModule("sentence_transformers")
+
+
+STOPWORDS = frozenset(
+    [
+        "a", "an", "and", "are", "as", "at", "be", "by", "can", "for", "from", "has",
+        "have", "in", "is", "it", "its", "may", "of", "on", "or", "that", "the",
+        "their", "these", "this", "to", "was", "were", "which", "with",
+    ]
+)
+
+_CROSS_ENCODERS = {}
+_CROSS_ENCODERS_LOCK = threading.Lock()
+
+
+def _tokenize(text):
+    return [
+        token for token in re.findall(r"\w+", text.lower()) if token not in STOPWORDS
+    ]
+
+
+class BM25Reranker:
+    """
+    Scores documents against an input sentence with Okapi BM25. Term statistics are
+    computed over the candidate documents only, which is enough to tell paragraphs
+    sharing the sentence's rare terms from those that merely embed close to it.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+    def score(self, docs, input_sentence):
+        """
+        Score documents against an input sentence.
+
+        Parameters:
+        docs (list[Document]): The candidate documents.
+        input_sentence (str): The user's input sentence.
+
+        Returns:
+        np.ndarray: The BM25 score of each document.
+        """
+        terms = list(dict.fromkeys(_tokenize(input_sentence)))
+        if not docs or not terms:
+            return np.zeros(len(docs))
+        doc_counts = [collections.Counter(_tokenize(doc.page_content)) for doc in docs]
+        # term frequency matrix of shape (n_docs, n_terms)
+        tf = np.array(
+            [[counts[term] for term in terms] for counts in doc_counts],
+            dtype=np.float64,
+        )
+        doc_lengths = np.array([sum(counts.values()) for counts in doc_counts])
+        n_docs = len(docs)
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+        length_norm = 1 - self.b + self.b * doc_lengths / max(doc_lengths.mean(), 1)
+        saturated_tf = tf * (self.k1 + 1) / (tf + self.k1 * length_norm[:, None])
+        return saturated_tf @ idf
+
+
+class CrossEncoderReranker:
+    """
+    Scores documents against an input sentence with a local cross-encoder model from
+    the `sentence-transformers` package.
+    """
+
+    def __init__(self, model_name):
+        if not lazy_import.is_available("sentence_transformers"):
+            raise ImportError(
+                "Install `sentence-transformers` to use the 'cross_encoder' reranker "
+                "or set `Config.reranker` to 'bm25'"
+            )
+        with _CROSS_ENCODERS_LOCK:
+            if model_name not in _CROSS_ENCODERS:
+                _CROSS_ENCODERS[model_name] = sentence_transformers.CrossEncoder(
+                    model_name
+                )
+                logger.debug(f"Loaded cross-encoder '{model_name}'")
+            self.model = _CROSS_ENCODERS[model_name]
+
+    def score(self, docs, input_sentence):
+        """
+        Score documents against an input sentence.
+
+        Parameters:
+        docs (list[Document]): The candidate documents.
+        input_sentence (str): The user's input sentence.
+
+        Returns:
+        np.ndarray: The relevance score of each document.
+        """
+        if not docs:
+            return np.zeros(0)
+        pairs = [(input_sentence, doc.page_content) for doc in docs]
+        return np.asarray(self.model.predict(pairs), dtype=np.float64)
+
+
+def _init_reranker(config):
+    if config.reranker == "bm25":
+        return BM25Reranker()
+    if config.reranker == "cross_encoder":
+        return CrossEncoderReranker(config.cross_encoder_model_name)
+    raise ValueError(f"Unknown reranker '{config.reranker}'")
+
+
+def rerank(docs, input_sentence, config):
+    """
+    Rescore retrieved documents with a local reranker and keep only the best ones, so
+    that fewer documents are sent to the language model for grading.
+
+    Parameters:
+    docs (list[Document]): The retrieved documents.
+    input_sentence (str): The user's input sentence.
+    config (Config): A Config object containing:
+                     - reranker (str): Either "bm25" or "cross_encoder".
+                     - cross_encoder_model_name (str): Name of the cross-encoder
+                                                       model.
+                     - n_docs_grade (int): Number of documents to keep for
+                                           grading.
+                     - rerank_min_score (float or None): Minimum score of the kept
+                                                         documents, or None to keep
+                                                         the top documents regardless
+                                                         of their score.
+
+    Returns:
+    list[Document]: The kept documents, best first.
+    """
+    scores = _init_reranker(config).score(docs, input_sentence)
+    k = min(config.n_docs_grade, len(docs))
+    # stable sort keeps the retrieval order among equally scored documents
+    order = np.argsort(-scores, kind="stable")[:k]
+    if config.rerank_min_score is not None:
+        order = order[scores[order] >= config.rerank_min_score]
+    logger.debug(
+        f"Reranked {len(docs)} documents, forwarding {len(order)} to grading"
+    )
+    return [docs[i] for i in order]
@@ -1,4 +1,9 @@
+import array
+import contextlib
 import functools
+import itertools
+import threading
+import urllib.parse
 
 import structlog
 
@@ -40,15 +45,63 @@ def exception_handler(func):
     return wrapper
 
 
+class HostLimiter:
+    """
+    Limits the number of concurrent requests made to each host, to stay polite
+    towards the scraped websites.
+    """
+
+    def __init__(self, max_requests_per_host):
+        self.max_requests_per_host = max_requests_per_host
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def limit(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(
+                    self.max_requests_per_host
+                )
+            semaphore = self._semaphores[host]
+        with semaphore:
+            yield
+
+
 class Article:
+    """
+    A scraped article. Many articles are held in memory during a batch search, so
+    they are slotted, and the paragraphs are stored in a single string with the end
+    offset of each paragraph instead of as one string object per paragraph. The
+    paragraphs are only split up again when `texts` is accessed.
+    """
+
+    __slots__ = (
+        "title", "doi", "publication_year", "authors", "abstract", "url", "_text",
+        "_ends",
+    )
+
     def __init__(self, title, doi, publication_year, authors, abstract, texts, url):
         self.title = title
         self.doi = doi
         self.publication_year = publication_year
-        self.authors = authors
+        self.authors = tuple(authors) if authors is not None else None
         self.abstract = abstract
-        self.texts = texts
         self.url = url
+        # texts are None if they could not be parsed
+        texts = texts or []
+        self._text = "".join(texts)
+        self._ends = array.array("I", itertools.accumulate(len(text) for text in texts))
+
+    @property
+    def texts(self):
+        starts = itertools.chain([0], self._ends)
+        return [self._text[start:end] for start, end in zip(starts, self._ends)]
+
+    @property
+    def n_texts(self):
+        return len(self._ends)
 
     def __repr__(self):
         return (
@@ -57,16 +110,31 @@ class Article:
         )
 
     def __hash__(self):
-        return hash((self.title, self.publication_year, tuple(self.authors)))
+        return hash((self.title, self.publication_year, self.authors))
 
     def __eq__(self, other):
         if isinstance(other, Article):
             return (
-                (self.title, self.publication_year, tuple(self.authors)) ==
-                (other.title, other.publication_year, tuple(other.authors))
+                (self.title, self.publication_year, self.authors) ==
+                (other.title, other.publication_year, other.authors)
             )
         return False
 
     @classmethod
     def from_parser(cls, parser, url):
         return cls(**parser.parse_article(), url=url)
+
+    def to_dict(self):
+        return {
+            "title": self.title,
+            "doi": self.doi,
+            "publication_year": self.publication_year,
+            "authors": list(self.authors) if self.authors is not None else None,
+            "abstract": self.abstract,
+            "texts": self.texts,
+            "url": self.url,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
@@ -0,0 +1,289 @@
+import http.server
+import json
+import threading
+
+import structlog
+
+import caching
+from app import CitationFinder
+from instrumentation import Metrics
+
+logger = structlog.get_logger(__name__)
+
+
+MAX_BODY_BYTES = 1024 * 1024
+MAX_SENTENCES_PER_REQUEST = 100
+# seconds clients are asked to wait before retrying a rejected request
+RETRY_AFTER = 1
+
+
+class CitationService:
+    """
+    Serves the searches of a single CitationFinder to concurrent requests, so that
+    the graph, clients and caches stay warm between requests. At most
+    `max_concurrency` searches run at once and at most `max_queue_size` further
+    requests wait for a slot. Requests beyond that are rejected, so that clients back
+    off instead of piling up behind a backlog they would time out on. Concurrent
+    requests for the same sentence share a single search.
+    """
+
+    def __init__(self, finder, max_concurrency=4, max_queue_size=32):
+        self.finder = finder
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.metrics = Metrics()
+        self._slots = threading.Semaphore(max_concurrency)
+        self._searches = caching.SingleFlight()
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._active = 0
+        self._requests = 0
+        self._rejected = 0
+        self._errors = 0
+
+    def admit(self):
+        """
+        Admit a request if the queue is not full.
+
+        Returns:
+        bool: Whether the request was admitted, in which case `release` must be
+              called once it has been handled.
+        """
+        with self._lock:
+            self._requests += 1
+            if self._admitted >= self.max_concurrency + self.max_queue_size:
+                self._rejected += 1
+                return False
+            self._admitted += 1
+            return True
+
+    def release(self, error=False):
+        with self._lock:
+            self._admitted -= 1
+            self._errors += int(error)
+
+    def _run(self, func, *args):
+        with self._slots:
+            with self._lock:
+                self._active += 1
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self._active -= 1
+
+    def _search(self, input_sentence):
+        state = self._run(self.finder.search, input_sentence, "return")
+        self.metrics.merge(state["metrics"])
+        return state
+
+    def search(self, input_sentence):
+        """
+        Search citations for an input sentence, or wait for the search of a
+        concurrent request for the same sentence.
+
+        Parameters:
+        input_sentence (str): The sentence to search citations for.
+
+        Returns:
+        GraphState: The final state of the search.
+        """
+        return self._searches.do(input_sentence, self._search, input_sentence)
+
+    def search_many(self, input_sentences):
+        """
+        Search citations for many input sentences at once with
+        `CitationFinder.search_many`, which takes a single slot.
+
+        Parameters:
+        input_sentences (list[str]): The sentences to search citations for.
+
+        Returns:
+        list[GraphState]: The final state of each input sentence, in input order.
+        """
+        states = self._run(self.finder.search_many, input_sentences, "return")
+        if states:
+            # the states share the Metrics of the whole batch
+            self.metrics.merge(states[0]["metrics"])
+        return states
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "requests": self._requests,
+                "rejected": self._rejected,
+                "errors": self._errors,
+                "active": self._active,
+                "queued": self._admitted - self._active,
+            }
+        stats["searches"] = self._searches.stats()
+        stats["llm_scheduler"] = self.finder.llm_scheduler.stats()
+        return stats
+
+
+def _format_state(state):
+    return {
+        "input_sentence": state["input_sentence"],
+        "citations": [dict(doc.metadata) for doc in state["docs"]],
+    }
+
+
+class _BadRequest(Exception):
+    pass
+
+
+def _parse_search_request(body):
+    try:
+        request = json.loads(body)
+    except ValueError as e:
+        raise _BadRequest(f"Invalid JSON: {e}")
+    if not isinstance(request, dict):
+        raise _BadRequest("Expected a JSON object")
+    if "sentence" in request:
+        sentence = request["sentence"]
+        if not isinstance(sentence, str) or not sentence.strip():
+            raise _BadRequest("'sentence' must be a non-empty string")
+        return sentence.strip(), None
+    if "sentences" in request:
+        sentences = request["sentences"]
+        if (
+            not isinstance(sentences, list)
+            or not sentences
+            or not all(isinstance(s, str) and s.strip() for s in sentences)
+        ):
+            raise _BadRequest("'sentences' must be a list of non-empty strings")
+        if len(sentences) > MAX_SENTENCES_PER_REQUEST:
+            raise _BadRequest(
+                f"At most {MAX_SENTENCES_PER_REQUEST} sentences per request"
+            )
+        return None, [s.strip() for s in sentences]
+    raise _BadRequest("Expected a 'sentence' or 'sentences' field")
+
+
+class CitationRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    JSON API of a CitationService:
+
+    - `POST /search` with `{"sentence": "..."}` returns the citations of the sentence,
+      with `{"sentences": [...]}` those of each sentence.
+    - `GET /health` returns the load of the service.
+    - `GET /metrics` returns the per-stage metrics of all searches so far in the
+      Prometheus text format.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, {"status": "ok", **self.service.stats()})
+        elif self.path == "/metrics":
+            text = self.service.metrics.to_prometheus()
+            self._send(
+                200, text.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+            )
+        else:
+            self._send(404, {"error": f"Unknown path '{self.path}'"})
+
+    def do_POST(self):
+        if self.path != "/search":
+            self._send(404, {"error": f"Unknown path '{self.path}'"})
+            return
+        length = self.headers.get("Content-Length")
+        if length is None:
+            # without a length, the end of the body can't be told from the next request
+            self.close_connection = True
+            self._send(411, {"error": "Content-Length required"})
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self._send(400, {"error": "Invalid Content-Length"})
+            return
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self._send(413, {"error": f"Body larger than {MAX_BODY_BYTES} bytes"})
+            return
+        try:
+            sentence, sentences = _parse_search_request(self.rfile.read(length))
+        except _BadRequest as e:
+            self._send(400, {"error": str(e)})
+            return
+        if not self.service.admit():
+            self._send(
+                503,
+                {"error": "Too many pending requests"},
+                headers={"Retry-After": str(RETRY_AFTER)},
+            )
+            return
+        error = False
+        try:
+            if sentence is not None:
+                response = _format_state(self.service.search(sentence))
+            else:
+                states = self.service.search_many(sentences)
+                response = {"results": [_format_state(state) for state in states]}
+        except Exception as e:
+            error = True
+            logger.exception("Search failed")
+            response = {"error": repr(e)}
+        finally:
+            self.service.release(error)
+        self._send(500 if error else 200, response)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def serve(config):
+    """
+    Run the citation server until interrupted. Dependencies and clients are loaded
+    before the server starts listening, so that the first request doesn't wait for
+    them.
+
+    Parameters:
+    config (Config): A Config object containing, besides the search settings:
+                     - server_host (str): Host to listen on.
+                     - server_port (int): Port to listen on.
+                     - server_max_concurrency (int): Maximum number of concurrent
+                                                     searches.
+                     - server_max_queue_size (int): Maximum number of requests
+                                                    waiting for a search slot.
+    """
+    finder = CitationFinder(config)
+    finder.warm_up()
+    server = http.server.ThreadingHTTPServer(
+        (config.server_host, config.server_port), CitationRequestHandler
+    )
+    server.daemon_threads = True
+    server.service = CitationService(
+        finder,
+        max_concurrency=config.server_max_concurrency,
+        max_queue_size=config.server_max_queue_size,
+    )
+    logger.info(
+        f"Serving citations on http://{config.server_host}:{server.server_port}"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        server.server_close()
@@ -0,0 +1,82 @@
+import concurrent.futures
+import threading
+
+import pytest
+
+import caching
+from caching import SingleFlight
+
+
+def _run_concurrently(flight, key, func, n_calls):
+    started = threading.Barrier(n_calls)
+
+    def call():
+        started.wait()
+        return flight.do(key, func)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_calls) as executor:
+        futures = [executor.submit(call) for _ in range(n_calls)]
+        concurrent.futures.wait(futures)
+    return futures
+
+
+def test_concurrent_calls_share_the_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def func():
+        calls.append(1)
+        release.wait(timeout=5)
+        return "result"
+
+    threading.Timer(0.2, release.set).start()
+    futures = _run_concurrently(flight, "key", func, 4)
+
+    assert [future.result() for future in futures] == ["result"] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {"in_flight": 0, "coalesced": 3}
+
+
+def test_leader_exception_reaches_followers_and_key_is_removed():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def func():
+        calls.append(1)
+        release.wait(timeout=5)
+        raise ValueError("failed")
+
+    threading.Timer(0.2, release.set).start()
+    futures = _run_concurrently(flight, "key", func, 4)
+
+    for future in futures:
+        with pytest.raises(ValueError, match="failed"):
+            future.result()
+    assert len(calls) == 1
+    assert flight.stats()["in_flight"] == 0
+    # the failed call is not cached, the next call runs again
+    assert flight.do("key", lambda: "retried") == "retried"
+
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+
+    assert flight.do(("1", "bs4"), lambda: "bs4") == "bs4"
+    assert flight.do(("1", "lxml"), lambda: "lxml") == "lxml"
+    assert flight.stats() == {"in_flight": 0, "coalesced": 0}
+
+
+def test_get_cache_applies_the_limits_of_the_latest_call(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = caching.get_cache(path, ttl_seconds=None, max_entries=None)
+    for i in range(5):
+        cache.set(str(i), i)
+
+    assert caching.get_cache(path, ttl_seconds=60, max_entries=3) is cache
+    assert (cache.ttl_seconds, cache.max_entries) == (60, 3)
+    # the least recently used entries are evicted right away
+    assert len(cache) == 3
+    assert cache.get("0") is None
+    assert cache.get("4") == 4
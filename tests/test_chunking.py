@@ -0,0 +1,90 @@
+import chunking
+from rate_limiting import estimate_tokens
+
+
+def _paragraph(n_tokens, letter="a"):
+    # estimate_tokens counts four characters per token, plus one
+    return letter * (4 * (n_tokens - 1))
+
+
+def _words(prefix, n_words):
+    return " ".join(f"{prefix}{i}" for i in range(n_words))
+
+
+def test_deduplicate_removes_exact_duplicates_after_normalization():
+    texts = ["Statins lower  cholesterol.", "statins lower cholesterol.", "Other text."]
+
+    assert chunking.deduplicate(texts) == ["Statins lower  cholesterol.", "Other text."]
+
+
+def test_deduplicate_removes_paragraphs_contained_in_earlier_ones():
+    texts = [
+        "Statins lower cholesterol [1]. 1. A footnote.",
+        "1. A footnote.",
+        "A footnote and more.",
+    ]
+
+    assert chunking.deduplicate(texts) == [texts[0], texts[2]]
+
+
+def test_deduplicate_removes_near_duplicates_above_the_threshold():
+    text = _words("word", 60)
+    near_duplicate = text.rsplit(" ", 1)[0] + " changed"
+    unrelated = _words("other", 60)
+    texts = [text, near_duplicate, unrelated]
+
+    assert chunking.deduplicate(texts, near_duplicate_threshold=0.8) == [
+        text, unrelated
+    ]
+    assert chunking.deduplicate(texts, near_duplicate_threshold=None) == texts
+
+
+def test_chunk_merges_small_paragraphs_until_the_target_size():
+    texts = [_paragraph(10, letter) for letter in "abcd"]
+
+    chunks = chunking.chunk(texts, target_tokens=20, max_tokens=40)
+
+    assert chunks == ["\n\n".join(texts[:2]), "\n\n".join(texts[2:])]
+
+
+def test_chunk_starts_a_new_chunk_before_exceeding_the_max_size():
+    texts = [_paragraph(15, "a"), _paragraph(30, "b")]
+
+    chunks = chunking.chunk(texts, target_tokens=20, max_tokens=40)
+
+    assert chunks == texts
+
+
+def test_chunk_keeps_a_paragraph_of_exactly_the_max_size():
+    texts = [_paragraph(40)]
+
+    assert chunking.chunk(texts, target_tokens=20, max_tokens=40) == texts
+
+
+def test_chunk_splits_oversized_paragraphs_and_flushes_the_current_chunk():
+    small = _paragraph(5)
+    oversized = _words("word", 100)
+
+    chunks = chunking.chunk([small, oversized], target_tokens=20, max_tokens=40)
+
+    assert chunks[0] == small
+    assert " ".join(chunks[1:]) == oversized
+    assert all(estimate_tokens(chunk) <= 40 for chunk in chunks)
+
+
+def test_split_merges_sentences_up_to_the_max_size():
+    sentences = [f"{_paragraph(15, letter)}." for letter in "abc"]
+
+    chunks = chunking._split(" ".join(sentences), max_tokens=35)
+
+    assert chunks == [" ".join(sentences[:2]), sentences[2]]
+
+
+def test_split_breaks_long_sentences_at_word_boundaries():
+    sentence = _words("word", 200)
+
+    chunks = chunking._split(sentence, max_tokens=30)
+
+    assert len(chunks) > 1
+    assert " ".join(chunks) == sentence
+    assert all(estimate_tokens(chunk) <= 30 for chunk in chunks)
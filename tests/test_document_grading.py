@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import types
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from document_grading import DocumentGrader
+
+VERDICT = {"document_is_relevant": True, "supporting_quote": "quote"}
+
+
+class RecordingCache:
+    def __init__(self):
+        self.threads = []
+        self.verdicts = {}
+
+    def get(self, doc, input_sentence):
+        self.threads.append(threading.get_ident())
+        return self.verdicts.get((doc.page_content, input_sentence))
+
+    def set(self, doc, input_sentence, tool_output):
+        self.threads.append(threading.get_ident())
+        self.verdicts[(doc.page_content, input_sentence)] = tool_output
+
+
+def _response(inputs):
+    return AIMessage(
+        content="",
+        tool_calls=[{"name": "DocumentGradingTool", "args": VERDICT, "id": "call"}],
+    )
+
+
+def test_agrade_accesses_the_verdict_cache_off_the_event_loop():
+    cache = RecordingCache()
+    grader = DocumentGrader(RunnableLambda(_response), cache=cache)
+    doc = Document(page_content="Statins lower cholesterol.")
+
+    async def main():
+        semaphore = asyncio.Semaphore(1)
+        first = await grader._agrade(doc, "Statins work.", semaphore)
+        second = await grader._agrade(doc, "Statins work.", semaphore)
+        return first, second
+
+    assert asyncio.run(main()) == (VERDICT, VERDICT)
+    # get, set, then a cache hit
+    assert len(cache.threads) == 3
+    assert threading.get_ident() not in cache.threads
+
+
+def test_retry_delay_honours_retry_after():
+    grader = DocumentGrader(RunnableLambda(_response))
+    error = Exception("rate limited")
+    error.response = types.SimpleNamespace(headers={"retry-after": "7"})
+
+    assert grader._retry_delay(1, error) == 7.0
+
+
+def test_retry_delay_backs_off_exponentially_with_jitter():
+    grader = DocumentGrader(RunnableLambda(_response))
+
+    delays = [grader._retry_delay(3, Exception("failed")) for _ in range(100)]
+
+    assert all(0 <= delay <= 4 for delay in delays)
+    assert len(set(delays)) > 1
+    assert all(0 <= grader._retry_delay(10) <= 10 for _ in range(100))
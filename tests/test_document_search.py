@@ -0,0 +1,49 @@
+import types
+import uuid
+
+import pytest
+from langchain_community.vectorstores import Chroma
+
+import document_search
+from benchmark import FakeEmbeddings
+from numpy_vectorstore import NumpyVectorStore
+
+
+def _metadatas(url, n):
+    return [types.MappingProxyType({"url": url})] * n
+
+
+@pytest.fixture(params=["numpy", "chroma"])
+def vectorstore(request):
+    if request.param == "numpy":
+        yield NumpyVectorStore(FakeEmbeddings())
+    else:
+        store = Chroma(
+            collection_name=f"test-{uuid.uuid4().hex}",
+            embedding_function=FakeEmbeddings(),
+        )
+        yield store
+        store.delete_collection()
+
+
+def _stored_texts(vectorstore, url):
+    docs = vectorstore.similarity_search(
+        "paragraph", k=10, filter={"url": {"$in": [url]}}
+    )
+    return sorted(doc.page_content for doc in docs)
+
+
+def test_upsert_paragraphs_replaces_stale_paragraphs_of_a_url(vectorstore):
+    document_search._upsert_paragraphs(
+        vectorstore, ["old paragraph", "kept paragraph"], _metadatas("a", 2)
+    )
+    document_search._upsert_paragraphs(
+        vectorstore, ["other paragraph"], _metadatas("b", 1)
+    )
+
+    document_search._upsert_paragraphs(
+        vectorstore, ["kept paragraph", "new paragraph"], _metadatas("a", 2)
+    )
+
+    assert _stored_texts(vectorstore, "a") == ["kept paragraph", "new paragraph"]
+    assert _stored_texts(vectorstore, "b") == ["other paragraph"]
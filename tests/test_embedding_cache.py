@@ -0,0 +1,69 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import embedding_cache
+from embedding_cache import CachedEmbeddings, EmbeddingStore
+
+
+class AsymmetricEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls += [("document", text) for text in texts]
+        return [[1.0, float(len(text))] for text in texts]
+
+    def embed_query(self, text):
+        self.calls.append(("query", text))
+        return [-1.0, float(len(text))]
+
+
+def test_query_and_document_vectors_are_cached_separately(tmp_path):
+    embeddings = AsymmetricEmbeddings()
+    cached = CachedEmbeddings(embeddings, EmbeddingStore(str(tmp_path)), "model")
+
+    assert cached.embed_documents(["statin"]) == [[1.0, 6.0]]
+    assert cached.embed_query("statin") == [-1.0, 6.0]
+    assert cached.embed_query("statin") == [-1.0, 6.0]
+    assert cached.embed_documents(["statin"]) == [[1.0, 6.0]]
+    assert embeddings.calls == [("document", "statin"), ("query", "statin")]
+    assert len(cached.store) == 2
+
+
+def _add_vectors(directory, worker, n_batches):
+    store = EmbeddingStore(directory)
+    for batch in range(n_batches):
+        keys = [f"{worker}:{batch}:{i}" for i in range(10)]
+        vectors = np.array(
+            [[worker, batch, i, 0.0] for i in range(10)], dtype=np.float32
+        )
+        store.add(keys, vectors)
+
+
+@pytest.mark.skipif(embedding_cache.fcntl is None, reason="file locks not available")
+def test_processes_sharing_a_store_keep_rows_consistent(tmp_path):
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=_add_vectors, args=(str(tmp_path), worker, 50))
+        for worker in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    store = EmbeddingStore(str(tmp_path))
+    keys = [
+        f"{worker}:{batch}:{i}"
+        for worker in range(4)
+        for batch in range(50)
+        for i in range(10)
+    ]
+    rows = store.lookup(keys)
+    assert len(store) == len(rows) == 2000
+    vectors = store.read([rows[key] for key in keys])
+    expected = [[float(part) for part in key.split(":")] + [0.0] for key in keys]
+    assert vectors.tolist() == expected
@@ -0,0 +1,70 @@
+import httpx
+import openai
+import pytest
+
+import embedding_util
+import rate_limiting
+
+
+def _response(status_code):
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    return httpx.Response(status_code, request=request)
+
+
+class FlakyEmbeddings:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return [[float(len(text))] for text in texts]
+
+
+def _scheduled(embeddings):
+    return embedding_util.ScheduledEmbeddings(
+        embeddings, rate_limiting.RateLimiter(), max_retries=3, backoff_base=0.0
+    )
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        openai.RateLimitError("rate limited", response=_response(429), body=None),
+        openai.InternalServerError("server error", response=_response(500), body=None),
+        openai.APITimeoutError(request=_response(500).request),
+        openai.APIConnectionError(request=_response(500).request),
+    ],
+)
+def test_transient_errors_are_retried(error):
+    embeddings = FlakyEmbeddings([error, error])
+
+    assert _scheduled(embeddings).embed_documents(["ab", "abc"]) == [[2.0], [3.0]]
+    assert embeddings.calls == 3
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        openai.BadRequestError("too long", response=_response(400), body=None),
+        openai.AuthenticationError("bad key", response=_response(401), body=None),
+        ValueError("bad input"),
+    ],
+)
+def test_other_errors_are_raised_immediately(error):
+    embeddings = FlakyEmbeddings([error])
+
+    with pytest.raises(type(error)):
+        _scheduled(embeddings).embed_documents(["ab"])
+    assert embeddings.calls == 1
+
+
+def test_retries_are_limited():
+    error = openai.RateLimitError("rate limited", response=_response(429), body=None)
+    embeddings = FlakyEmbeddings([error] * 5)
+
+    with pytest.raises(openai.RateLimitError):
+        _scheduled(embeddings).embed_documents(["ab"])
+    assert embeddings.calls == 4
@@ -0,0 +1,48 @@
+import pytest
+
+import instrumentation
+from instrumentation import Metrics
+
+pytestmark = pytest.mark.skipif(
+    instrumentation.get_rss_bytes() is None, reason="resident memory not available"
+)
+
+MIB = 2 ** 20
+
+
+def test_stages_record_their_own_rss_growth():
+    metrics = Metrics()
+    kept = []
+    with metrics.stage("allocate"):
+        kept.append(bytearray(64 * MIB))
+    with metrics.stage("allocate_and_free"):
+        buffer = bytearray(64 * MIB)
+        del buffer
+    with metrics.stage("idle"):
+        pass
+
+    stages = metrics.to_dict()
+    assert stages["allocate"]["max_rss_growth_bytes"] >= 60 * MIB
+    # unlike the process's peak memory, earlier stages don't carry over
+    assert stages["allocate_and_free"]["max_rss_growth_bytes"] < 8 * MIB
+    assert stages["idle"]["max_rss_growth_bytes"] < 8 * MIB
+
+
+def test_merge_keeps_largest_rss_growth():
+    metrics = Metrics()
+    other = Metrics()
+    kept = []
+    with other.stage("allocate"):
+        kept.append(bytearray(32 * MIB))
+    with metrics.stage("allocate"):
+        pass
+
+    metrics.merge(other)
+
+    stats = metrics.to_dict()["allocate"]
+    assert stats["calls"] == 2
+    assert stats["max_rss_growth_bytes"] >= 30 * MIB
+    assert (
+        f'citation_finder_stage_max_rss_growth_bytes{{stage="allocate"}} '
+        f'{stats["max_rss_growth_bytes"]}'
+    ) in metrics.to_prometheus()
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+import llm_util
+import rate_limiting
+from llm_util import Assistant, LLMScheduler
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    scheduler = LLMScheduler(max_concurrency=1)
+
+    async def main():
+        await scheduler.aacquire()
+        waiter = asyncio.create_task(scheduler.aacquire())
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()["queue_depth"] == 1
+
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.stats()["queue_depth"] == 0
+
+        scheduler.release()
+        # the slot of the cancelled waiter is free
+        await asyncio.wait_for(scheduler.aacquire(), timeout=1)
+        scheduler.release()
+
+    asyncio.run(main())
+    assert scheduler.stats()["active"] == 0
+
+
+def test_waiter_cancelled_after_being_granted_gives_back_its_slot():
+    scheduler = LLMScheduler(max_concurrency=1)
+
+    async def main():
+        await scheduler.aacquire()
+        waiter = asyncio.create_task(scheduler.aacquire())
+        await asyncio.sleep(0.01)
+        # grants the slot to the waiter, which is cancelled before it resumes
+        scheduler.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.stats()["active"] == 0
+
+    asyncio.run(main())
+
+
+def test_waiting_coroutines_dont_block_the_event_loop():
+    scheduler = LLMScheduler(max_concurrency=2)
+
+    async def call(order, i):
+        await scheduler.aacquire()
+        try:
+            await asyncio.sleep(0.01)
+            order.append(i)
+        finally:
+            scheduler.release()
+
+    async def main():
+        order = []
+        await asyncio.wait_for(
+            asyncio.gather(*(call(order, i) for i in range(20))), timeout=5
+        )
+        return order
+
+    assert sorted(asyncio.run(main())) == list(range(20))
+    stats = scheduler.stats()
+    assert stats["active"] == 0
+    assert stats["max_queue_depth"] == 18
+    assert stats["lanes"]["bulk"]["requests"] == 20
+
+
+def test_threads_and_coroutines_share_the_queue_by_priority():
+    scheduler = LLMScheduler(max_concurrency=1)
+    order = []
+    scheduler.acquire()
+
+    def bulk_call():
+        with scheduler.slot("bulk"):
+            order.append("bulk")
+
+    async def interactive_call():
+        await scheduler.aacquire("interactive")
+        order.append("interactive")
+        scheduler.release()
+
+    async def main():
+        thread = threading.Thread(target=bulk_call)
+        thread.start()
+        while scheduler.stats()["queue_depth"] < 1:
+            await asyncio.sleep(0.001)
+        task = asyncio.create_task(interactive_call())
+        while scheduler.stats()["queue_depth"] < 2:
+            await asyncio.sleep(0.001)
+        scheduler.release()
+        await task
+        await asyncio.to_thread(thread.join)
+
+    asyncio.run(main())
+    assert order == ["interactive", "bulk"]
+
+
+class RecordingRateLimiter(rate_limiting.RateLimiter):
+    def __init__(self):
+        super().__init__()
+        self.reserved = []
+
+    def reserve(self, n_tokens=0):
+        self.reserved.append(n_tokens)
+        return super().reserve(n_tokens)
+
+
+def test_assistant_reserves_system_prompt_message_and_output_tokens():
+    rate_limiter = RecordingRateLimiter()
+    scheduler = LLMScheduler(max_concurrency=1, rate_limiter=rate_limiter)
+    system_prompt = "You are a helpful assistant. " * 100
+    assistant = Assistant(
+        RunnableLambda(lambda inputs: AIMessage(content="")),
+        scheduler=scheduler,
+        system_prompt=system_prompt,
+    )
+
+    assistant.invoke("A message.")
+    asyncio.run(assistant.ainvoke("A message."))
+
+    expected = (
+        rate_limiting.estimate_tokens(system_prompt)
+        + rate_limiting.estimate_tokens("A message.")
+        + llm_util.OUTPUT_TOKENS_ALLOWANCE
+    )
+    assert rate_limiter.reserved == [expected, expected]
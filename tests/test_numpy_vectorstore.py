@@ -0,0 +1,118 @@
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import numpy_vectorstore
+from numpy_vectorstore import NumpyVectorStore
+
+
+class TableEmbeddings(Embeddings):
+    """Embeddings looked up in a table, so that similarities are known exactly."""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+
+VECTORS = {
+    "x": [1.0, 0.0, 0.0],
+    "x2": [0.9, 0.1, 0.0],
+    "x3": [0.9, 0.0, 0.1],
+    "y": [0.0, 1.0, 0.0],
+    "z": [0.0, 0.0, 1.0],
+}
+
+
+def _store(initial_capacity=1024):
+    store = NumpyVectorStore(TableEmbeddings(VECTORS), initial_capacity)
+    store.add_texts(
+        ["x", "x2", "y", "z"],
+        metadatas=[{"url": "a"}, {"url": "b"}, {"url": "a"}, {"url": "b"}],
+        ids=["1", "2", "3", "4"],
+    )
+    return store
+
+
+def _texts(docs):
+    return [doc.page_content for doc in docs]
+
+
+def test_top_k_returns_the_k_highest_scores_in_descending_order():
+    scores = np.array([0.1, 0.9, 0.3, 0.7, 0.5, 0.9], dtype=np.float32)
+
+    assert numpy_vectorstore._top_k(scores, 3).tolist() == [1, 5, 3]
+    assert numpy_vectorstore._top_k(scores, 10).tolist() == [1, 5, 3, 4, 2, 0]
+    assert numpy_vectorstore._top_k(scores, 0).tolist() == []
+
+
+def test_similarity_search_ranks_by_cosine_similarity():
+    store = _store()
+
+    docs = store.similarity_search_with_score_by_vector([1.0, 0.0, 0.0], k=3)
+
+    assert _texts(doc for doc, _ in docs) == ["x", "x2", "y"]
+    assert docs[0][1] == np.float32(1.0)
+
+
+def test_similarity_search_filters_by_url():
+    store = _store()
+
+    docs = store.similarity_search("x", k=4, filter={"url": {"$in": ["b"]}})
+
+    assert _texts(docs) == ["x2", "z"]
+    assert {doc.metadata["url"] for doc in docs} == {"b"}
+    assert store.similarity_search("x", filter={"url": {"$in": ["c"]}}) == []
+
+
+def test_add_texts_updates_rows_of_existing_ids():
+    store = _store()
+
+    store.add_texts(["y"], metadatas=[{"url": "a", "updated": True}], ids=["1"])
+
+    assert len(store) == 4
+    docs = store.similarity_search("y", k=1, filter={"url": {"$in": ["a"]}})
+    assert _texts(docs) == ["y"]
+    assert docs[0].metadata == {"url": "a", "updated": True}
+
+
+def test_add_texts_grows_the_matrix_beyond_its_initial_capacity():
+    store = _store(initial_capacity=2)
+    store.add_texts(["x3"], metadatas=[{"url": "c"}], ids=["5"])
+
+    assert len(store) == 5
+    assert store._matrix.shape[0] >= 5
+    assert _texts(store.similarity_search("z", k=1)) == ["z"]
+    assert _texts(store.similarity_search("x", k=5))[:3] == ["x", "x2", "x3"]
+
+
+def test_get_and_delete_by_url():
+    store = _store()
+
+    assert sorted(store.get(where={"url": {"$in": ["a"]}})["ids"]) == ["1", "3"]
+    store.delete(ids=["1"])
+
+    assert len(store) == 3
+    assert store.get(ids=["1", "2"])["ids"] == ["2"]
+    docs = store.similarity_search("x", k=1, filter={"url": {"$in": ["a"]}})
+    assert _texts(docs) == ["y"]
+
+
+def test_max_marginal_relevance_search_prefers_diverse_documents():
+    store = _store()
+    store.add_texts(["x3"], metadatas=[{"url": "c"}], ids=["5"])
+
+    relevant = store.max_marginal_relevance_search_by_vector(
+        [1.0, 0.0, 0.0], k=2, fetch_k=5, lambda_mult=1.0
+    )
+    diverse = store.max_marginal_relevance_search_by_vector(
+        [1.0, 0.0, 0.0], k=2, fetch_k=5, lambda_mult=0.3
+    )
+
+    assert _texts(relevant)[0] == "x"
+    assert _texts(relevant)[1] in ("x2", "x3")
+    assert _texts(diverse)[0] == "x"
+    assert _texts(diverse)[1] in ("y", "z")
@@ -0,0 +1,90 @@
+import asyncio
+import os
+
+import pytest
+
+import pubmed
+from config import Config
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "pmc")
+FIXTURES = sorted(name[:-len(".html")] for name in os.listdir(FIXTURES_DIR))
+
+
+def _read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, f"{name}.html"), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_lxml_parser_matches_bs4_parser(name):
+    pytest.importorskip("lxml.html")
+    html = _read_fixture(name)
+    url = pubmed.ARTICLE_BASE_URL + name
+
+    expected = pubmed._parse_article_html(html, url, "bs4").to_dict()
+    actual = pubmed._parse_article_html(html, url, "lxml").to_dict()
+
+    assert actual.keys() == expected.keys()
+    for field in expected:
+        assert actual[field] == expected[field], field
+
+
+@pytest.mark.parametrize("html_parser", ["bs4", "lxml"])
+def test_parse_article_with_xml_declaration_and_section_abstract(html_parser):
+    if html_parser == "lxml":
+        pytest.importorskip("lxml.html")
+    article = pubmed._parse_article_html(
+        _read_fixture("PMC7843064"), pubmed.ARTICLE_BASE_URL + "PMC7843064", html_parser
+    )
+
+    assert article.title == "Myocarditis after COVID–19 vaccination: a case series"
+    assert article.doi == "10.1016/j.jcvm.2021.01.004"
+    assert article.publication_year == 2021
+    assert article.authors == ("Anna B. Smith", "Mikko Virtanen", "Ciara O’Neil")
+    assert article.abstract.startswith("Myocarditis has been reported")
+    assert article.abstract.count("\n\n") == 2
+    # the abstract is a section of its own
+    assert article.texts[0] == article.abstract.split("\n\n")[0]
+    assert "We thank the patients." not in article.texts
+
+
+@pytest.mark.parametrize("html_parser", ["bs4", "lxml"])
+def test_parse_article_without_abstract(html_parser):
+    if html_parser == "lxml":
+        pytest.importorskip("lxml.html")
+    article = pubmed._parse_article_html(
+        _read_fixture("PMC8112233"), pubmed.ARTICLE_BASE_URL + "PMC8112233", html_parser
+    )
+
+    assert article.abstract is None
+    assert article.publication_year == 2018
+    assert article.authors == ("Jin Lee", "Lucía García", "Stroke Study Group")
+    assert len(article.texts) == 5
+
+
+def test_apubmed_document_search_cancels_scrapes_when_a_search_fails(monkeypatch):
+    scrape_cancelled = asyncio.Event()
+
+    async def search(query_string, config, http_client):
+        if query_string == "failing":
+            await asyncio.sleep(0.01)
+            raise RuntimeError("search failed")
+        return ["https://example.org/article"]
+
+    async def scrape(url, http_client, config, cache=None):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            scrape_cancelled.set()
+            raise
+
+    monkeypatch.setattr(pubmed, "_asearch_article_urls", search)
+    monkeypatch.setattr(pubmed, "_ascrape_article", scrape)
+    config = Config(pubmed_backend="html", use_article_cache=False)
+
+    async def main():
+        with pytest.raises(RuntimeError, match="search failed"):
+            await pubmed.apubmed_document_search(["working", "failing"], config)
+        assert scrape_cancelled.is_set()
+
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+import pytest
+
+import benchmark
+import http_util
+import pubmed
+import pubmed_eutils
+import rate_limiting
+from config import Config
+
+
+@pytest.fixture(scope="module")
+def stub():
+    store = benchmark.FixtureStore(n_articles=50, n_paragraphs=3)
+    article_base_url = pubmed.ARTICLE_BASE_URL
+    search_base_url = pubmed.SEARCH_BASE_URL
+    process, eutils_base_url = benchmark.start_stub_server(store)
+    yield store, eutils_base_url
+    process.terminate()
+    pubmed.ARTICLE_BASE_URL = article_base_url
+    pubmed.SEARCH_BASE_URL = search_base_url
+
+
+def test_eutils_document_search_per_query(stub):
+    store, eutils_base_url = stub
+    config = Config(
+        n_articles_per_query=4,
+        eutils_base_url=eutils_base_url,
+        eutils_batch_size=3,
+        ncbi_api_key="test",
+    )
+    query_strings = ["covid myocarditis", "statin stroke"]
+    http_client = http_util.get_http_client(config)
+
+    articles_per_query = pubmed_eutils.eutils_document_search_per_query(
+        query_strings, config, http_client
+    )
+
+    assert list(articles_per_query) == query_strings
+    for query_string, articles in articles_per_query.items():
+        urls = pubmed._parse_search_results(
+            store.search_page(query_string), 4, query_string
+        )
+        # the E-utilities backend finds the same articles as the HTML backend
+        expected = [
+            pubmed._parse_article_html(
+                store.article_page(pubmed._pmid_from_url(url)), url
+            )
+            for url in urls
+        ]
+        assert len(articles) == 4
+        assert [article.to_dict() for article in articles] == [
+            article.to_dict() for article in expected
+        ]
+    stats = http_client.stats()
+    assert stats["eutils_esearch"]["requests"] == 2
+    # 8 articles in batches of 3
+    assert stats["eutils_elink"]["requests"] == 3
+    assert stats["eutils_efetch"]["requests"] == 3
+
+
+def test_eutils_rate_limit_depends_on_api_key(monkeypatch):
+    monkeypatch.delenv("NCBI_API_KEY", raising=False)
+    bucket = pubmed_eutils._get_bucket(Config())
+    assert bucket.capacity == 3
+    assert bucket.rate == 3
+    bucket = pubmed_eutils._get_bucket(Config(ncbi_api_key="test"))
+    assert bucket.capacity == 10
+    assert bucket.rate == 10
+    assert pubmed_eutils._get_bucket(Config(ncbi_api_key="other")) is bucket
+
+
+def test_token_bucket_capacity_limits_bursts():
+    bucket = rate_limiting.TokenBucket(180, capacity=3)
+    assert [bucket.reserve(1) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve(1) == pytest.approx(1 / 3, abs=0.01)
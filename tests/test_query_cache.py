@@ -0,0 +1,85 @@
+import asyncio
+import threading
+
+import benchmark
+import caching
+import query_cache
+from query_translation import QueryTranslationTool, QueryTranslator
+
+
+class LockCheckingEmbeddings(benchmark.FakeEmbeddings):
+    def __init__(self):
+        super().__init__()
+        self.cache = None
+        self.locked_calls = 0
+
+    def embed_documents(self, texts):
+        if self.cache is not None and self.cache._lock.locked():
+            self.locked_calls += 1
+        return super().embed_documents(texts)
+
+
+def _query_cache(tmp_path, embeddings):
+    cache = caching.PersistentCache(str(tmp_path / "queries.sqlite"))
+    return query_cache.QueryCache(
+        cache,
+        "model",
+        "prompt",
+        embeddings=embeddings,
+        similarity_threshold=0.9,
+    )
+
+
+def test_similarity_index_is_embedded_outside_the_lock(tmp_path):
+    embeddings = LockCheckingEmbeddings()
+    cache = _query_cache(tmp_path, embeddings)
+    embeddings.cache = cache
+    cache.cache.set(
+        cache._key("statin use lowers stroke risk"),
+        {"sentence": "statin use lowers stroke risk", "query_strings": ["statin"]},
+    )
+
+    assert cache.get("Statin use lowers stroke risk in the elderly") is None
+    assert cache.get("Statin use lowers stroke risk ") == ["statin"]
+    cache.set("covid vaccine myocarditis", ["covid myocarditis"])
+    assert cache.get("covid vaccine myocarditis.") == ["covid myocarditis"]
+
+    assert cache._keys is not None
+    assert embeddings.locked_calls == 0
+
+
+class ThreadRecordingCache:
+    def __init__(self):
+        self.threads = []
+        self.entries = {}
+
+    def get(self, sentence):
+        self.threads.append(threading.get_ident())
+        return self.entries.get(sentence)
+
+    def set(self, sentence, query_strings):
+        self.threads.append(threading.get_ident())
+        self.entries[sentence] = query_strings
+
+    def stats(self):
+        return {}
+
+
+def test_acall_reads_and_writes_the_cache_outside_the_event_loop():
+    runnable = benchmark.fake_assistant_runnable_factory()(
+        "prompt", [QueryTranslationTool], None
+    )
+    cache = ThreadRecordingCache()
+    translator = QueryTranslator(runnable, cache=cache)
+    state = {"input_sentence": "Statin use lowers stroke risk"}
+
+    async def translate_twice():
+        first = await translator.acall(state)
+        second = await translator.acall(state)
+        return threading.get_ident(), first, second
+
+    loop_thread, first, second = asyncio.run(translate_twice())
+
+    assert first == second == {"query_strings": ["statin stroke"]}
+    assert len(cache.threads) == 3
+    assert loop_thread not in cache.threads
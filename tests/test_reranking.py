@@ -0,0 +1,38 @@
+from langchain_core.documents import Document
+
+import reranking
+from config import Config
+
+
+def _docs():
+    return [
+        Document(page_content="Diabetes is common in the elderly."),
+        Document(page_content="Statin use lowers the risk of stroke."),
+        Document(page_content="Statins lower cholesterol."),
+        Document(page_content="Stroke risk rises with age."),
+        Document(page_content="Statin therapy after stroke lowers the stroke risk."),
+    ]
+
+
+def test_rerank_keeps_n_docs_grade_best_documents():
+    config = Config(reranker="bm25", n_docs_retrival=10, n_docs_grade=2)
+
+    docs = reranking.rerank(_docs(), "Statin use and stroke risk", config)
+
+    assert [doc.page_content for doc in docs] == [
+        "Statin use lowers the risk of stroke.",
+        "Statin therapy after stroke lowers the stroke risk.",
+    ]
+
+
+def test_rerank_drops_documents_below_min_score():
+    config = Config(reranker="bm25", n_docs_grade=5, rerank_min_score=0.1)
+
+    docs = reranking.rerank(_docs(), "Statin use and stroke risk", config)
+
+    # without stemming, "Statins" doesn't match "Statin" either
+    assert [doc.page_content for doc in docs] == [
+        "Statin use lowers the risk of stroke.",
+        "Statin therapy after stroke lowers the stroke risk.",
+        "Stroke risk rises with age.",
+    ]
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from caching import PersistentCache
+from search_util import Article
+
+TEXTS = [
+    pytest.param([], id="no-texts"),
+    pytest.param(["", "First paragraph.", "", "Last."], id="empty-texts"),
+    pytest.param(
+        ["Café, naïve façade.", "β-blockers ≥ 5 mg", "😷 masks 🦠", "é"],
+        id="unicode",
+    ),
+]
+
+
+def _article(texts, authors=("Doe J", "Roe R")):
+    return Article(
+        title="Statins and stroke",
+        doi="10.1000/xyz",
+        publication_year=2020,
+        authors=authors,
+        abstract="Abstract.",
+        texts=texts,
+        url="https://example.org/PMC1/",
+    )
+
+
+@pytest.mark.parametrize("texts", TEXTS)
+def test_texts_round_trip(texts):
+    article = _article(texts)
+
+    assert article.texts == texts
+    assert article.n_texts == len(texts)
+
+
+def test_texts_that_could_not_be_parsed_are_empty():
+    article = _article(None)
+
+    assert article.texts == []
+    assert article.n_texts == 0
+
+
+@pytest.mark.parametrize("texts", TEXTS)
+def test_to_dict_from_dict_is_lossless(texts):
+    d = _article(texts).to_dict()
+
+    restored = Article.from_dict(json.loads(json.dumps(d)))
+
+    assert restored.to_dict() == d
+    assert restored.texts == texts
+    assert restored.authors == ("Doe J", "Roe R")
+
+
+def test_to_dict_from_dict_keeps_missing_fields():
+    article = Article(
+        title=None, doi=None, publication_year=None, authors=None, abstract=None,
+        texts=None, url="https://example.org/PMC1/",
+    )
+
+    restored = Article.from_dict(article.to_dict())
+
+    assert restored.to_dict() == article.to_dict()
+    assert restored.authors is None
+    assert restored.texts == []
+
+
+@pytest.mark.parametrize("texts", TEXTS)
+def test_cached_articles_round_trip(tmp_path, texts):
+    article = _article(texts)
+    cache = PersistentCache(str(tmp_path / "articles.sqlite"))
+    cache.set("1", article.to_dict())
+
+    restored = Article.from_dict(cache.get("1"))
+
+    assert restored == article
+    assert restored.to_dict() == article.to_dict()
+    assert restored.texts == texts
@@ -0,0 +1,101 @@
+import http.client
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+import server
+from instrumentation import Metrics
+from llm_util import LLMScheduler
+
+
+class BlockingFinder:
+    def __init__(self):
+        self.release = threading.Event()
+        self.llm_scheduler = LLMScheduler()
+
+    def search(self, input_sentence, return_mode):
+        self.release.wait(timeout=10)
+        return {"input_sentence": input_sentence, "docs": [], "metrics": Metrics()}
+
+
+@pytest.fixture
+def citation_server():
+    finder = BlockingFinder()
+    httpd = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), server.CitationRequestHandler
+    )
+    httpd.daemon_threads = True
+    httpd.service = server.CitationService(finder, max_concurrency=1, max_queue_size=1)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd, finder
+    finder.release.set()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _post(port, body, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    conn.putrequest("POST", "/search")
+    for name, value in (headers or {}).items():
+        conn.putheader(name, value)
+    conn.endheaders(body)
+    resp = conn.getresponse()
+    result = resp.status, dict(resp.getheaders()), json.loads(resp.read())
+    conn.close()
+    return result
+
+
+def _search(port, sentence):
+    body = json.dumps({"sentence": sentence}).encode("utf-8")
+    return _post(port, body, {"Content-Length": str(len(body))})
+
+
+def test_requests_beyond_the_queue_are_rejected(citation_server):
+    httpd, finder = citation_server
+    port = httpd.server_port
+    results = {}
+
+    def search(sentence):
+        results[sentence] = _search(port, sentence)
+
+    threads = [
+        threading.Thread(target=search, args=(sentence,))
+        for sentence in ("first sentence", "second sentence")
+    ]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while httpd.service.stats()["requests"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    status, headers, body = _search(port, "third sentence")
+    assert status == 503
+    assert headers["Retry-After"] == str(server.RETRY_AFTER)
+    assert body == {"error": "Too many pending requests"}
+
+    finder.release.set()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert [results[sentence][0] for sentence in results] == [200, 200]
+    stats = httpd.service.stats()
+    assert stats["rejected"] == 1
+    assert stats["active"] == stats["queued"] == 0
+
+
+@pytest.mark.parametrize(
+    "headers, status",
+    [
+        ({}, 411),
+        ({"Content-Length": "abc"}, 400),
+        ({"Content-Length": "-1"}, 400),
+        ({"Content-Length": str(server.MAX_BODY_BYTES + 1)}, 413),
+    ],
+)
+def test_invalid_content_length_is_rejected(citation_server, headers, status):
+    httpd, _ = citation_server
+
+    assert _post(httpd.server_port, None, headers)[0] == status